@@ -0,0 +1,120 @@
+"""
+This program compares the memory allocated per image when the images are
+summed up for the radial average of the background, before (a new mask and
+a masked copy of the data per image) and after (in-place sums in
+preallocated buffers with BackgroundSum), on synthetic Pilatus 6M and
+Eiger 16M sized images.
+
+The memory allocated while one image is added is measured with tracemalloc,
+after the sums already hold one image. It can be run from the root of the
+repository:
+
+    python -m benchmarks.benchmark_background_sum
+"""
+from __future__ import absolute_import, division, print_function
+
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+
+from src.iolite.ice_ring.background_sum import BackgroundSum
+
+# name, image size (fast, slow)
+IMAGES = [("Pilatus 6M", (2463, 2527)), ("Eiger 16M", (4150, 4371))]
+
+
+def synthetic_image(x_dim, y_dim, seed=0):
+    """
+    This function writes an image of random counts, a mask of valid pixels
+    and the indices of strong spot pixels.
+
+    :param int x_dim: width of the image
+    :param int y_dim: height of the image
+    :param int seed: seed of the random numbers
+
+    :returns: data, mask and strong spot pixels of the image
+    """
+    rng = np.random.RandomState(seed)
+    data = rng.poisson(2, size=(y_dim, x_dim)).astype(np.int32)
+    mask = np.ones((y_dim, x_dim), dtype=bool)
+    mask[:, ::100] = False
+    strong = rng.choice(y_dim * x_dim, 20000, replace=False)
+    return data, mask, strong
+
+
+class SumBefore:
+    """ A class that sums up images like summed_data_mask did before."""
+
+    def __init__(self, y_dim, x_dim):
+        """
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        """
+        self.y_dim = y_dim
+        self.x_dim = x_dim
+        self.summed_data = None
+        self.summed_mask = None
+
+    def add(self, data, mask, strong_pixels):
+        """
+        This function adds one image to the sums.
+
+        :param numpy array data: pixel values of the image
+        :param numpy array mask: valid pixels of the image
+        :param numpy array strong_pixels: indices of the strong spot pixels
+        """
+        mask_array = np.zeros((self.y_dim, self.x_dim), dtype=bool)
+        mask_array.reshape(-1)[strong_pixels] = True
+        mask_array = ~mask_array
+        mask_combined = np.logical_and(mask, mask_array).astype(np.int64)
+        temp = data * mask_combined
+        if self.summed_data is None:
+            self.summed_data = temp
+            self.summed_mask = mask_combined
+        else:
+            self.summed_data += temp
+            self.summed_mask += mask_combined
+
+
+def measure(summation, image):
+    """
+    This function measures the memory allocated and the time taken while
+    one image is added.
+
+    :param summation: SumBefore or BackgroundSum holding one image
+    :param tuple image: data, mask and strong spot pixels of the image
+
+    :returns: peak memory allocated in bytes and time in seconds
+    """
+    tracemalloc.start()
+    start = timer()
+    summation.add(*image)
+    end = timer()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, end - start
+
+
+def run():
+    """
+    This function runs the benchmark and prints the results.
+    """
+    mb = 1024 ** 2
+    for name, (x_dim, y_dim) in IMAGES:
+        image = synthetic_image(x_dim, y_dim)
+        print(name)
+        for label, summation in [
+            ("before", SumBefore(y_dim, x_dim)),
+            ("after", BackgroundSum(y_dim, x_dim)),
+        ]:
+            summation.add(*image)
+            peak, time_taken = measure(summation, image)
+            print(
+                "  %-7s %8.1f MB allocated per image, %6.3f s per image"
+                % (label + ":", peak / mb, time_taken)
+            )
+
+
+if __name__ == "__main__":
+    run()
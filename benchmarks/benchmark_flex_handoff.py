@@ -0,0 +1,112 @@
+"""
+This program compares the time and the Python memory taken to hand the
+average image and the mask of radial_average_bg to flex, before (through
+Python lists with tolist) and after (directly from the contiguous numpy
+arrays), on synthetic Pilatus 6M and Eiger 16M sized images.
+
+The Python memory is measured with tracemalloc, which sees the temporary
+lists but not the memory of the flex arrays themselves. It needs to be run
+with dials.python from the root of the repository:
+
+    dials.python -m benchmarks.benchmark_flex_handoff
+"""
+from __future__ import absolute_import, division, print_function
+
+import tracemalloc
+from timeit import default_timer as timer
+
+import numpy as np
+
+from dials.array_family import flex
+
+# name, image size (fast, slow)
+IMAGES = [("Pilatus 6M", (2463, 2527)), ("Eiger 16M", (4150, 4371))]
+
+
+def handoff_before(average, final_mask):
+    """
+    This function hands the arrays to flex through Python lists, like
+    radial_average_bg did before. The lists are flat and the flex arrays
+    are reshaped to the image afterwards.
+
+    :param numpy array average: 2D float64 array of the average image
+    :param numpy array final_mask: 2D bool array of the valid pixels
+
+    :returns: flex.double and flex.bool arrays
+    """
+    grid = flex.grid(*average.shape)
+    data = flex.double(average.reshape(-1).tolist())
+    data.reshape(grid)
+    mask = flex.bool(final_mask.reshape(-1).tolist())
+    mask.reshape(grid)
+    return data, mask
+
+
+def handoff_after(average, final_mask):
+    """
+    This function hands the arrays to flex like radial_average_bg does now.
+
+    :param numpy array average: 2D float64 array of the average image
+    :param numpy array final_mask: 2D bool array of the valid pixels
+
+    :returns: flex.double and flex.bool arrays
+    """
+    return (
+        flex.double(np.ascontiguousarray(average, dtype=np.float64)),
+        flex.bool(np.ascontiguousarray(final_mask, dtype=bool)),
+    )
+
+
+def measure(function, *args):
+    """
+    This function measures the time taken by a function and the peak of the
+    Python memory while it ran.
+
+    :param function function: function that is measured
+    :param args: arguments of the function
+
+    :returns: time in seconds, peak memory in bytes and the result
+    """
+    tracemalloc.start()
+    start = timer()
+    result = function(*args)
+    end = timer()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return end - start, peak, result
+
+
+def run():
+    """
+    This function runs the benchmark and prints the results.
+    """
+    mb = 1024 ** 2
+    for name, (x_dim, y_dim) in IMAGES:
+        rng = np.random.RandomState(0)
+        average = rng.uniform(0, 100, size=(y_dim, x_dim))
+        final_mask = rng.uniform(size=(y_dim, x_dim)) > 0.05
+
+        print(name)
+        results = []
+        for label, function in [("before", handoff_before), ("after", handoff_after)]:
+            time_taken, peak, result = measure(function, average, final_mask)
+            results.append(result)
+            print(
+                "  %-7s %7.3f s, %8.1f MB Python memory"
+                % (label + ":", time_taken, peak / mb)
+            )
+
+        # both ways give the same flex arrays
+        (data_before, mask_before), (data_after, mask_after) = results
+        assert np.array_equal(
+            data_before.as_numpy_array().reshape(-1),
+            data_after.as_numpy_array().reshape(-1),
+        )
+        assert np.array_equal(
+            mask_before.as_numpy_array().reshape(-1),
+            mask_after.as_numpy_array().reshape(-1),
+        )
+
+
+if __name__ == "__main__":
+    run()
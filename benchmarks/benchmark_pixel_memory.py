@@ -0,0 +1,132 @@
+"""
+This program compares the memory taken by the resolution map and the
+resolution bin index of every pixel in the pixel mode of overlapping_spots,
+before and after the bin index was stored in the smallest unsigned type
+and the resolution map was dropped after binning, on synthetic Pilatus 6M
+and Eiger 16M sized images.
+
+The memory is measured with tracemalloc. The previous way of binning (one
+Python int per pixel) is only measured on a strip of rows of the image and
+extrapolated to the full image, because it takes minutes on a full Eiger
+image. It can be run from the root of the repository:
+
+    python -m benchmarks.benchmark_pixel_memory
+"""
+from __future__ import absolute_import, division, print_function
+
+import tracemalloc
+
+import numpy as np
+
+from src.iolite.resolution_bins import bin_index
+
+# name, image size (fast, slow)
+IMAGES = [("Pilatus 6M", (2463, 2527)), ("Eiger 16M", (4150, 4371))]
+
+
+def synthetic_resolution(x_dim, y_dim):
+    """
+    This function writes a resolution (1/d^2) map that grows with the distance
+    of the pixels from the centre of the image.
+
+    :param int x_dim: width of the image
+    :param int y_dim: height of the image
+
+    :returns: 2D numpy array containing the resolutions (1/d^2)
+    """
+    y, x = np.ogrid[0:y_dim, 0:x_dim]
+    return 0.001 + ((x - x_dim / 2) ** 2 + (y - y_dim / 2) ** 2) * 1e-8
+
+
+def bins_before(x_dim, y_dim, num_bins):
+    """
+    This function bins the pixels like prepare_bins_pixel did before, with
+    one Python int per pixel, and keeps the resolution map.
+
+    :param int x_dim: width of the image
+    :param int y_dim: height of the image
+    :param int num_bins: number of resolution bins
+
+    :returns: resolution map and index array that are held during the run
+    """
+    resolution = synthetic_resolution(x_dim, y_dim)
+    vmin = np.amin(resolution)
+    vmax = np.amax(resolution)
+    intervall = (vmax - vmin) / (num_bins)
+
+    index_list = []
+    for d2 in resolution.reshape(-1):
+        if d2 == vmin:
+            index = 0
+        elif d2 == vmax:
+            index = num_bins - 1
+        else:
+            index = int((d2 - vmin - intervall / 2) / intervall)
+        index_list.append(index)
+    index_array = np.array(index_list)
+
+    return resolution, index_array
+
+
+def bins_after(x_dim, y_dim, num_bins):
+    """
+    This function bins the pixels like prepare_bins_pixel does now and
+    drops the resolution map.
+
+    :param int x_dim: width of the image
+    :param int y_dim: height of the image
+    :param int num_bins: number of resolution bins
+
+    :returns: index array that is held during the run
+    """
+    resolution = synthetic_resolution(x_dim, y_dim)
+    vmin = np.amin(resolution)
+    vmax = np.amax(resolution)
+    index_array = bin_index(resolution.reshape(-1), vmin, vmax, num_bins)
+    del resolution
+
+    return (index_array,)
+
+
+def measure(function, *args):
+    """
+    This function measures the memory held after a function returned and
+    the peak memory while it ran.
+
+    :param function function: function that is measured
+    :param args: arguments of the function
+
+    :returns: held and peak memory in bytes
+    """
+    tracemalloc.start()
+    held = function(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del held
+    return current, peak
+
+
+def run(num_bins=50, reference_rows=100):
+    """
+    This function runs the benchmark and prints the results.
+
+    :param int num_bins: number of resolution bins
+    :param int reference_rows: number of rows the previous way of binning
+                               is measured on
+    """
+    mb = 1024 ** 2
+    for name, (x_dim, y_dim) in IMAGES:
+        held_before, peak_before = measure(bins_before, x_dim, reference_rows, num_bins)
+        held_before *= y_dim / reference_rows
+        peak_before *= y_dim / reference_rows
+        held_after, peak_after = measure(bins_after, x_dim, y_dim, num_bins)
+
+        print(name, "(%d bins)" % num_bins)
+        print("  held before:  ~%8.1f MB" % (held_before / mb))
+        print("  held after:    %8.1f MB" % (held_after / mb))
+        print("  peak before:  ~%8.1f MB" % (peak_before / mb))
+        print("  peak after:    %8.1f MB" % (peak_after / mb))
+
+
+if __name__ == "__main__":
+    run()
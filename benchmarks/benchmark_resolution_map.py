@@ -0,0 +1,94 @@
+"""
+This program compares the time taken to compute the resolution (1/d^2) map
+of a panel with resolution_map (whole numpy arrays) and with
+resolution_map_per_pixel (one call of panel.get_resolution_at_pixel per
+pixel) on synthetic Pilatus 6M and Eiger 16M sized panels.
+
+The per pixel reference is only timed on a strip of rows of the panel and
+extrapolated to the full panel, because it takes minutes on a full Eiger
+panel. It needs to be run with dials.python from the root of the repository:
+
+    dials.python -m benchmarks.benchmark_resolution_map
+"""
+from __future__ import absolute_import, division, print_function
+
+from timeit import default_timer as timer
+
+import numpy as np
+
+from dxtbx.model import BeamFactory, DetectorFactory, ParallaxCorrectedPxMmStrategy
+from src.iolite.overlaps.resolution_map import (
+    resolution_map,
+    resolution_map_per_pixel,
+)
+
+# name, pixel size (mm), image size (fast, slow), sensor thickness (mm), mu (1/mm)
+PANELS = [
+    ("Pilatus 6M", (0.172, 0.172), (2463, 2527), 0.32, 3.96),
+    ("Eiger 16M", (0.075, 0.075), (4150, 4371), 0.45, 3.96),
+]
+
+
+def synthetic_models(pixel_size, image_size, thickness, mu, parallax):
+    """
+    This function creates a synthetic beam and a single panel detector with
+    the beam centre in the middle of the panel.
+
+    :param tuple pixel_size: size of a pixel in mm
+    :param tuple image_size: number of pixels along the fast and slow axis
+    :param float thickness: thickness of the sensor in mm
+    :param float mu: attenuation coefficient of the sensor in 1/mm
+    :param bool parallax: if True, the panel uses parallax correction
+
+    :returns: the panel and the beam
+    """
+    beam = BeamFactory.simple(0.9795)
+    beam_centre = (
+        image_size[0] * pixel_size[0] / 2,
+        image_size[1] * pixel_size[1] / 2,
+    )
+    detector = DetectorFactory.simple(
+        "PAD", 200.0, beam_centre, "+x", "-y", pixel_size, image_size, (-1, 1e6)
+    )
+    panel = detector[0]
+    if parallax:
+        panel.set_thickness(thickness)
+        panel.set_mu(mu)
+        panel.set_px_mm_strategy(ParallaxCorrectedPxMmStrategy(mu, thickness))
+    return panel, beam
+
+
+def run(reference_rows=50):
+    """
+    This function runs the benchmark and prints the results.
+
+    :param int reference_rows: number of rows the per pixel reference
+                               is timed on
+    """
+    for name, pixel_size, image_size, thickness, mu in PANELS:
+        for parallax in (False, True):
+            panel, beam = synthetic_models(
+                pixel_size, image_size, thickness, mu, parallax
+            )
+            x_dim, y_dim = image_size
+
+            start = timer()
+            resolution = resolution_map(panel, beam, x_dim, y_dim)
+            time_vectorized = timer() - start
+
+            start = timer()
+            reference = resolution_map_per_pixel(panel, beam, x_dim, reference_rows)
+            time_reference = (timer() - start) * y_dim / reference_rows
+
+            max_error = np.amax(
+                np.abs(resolution[:reference_rows] - reference) / reference
+            )
+            print(name, "(parallax corrected)" if parallax else "")
+            print("  resolution_map:            %.2f s" % time_vectorized)
+            print("  resolution_map_per_pixel: ~%.2f s" % time_reference)
+            print("  speed up:                  %.0fx" % (time_reference / time_vectorized))
+            print("  max. relative difference:  %.2e" % max_error)
+
+
+if __name__ == "__main__":
+    run()
@@ -18,6 +18,7 @@ def main():
             "bin/classify_sigma",
             "bin/classify_overlaps",
             "bin/overlapping_spots",
+            "bin/reaggregate_overlaps",
             "bin/label_dataset",
             "bin/plot_results_overlaps",
             "bin/sigma_values",
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+module load dials/latest
+
+dials.python /dls/science/users/gwx73773/iolite/src/iolite/overlaps/overlapping_spots.py --run_combined
@@ -0,0 +1,87 @@
+"""
+This module sums up the images of an imageset and the number of times each
+pixel was valid, leaving out masked pixels and strong spots, so that the
+images can be averaged for the radial average of the background.
+
+The sums are kept in buffers that are allocated once: the data in float64,
+which holds the sum of integer pixel values exactly up to 2^53 and cannot
+overflow on long sweeps, and the counts in uint32. Every image is added in
+place, so adding an image allocates no image-sized array.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+class BackgroundSum:
+    """ A class that adds up the valid pixels of images without allocating
+        memory per image."""
+
+    def __init__(self, y_dim, x_dim):
+        """
+        The sums are initialized with zeros for images of the given size.
+
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        """
+        self.summed_data = np.zeros((y_dim, x_dim), dtype=np.float64)
+        self.summed_mask = np.zeros((y_dim, x_dim), dtype=np.uint32)
+        self.valid = np.zeros((y_dim, x_dim), dtype=bool)
+
+    def add(self, data, mask, strong_pixels=None):
+        """
+        This function adds the valid pixels of one image to the sums.
+
+        :param numpy array data: 2D array of the pixel values of the image
+        :param numpy array mask: 2D bool array of the valid pixels of the image
+        :param numpy array strong_pixels: indices of the strong spot pixels in
+                                          the flattened image, which are left
+                                          out (default: None)
+        """
+        np.copyto(self.valid, mask)
+        if strong_pixels is not None:
+            self.valid.reshape(-1)[strong_pixels] = False
+
+        np.add(self.summed_data, data, out=self.summed_data, where=self.valid)
+        np.add(self.summed_mask, self.valid, out=self.summed_mask)
+
+    def merge(self, other):
+        """
+        This function adds the sums of another BackgroundSum to the sums.
+
+        :param BackgroundSum other: sums of other images of the same size
+        """
+        self.summed_data += other.summed_data
+        self.summed_mask += other.summed_mask
+
+
+def pairwise_sum(sums):
+    """
+    This function adds up partial sums of consecutive blocks of images by
+    pairwise reduction: neighbouring sums are merged, then neighbouring
+    merged sums, and so on. Sums are merged as soon as their partner is
+    available, so at most about log2(n) sums are kept at a time.
+
+    :param list sums: BackgroundSum of every block, in the order of the blocks
+
+    :returns: BackgroundSum of all blocks
+    """
+    # stack of merged sums and the number of merges they went through
+    stack = []
+    for background_sum in sums:
+        level = 0
+        while stack and stack[-1][0] == level:
+            _, previous = stack.pop()
+            previous.merge(background_sum)
+            background_sum = previous
+            level += 1
+        stack.append((level, background_sum))
+    assert stack, "No sums to add up"
+
+    # merge the remaining sums from right to left
+    _, total = stack.pop()
+    while stack:
+        _, previous = stack.pop()
+        previous.merge(total)
+        total = previous
+    return total
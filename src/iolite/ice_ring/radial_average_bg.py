@@ -1,8 +1,13 @@
 from __future__ import absolute_import, division, print_function
+import functools
 from dials.array_family import flex
 from dxtbx.model.experiment_list import ExperimentListFactory
 from timeit import default_timer as timer
 import numpy as np
+from src.iolite.ice_ring.background_sum import BackgroundSum, pairwise_sum
+from src.iolite.ice_ring.strong_spots import frame_pixels, strong_spot_pixels
+from src.iolite.overlaps.frame_pool import map_frames
+from src.iolite.overlaps.sampling import radical_inverse
 
 help_message = """
 
@@ -32,6 +37,28 @@ phil_scope = parse(
     .type = ints(size=2)
     .help = "The scan range to do the average over"
 
+  scan_step = 1
+    .type = int(value_min=1)
+    .help = "Only every scan_step-th image of the scan range is averaged"
+
+  max_images = None
+    .type = int(value_min=1)
+    .help = "The maximum number of images averaged, evenly spaced over the scan range"
+
+  adaptive {
+    enable = False
+      .type = bool
+      .help = "Add evenly spaced images until the radial average stops changing"
+
+    initial_images = 8
+      .type = int(value_min=1)
+      .help = "The number of images of the first radial average, which is doubled in every step"
+
+    tolerance = 0.01
+      .type = float(value_min=0)
+      .help = "The change of the radial average, relative to its maximum, below which no more images are added"
+  }
+
   num_bins = None
     .type = int(value_min=1)
     .help = "The number of bins (default = w+h of image)"
@@ -48,6 +75,10 @@ phil_scope = parse(
         .type = bool
         .help = "The boolean that determines if the average should be plotted."
 
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of processes, each summing up a block of consecutive images"
+
 """
 )
 
@@ -72,19 +103,98 @@ class Script:
             usage=usage, phil=phil_scope, epilog=help_message, read_experiments=True
         )
 
-    def init_list_of_objects(self, size):
-        """ Create a list of empty lists of length size.
-        
-        :param int size: length of the nested list
-        :returns: list of length size of empty lists  
+    def sum_block(self, imageset, pixels, offsets, y_dim, x_dim, block):
+        """
+        Sum up the data and the mask of a block of images, including 
+        masking of strong spots.
+
+        :param dxtbx_imageset_ext.ImageSweep imageset: imageset that
+         contains the raw data
+        :param numpy array pixels: strong spot pixels of all images
+        :param numpy array offsets: offset of the strong spot pixels of 
+         every image
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param list block: indices of the images of the block
+        :returns: BackgroundSum of the block
         """
+        background_sum = BackgroundSum(y_dim, x_dim)
+        for n in block:
+            data = imageset.get_raw_data(n)[0].as_numpy_array()
+            mask = imageset.get_mask(n)[0].as_numpy_array()
+            background_sum.add(data, mask, frame_pixels(pixels, offsets, n))
+        return background_sum
+
+    def select_images(self, scan_range, scan_step=1, max_images=None):
+        """
+        Select the images that are averaged: every scan_step-th image of
+        the scan range, of which at most max_images evenly spaced images
+        are kept.
 
-        list_of_objects = list()
-        for i in range(size):
-            list_of_objects.append(list())
-        return list_of_objects
+        :param tuple scan_range: range of images in the imageset
+        :param int scan_step: step between the selected images
+        :param int max_images: maximum number of images, all selected
+         images are kept if set to None
+        :returns: list of the indices of the selected images
+        """
+        images = list(range(scan_range[0], scan_range[1], scan_step))
+        if max_images is not None and len(images) > max_images:
+            positions = np.round(np.linspace(0, len(images) - 1, max_images))
+            images = [images[int(p)] for p in positions]
+        return images
 
-    def summed_data_mask(self, imageset, scan_range, shoebox):
+    def sum_images(self, imageset, pixels, offsets, images, y_dim, x_dim, nproc=1):
+        """
+        Sum up the data and the mask of images, including masking of strong
+        spots. The images are split into one block of consecutive images per
+        process and the sums of the blocks are added up pairwise, which gives
+        exactly the sums of one process.
+
+        :param dxtbx_imageset_ext.ImageSweep imageset: imageset that
+         contains the raw data
+        :param numpy array pixels: strong spot pixels of all images
+        :param numpy array offsets: offset of the strong spot pixels of 
+         every image
+        :param list images: indices of the images
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param int nproc: number of processes
+        :returns: BackgroundSum of the images
+        """
+        # Split the images into one block of consecutive images per process
+        block_size = -(-len(images) // nproc)
+        blocks = [
+            images[start : start + block_size]
+            for start in range(0, len(images), block_size)
+        ]
+
+        # add up the images, leaving out masked pixels and strong spots
+        sum_block = functools.partial(
+            self.sum_block, imageset, pixels, offsets, y_dim, x_dim
+        )
+        return pairwise_sum(map_frames(sum_block, blocks, nproc))
+
+    def strong_spots(self, shoebox, y_dim, x_dim, num_frames):
+        """
+        Find the strong spot pixels of all images, converting the mask of
+        each shoebox once.
+
+        :param list shoebox: list of all shoeboxes found in the imageset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param int num_frames: number of images
+        :returns: numpy arrays of the strong spot pixels and of the offset
+         of the strong spot pixels of every image
+        """
+        return strong_spot_pixels(
+            [sbox.bbox for sbox in shoebox],
+            (sbox.mask.as_numpy_array() for sbox in shoebox),
+            y_dim,
+            x_dim,
+            num_frames,
+        )
+
+    def summed_data_mask(self, imageset, images, shoebox, y_dim, x_dim, nproc=1):
         """
         Create numpy array of summed data and summed mask of an imageset,
         respectively, including masking of strong spots. 
@@ -92,59 +202,146 @@ class Script:
 
         :param dxtbx_imageset_ext.ImageSweep imageset: imageset that
          contains the raw data
-        :param tuple scan_range: range of images in the imageset
+        :param list images: indices of the images that are summed up
         :param list shoebox: list of all shoeboxes found in the imageset
-        :returns: numpy array summed_data and summed_mask
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param int nproc: number of processes
+        :returns: numpy array summed_data (float64) and summed_mask (uint32)
         """
+        pixels, offsets = self.strong_spots(shoebox, y_dim, x_dim, max(images) + 1)
+        background_sum = self.sum_images(
+            imageset, pixels, offsets, images, y_dim, x_dim, nproc
+        )
 
-        # get dimensions of the image
-        y_dim = imageset.get_raw_data(0)[0].all()[0]
-        x_dim = imageset.get_raw_data(0)[0].all()[1]
-
-        # create nested list of shoeboxes per image
-        _, _, _, _, _, z1 = shoebox[-1].bbox
-        image_shoebox_l = self.init_list_of_objects(z1)
-        for sbox in shoebox:
-            x0, x1, y0, y1, z0, z1 = sbox.bbox
-            for i in range(z0, z1):
-                image_shoebox_l[i].append(sbox)
-
-        summed_data = None
-        summed_mask = None
-
-        # Loop through images
-        for n in range(*scan_range):
-            mask_array = np.zeros((y_dim, x_dim), dtype=bool)
-            data = tuple(i.as_numpy_array() for i in imageset.get_raw_data(n))[0]
-            mask = tuple(m.as_numpy_array() for m in imageset.get_mask(n))[0]
-
-            # create strong spot mask of current image
-            for sbox in image_shoebox_l[n]:
-
-                x0, x1, y0, y1, z0, z1 = sbox.bbox
-                mask_sp = sbox.mask.as_numpy_array()
-                mask_sp_slice = mask_sp[n - z0, :, :]
-                true_pixels = mask_sp_slice == 5
-                mask_array[y0:y1, x0:x1] = np.logical_or(
-                    mask_array[y0:y1, x0:x1], true_pixels
-                )
+        return background_sum.summed_data, background_sum.summed_mask
+
+    def radial_average(
+        self, summed_data, summed_mask, num_images, beam, detector, params
+    ):
+        """
+        Average the summed images and make a radial average of the average
+        over resolution shells.
+
+        :param numpy array summed_data: summed data of the images
+        :param numpy array summed_mask: number of images each pixel was
+         valid on
+        :param int num_images: number of summed images
+        :param beam: beam model
+        :param detector: detector model
+        :param params: phil parameters
+        :returns: resolutions (1/d^2) and mean intensities of the shells,
+         and the average image
+        """
+        # calculate the average
+        average = np.zeros(summed_data.shape)
+        np.divide(summed_data, summed_mask, out=average, where=summed_mask > 0)
+
+        # pixels need to be valid on more than 5 images, or on all images 
+        # if fewer are averaged
+        final_mask = summed_mask > min(5, num_images - 1)
+
+        # filter out random high intensity pixels
+        from scipy.signal import medfilt
+
+        average = medfilt(average)
 
-            mask_array = ~mask_array
+        # Compute min and max and num
+        if params.num_bins is None:
+            num_bins = sum(sum(p.get_image_size()) for p in detector)
+        else:
+            num_bins = params.num_bins
+        if params.d_max is None:
+            vmin = 0
+        else:
+            vmin = (1.0 / params.d_max) ** 2
+        d_min = params.d_min
+        if d_min is None:
+            d_min = detector.get_max_resolution(beam.get_s0())
+        vmax = (1.0 / d_min) ** 2
+
+        # Compute the radial average
+        from dials.algorithms.background import RadialAverage
+
+        # the arrays are handed to flex directly, without going through
+        # Python lists
+        radial_average = RadialAverage(beam, detector, vmin, vmax, num_bins)
+        radial_average.add(
+            flex.double(np.ascontiguousarray(average, dtype=np.float64)),
+            flex.bool(np.ascontiguousarray(final_mask, dtype=bool)),
+        )
+        mean = radial_average.mean()
+        reso = radial_average.inv_d2()
 
-            #combine image mask and strong spot mak
-            mask_combined = np.logical_and(mask, mask_array).astype(np.int)
+        return reso, mean, average
 
-            # apply mask on data and sum data and mask up
-            temp = data * mask_combined
+    def adaptive_radial_average(
+        self, imageset, images, shoebox, y_dim, x_dim, beam, detector, params
+    ):
+        """
+        Make the radial average of more and more evenly spaced images,
+        doubling their number in every step, until the radial average 
+        changes by less than the tolerance relative to its maximum.
 
-            if summed_data is None:
-                summed_data = temp
-                summed_mask = mask_combined
-            else:
-                summed_data += temp
-                summed_mask += mask_combined
+        :param dxtbx_imageset_ext.ImageSweep imageset: imageset that
+         contains the raw data
+        :param list images: indices of the images that can be averaged
+        :param list shoebox: list of all shoeboxes found in the imageset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param beam: beam model
+        :param detector: detector model
+        :param params: phil parameters
+        :returns: resolutions (1/d^2) and mean intensities of the shells,
+         the average image and the number of images used
+        """
+        pixels, offsets = self.strong_spots(shoebox, y_dim, x_dim, max(images) + 1)
+
+        # every leading part of this order is spread over all images
+        order = [images[i] for i in sorted(range(len(images)), key=radical_inverse)]
+
+        background_sum = BackgroundSum(y_dim, x_dim)
+        num_images = 0
+        size = min(params.adaptive.initial_images, len(order))
+        previous = None
+        while True:
+            background_sum.merge(
+                self.sum_images(
+                    imageset,
+                    pixels,
+                    offsets,
+                    sorted(order[num_images:size]),
+                    y_dim,
+                    x_dim,
+                    params.nproc,
+                )
+            )
+            num_images = size
+            reso, mean, average = self.radial_average(
+                background_sum.summed_data,
+                background_sum.summed_mask,
+                num_images,
+                beam,
+                detector,
+                params,
+            )
+
+            # compare the radial average with the one of half the images
+            mean_array = mean.as_numpy_array()
+            if previous is not None:
+                scale = max(np.max(np.abs(previous)), np.finfo(float).tiny)
+                change = np.max(np.abs(mean_array - previous)) / scale
+                print(
+                    "Images: %d, change of radial average: %f" % (num_images, change)
+                )
+                if change < params.adaptive.tolerance:
+                    break
+            if num_images == len(order):
+                break
+            previous = mean_array
+            size = min(2 * size, len(order))
 
-        return summed_data, summed_mask
+        return reso, mean, average, num_images
 
     def run(self):
         """ Perform the integration."""
@@ -166,6 +363,7 @@ class Script:
         imageset = experiments[0].imageset
         beam = experiments[0].beam
         detector = experiments[0].detector
+        x_dim, y_dim = detector[0].get_image_size()
         reflections = flex.reflection_table.from_file(params.filename_refl) 
         shoebox = reflections["shoebox"]
 
@@ -182,19 +380,23 @@ class Script:
             if i0 >= i1:
                 raise RuntimeError("Invalid scan range")
 
-        # apply masks on data, sum up data and mask
-        summed_data, summed_mask = self.summed_data_mask(imageset, scan_range, shoebox)
+        # select the images of the scan range that are averaged
+        images = self.select_images(scan_range, params.scan_step, params.max_images)
 
-        # calculate the average
-        index = np.where(summed_mask > 0)
-        summed_data[index] = summed_data[index] / summed_mask[index]
-        average = summed_data
-        final_mask = summed_mask > 5
-
-        # filter out random high intensity pixels
-        from scipy.signal import medfilt
-
-        average = medfilt(average)
+        if params.adaptive.enable:
+            reso, mean, average, num_images = self.adaptive_radial_average(
+                imageset, images, shoebox, y_dim, x_dim, beam, detector, params
+            )
+        else:
+            # apply masks on data, sum up data and mask
+            summed_data, summed_mask = self.summed_data_mask(
+                imageset, images, shoebox, y_dim, x_dim, params.nproc
+            )
+            num_images = len(images)
+            reso, mean, average = self.radial_average(
+                summed_data, summed_mask, num_images, beam, detector, params
+            )
+        print("Number of images averaged:", num_images)
 
         # plot average
         if params.plot:
@@ -203,25 +405,6 @@ class Script:
             pylab.imshow(average)
             pylab.show()
 
-        # Compute min and max and num
-        if params.num_bins is None:
-            num_bins = sum(sum(p.get_image_size()) for p in detector)
-        if params.d_max is None:
-            vmin = 0
-        else:
-            vmin = (1.0 / d_max) ** 2
-        if params.d_min is None:
-            params.d_min = detector.get_max_resolution(beam.get_s0())
-        vmax = (1.0 / params.d_min) ** 2
-
-        # Compute the radial average
-        from dials.algorithms.background import RadialAverage
-
-        radial_average = RadialAverage(beam, detector, vmin, vmax, num_bins)
-        radial_average.add(flex.double(average.tolist()), flex.bool(final_mask))
-        mean = radial_average.mean()
-        reso = radial_average.inv_d2()
-
         # measure time taken
         end = timer()
         print("Time Taken:", end - start)
@@ -0,0 +1,64 @@
+"""
+This module finds the pixels of the strong spots on every image of an
+imageset, so that they can be masked before the images are averaged.
+
+The mask of every shoebox is converted once. The pixels whose mask value is
+5 (valid and foreground) are collected for all images in one pass and kept
+as one sorted array of pixel indices per image, stored back to back with
+the offset of the first pixel of each image. Masking the strong spots of an
+image is then a single fancy-indexed assignment.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+def strong_spot_pixels(bboxes, masks, y_dim, x_dim, num_frames):
+    """
+    This function finds the strong spot pixels of all images.
+
+    :param list bboxes: bounding boxes (x0, x1, y0, y1, z0, z1) of the shoeboxes
+    :param list masks: 3D numpy arrays of the masks of the shoeboxes
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+    :param int num_frames: number of images, pixels on later images are dropped
+
+    :returns: numpy array of the indices of the strong spot pixels in the
+              flattened image, sorted by image, and numpy array of the offset
+              of the first pixel of every image (length num_frames + 1)
+    """
+    num_pixels = y_dim * x_dim
+    keys = []
+    for (x0, x1, y0, y1, z0, z1), mask in zip(bboxes, masks):
+        z, y, x = np.nonzero(np.asarray(mask) == 5)
+        z = z + z0
+        y = y + y0
+        x = x + x0
+        inside = (z < num_frames) & (y >= 0) & (y < y_dim) & (x >= 0) & (x < x_dim)
+        keys.append(
+            (z[inside].astype(np.int64) * num_pixels) + y[inside] * x_dim + x[inside]
+        )
+
+    # pixels that belong to several shoeboxes are kept once
+    if keys:
+        keys = np.unique(np.concatenate(keys))
+    else:
+        keys = np.zeros(0, dtype=np.int64)
+    frames = keys // num_pixels
+    pixels = keys - frames * num_pixels
+    offsets = np.searchsorted(frames, np.arange(num_frames + 1))
+
+    return pixels, offsets
+
+
+def frame_pixels(pixels, offsets, n):
+    """
+    This function returns the strong spot pixels of one image.
+
+    :param numpy array pixels: result of strong_spot_pixels
+    :param numpy array offsets: result of strong_spot_pixels
+    :param int n: index of the image
+
+    :returns: numpy array of the indices of the pixels in the flattened image
+    """
+    return pixels[offsets[n] : offsets[n + 1]]
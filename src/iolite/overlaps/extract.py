@@ -28,9 +28,13 @@ dials.extract_shoeboxes models.expt observations.refl
 
 """
 
+import functools
+
+import numpy as np
 from libtbx.phil import parse
-from collections import defaultdict
 from dials.array_family import flex
+from src.iolite.overlaps.frame_pool import map_frames
+from src.iolite.overlaps.shoebox_store import ShoeboxStoreWriter, clear_store
 
 phil_scope = parse(
     """
@@ -38,7 +42,28 @@ phil_scope = parse(
     prefix = 'shoeboxes_'
       .type = str
       .help = "The integrated output filename"
+    format = *pickle store
+      .type = choice
+      .help = "Write one pickle file per image or one shoebox store"
+    store = 'shoeboxes'
+      .type = str
+      .help = "The directory of the shoebox store"
+    chunk_size = 100
+      .type = int(value_min=1)
+      .help = "The number of images per chunk of the shoebox store"
+    mask_only = False
+      .type = bool
+      .help = "Only save the bounding boxes, panels, resolutions and masks of"
+              "the shoeboxes, with the masks of the shoebox store as uint8"
   }
+  nproc = 1
+    .type = int(value_min=1)
+    .help = "The number of processes, each extracting a block of consecutive images"
+  streaming = False
+    .type = bool
+    .help = "Split the reflections into partials frame by frame while extracting,"
+            "instead of splitting all reflections up front, so that only the"
+            "partials of one frame are held in memory"
 """
 )
 
@@ -66,12 +91,125 @@ class Script(object):
             read_reflections=True,
         )
 
+    def remove_junk(self, reflections):
+        """ Remove reflections that were not integrated. """
+        reflections = reflections.select(reflections['id'] >= 0)
+        reflections = reflections.select(reflections['miller_index'] != (0,0,0))
+        reflections = reflections.select(reflections.get_flags(reflections.flags.integrated_sum))
+        return reflections
+
     def create_reflection_lookup(self, reflections):
-        lookup = defaultdict(flex.size_t)
-        for i, bbox in enumerate(reflections['bbox']):
-            assert bbox[5] == bbox[4]+1
-            lookup[bbox[4]].append(i)
-        return dict((key, reflections.select(value)) for key, value in lookup.iteritems())
+        # Sort the reflections by frame and cut the sorted list at each new frame
+        _, _, _, _, z0, z1 = reflections['bbox'].parts()
+        frames = z0.as_numpy_array()
+        assert np.all(z1.as_numpy_array() == frames + 1)
+        order = np.argsort(frames, kind='mergesort')
+        keys, first = np.unique(frames[order], return_index=True)
+        last = np.append(first[1:], len(order))
+        return dict(
+            (key, reflections.select(flex.size_t(order[i:j].tolist())))
+            for key, i, j in zip(keys.tolist(), first, last)
+        )
+
+    def lookup_frames(self, reflection_lookup, first, last):
+        """ Generate the reflections of the frames of a block from the lookup. """
+        for frame in range(first, last):
+            yield reflection_lookup[frame]
+
+    def stream_frames(self, reflections, first, last):
+        """ Generate the partials of the frames of a block in frame order,
+        splitting only the reflections that are recorded on the current frame.
+        The partials are the same as those of reflections.split_partials(),
+        with the junk removed. """
+        _, _, _, _, z0, z1 = [p.as_numpy_array() for p in reflections['bbox'].parts()]
+        assert np.all(z1 > z0)
+        split = np.any(z1 - z0 > 1)
+
+        # Reflections sorted by their first frame
+        order = np.argsort(z0, kind='mergesort')
+        starts = z0[order]
+
+        # Reflections that are recorded on the first frame of the block
+        active = np.flatnonzero((z0 <= first) & (z1 > first))
+        next_start = np.searchsorted(starts, first, side='right')
+
+        for frame in range(first, last):
+            # add the reflections that start on this frame and drop the ones
+            # that ended on the frame before
+            stop = np.searchsorted(starts, frame, side='right')
+            active = np.concatenate([active[z1[active] > frame], order[next_start:stop]])
+            next_start = stop
+            indices = np.sort(active)
+
+            # Split the reflections into the partials of this frame
+            subset_reflections = reflections.select(flex.size_t(indices.tolist()))
+            if split:
+                x0, x1, y0, y1, _, _ = subset_reflections['bbox'].parts()
+                n = len(subset_reflections)
+                subset_reflections['bbox'] = flex.int6(
+                    x0, x1, y0, y1, flex.int(n, frame), flex.int(n, frame + 1)
+                )
+                subset_reflections['partial_id'] = flex.size_t(indices.tolist())
+
+            yield self.remove_junk(subset_reflections)
+
+    def mask_only_reflections(self, reflections):
+        """ Reduce a reflection table to the bounding boxes, panels,
+        resolutions and the masks of the shoeboxes. """
+        subset = flex.reflection_table()
+        for key in ("bbox", "panel", "d"):
+            subset[key] = reflections[key]
+
+        # Shoeboxes that contain only the mask
+        shoebox = flex.shoebox(reflections["panel"], reflections["bbox"], allocate=False)
+        for index, sbox in enumerate(reflections["shoebox"]):
+            shoebox[index].mask = sbox.mask
+        subset["shoebox"] = shoebox
+        return subset
+
+    def extract_block(self, block, experiments, frame_source, params):
+        """ Extract the shoeboxes of a block of consecutive frames. """
+        first, last = block
+        imageset = experiments[0].imageset
+
+        # Each block writes its own chunks of the shoebox store
+        if params.output.format == "store":
+            mask_dtype = np.uint8 if params.output.mask_only else np.int32
+            writer = ShoeboxStoreWriter(
+                params.output.store, first, params.output.chunk_size, mask_dtype
+            )
+
+        # Loop through frames and get the subset on each frame
+        for frame, subset_reflections in zip(
+            range(first, last), frame_source(first, last)
+        ):
+
+            # Allocate the shoeboxes
+            subset_reflections["shoebox"] = flex.shoebox(
+                subset_reflections["panel"], subset_reflections["bbox"], allocate=True
+            )
+
+            # Extract the shoeboxes
+            subset_reflections.extract_shoeboxes(imageset[frame:frame+1], verbose=True)
+
+            # Compute the mask
+            subset_reflections.compute_mask(experiments)
+            if params.output.mask_only:
+                subset_reflections = self.mask_only_reflections(subset_reflections)
+
+            # Saving the reflections to disk
+            if params.output.format == "store":
+                logger.info("Saving %d reflections to %s" % (len(subset_reflections), params.output.store))
+                writer.append_reflections(subset_reflections)
+            else:
+                filename = "%s%d.pickle" % (params.output.prefix, frame)
+                logger.info("Saving %d reflections to %s" % (len(subset_reflections), filename))
+                subset_reflections.as_pickle(filename)
+
+        if params.output.format == "store":
+            writer.close()
+
+        return last - first
 
     def run(self):
         """ Extract the shoeboxes. """
@@ -121,39 +259,44 @@ class Script(object):
         scan = imageset.get_scan()
         frame0, frame1 = scan.get_array_range()
 
-        # Split reflections into individual frames
+        # Split reflections into individual frames, either while extracting
+        # the frames or all at once
         del reflections['shoebox']
-        reflections.split_partials()
-
-        # Remove junk
-        reflections = reflections.select(reflections['id'] >= 0)
-        reflections = reflections.select(reflections['miller_index'] != (0,0,0))
-        reflections = reflections.select(reflections.get_flags(reflections.flags.integrated_sum))
-
-        # Create a lookup of frame -> reflection table
-        reflection_lookup = self.create_reflection_lookup(reflections)
-
-        # Loop through frames
-        for frame in range(len(imageset)):
-       
-            # Get the subset on this frame
-            subset_reflections = reflection_lookup[frame]
-
-            # Allocate the shoeboxes
-            subset_reflections["shoebox"] = flex.shoebox(
-                subset_reflections["panel"], subset_reflections["bbox"], allocate=True
-            )
-                        
-            # Extract the shoeboxes
-            subset_reflections.extract_shoeboxes(imageset[frame:frame+1], verbose=True)
-
-            # Compute the mask
-            subset_reflections.compute_mask(experiments)
-
-            # Saving the reflections to disk
-            filename = "%s%d.pickle" % (params.output.prefix, frame)
-            logger.info("Saving %d reflections to %s" % (len(subset_reflections), filename))
-            subset_reflections.as_pickle(filename)
+        if params.streaming:
+            frame_source = functools.partial(self.stream_frames, reflections)
+        else:
+            reflections.split_partials()
+
+            # Remove junk
+            reflections = self.remove_junk(reflections)
+
+            # Create a lookup of frame -> reflection table
+            reflection_lookup = self.create_reflection_lookup(reflections)
+            frame_source = functools.partial(self.lookup_frames, reflection_lookup)
+
+        # Split the frames into one block of consecutive frames per process
+        num_frames = len(imageset)
+        block_size = -(-num_frames // params.nproc)
+        blocks = [
+            (first, min(first + block_size, num_frames))
+            for first in range(0, num_frames, block_size)
+        ]
+
+        # Remove the chunks of an earlier store, the blocks only add chunks
+        if params.output.format == "store":
+            clear_store(params.output.store)
+
+        # Extract the blocks
+        extract_block = functools.partial(
+            self.extract_block,
+            experiments=experiments,
+            frame_source=frame_source,
+            params=params,
+        )
+        for block, num_extracted in zip(
+            blocks, map_frames(extract_block, blocks, params.nproc)
+        ):
+            logger.info("Extracted frames %d to %d" % (block[0], block[1] - 1))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,60 @@
+"""
+This module distributes the images of a dataset to a pool of processes.
+The results of the images are returned in the order of the images, so that
+adding them up gives the same result as processing the images one after
+another.
+"""
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+
+# function that processes one image in a worker process
+_frame_function = None
+
+
+def _init_worker(function):
+    """
+    This function stores the function that processes one image in a
+    worker process, so that it is only passed once per process.
+
+    :param function function: function that takes the index of an image
+    """
+    global _frame_function
+    _frame_function = function
+
+
+def _run_worker(z):
+    """
+    This function processes one image in a worker process.
+
+    :param int z: index of the image
+
+    :returns: result of the function for the image
+    """
+    return _frame_function(z)
+
+
+def map_frames(function, frames, nproc):
+    """
+    This function applies a function to every image and yields the results
+    in the order of the images. If nproc is larger than one, the images are
+    processed in parallel by a pool of nproc processes.
+
+    :param function function: function that takes the index of an image
+    :param list frames: indices of the images
+    :param int nproc: number of processes
+
+    :returns: generator of the results of the images
+    """
+    if nproc <= 1:
+        for z in frames:
+            yield function(z)
+        return
+
+    pool = multiprocessing.Pool(nproc, _init_worker, (function,))
+    try:
+        for result in pool.imap(_run_worker, frames):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -1,4 +1,4 @@
-import itertools
+import functools
 from timeit import default_timer as timer
 
 import matplotlib.pyplot as plt
@@ -8,13 +8,62 @@ from matplotlib import pylab
 from dials.array_family import flex
 from dxtbx.model.experiment_list import ExperimentListFactory
 from dials.util.options import flatten_experiments
+from src.iolite.overlaps.frame_pool import map_frames
+from src.iolite.overlaps.predicted_shoeboxes import PredictedShoeboxes
+from src.iolite.overlaps.prefetch import FramePrefetcher
+from src.iolite.overlaps.sampling import (
+    MIN_FRAMES,
+    mean_and_interval,
+    sample_frames,
+)
+from src.iolite.overlaps.rasterize import (
+    ShoeboxMasks,
+    bbox_pairs,
+    count_overlaps_per_shoebox,
+    overlapping_pairs,
+    sparse_bg_and_fg,
+)
+from src.iolite.overlaps.resolution_cache import ResolutionCache
+from src.iolite.overlaps.shoebox_store import ShoeboxStore
+from src.iolite.overlaps.resolution_map import (
+    VECTORIZED_STRATEGIES,
+    geometry_key,
+    resolution_map,
+    resolution_map_per_pixel,
+)
+from src.iolite.resolution_bins import bin_centres, bin_index, bin_sum, bin_weight
+
+# names of the raw overlap counts per shoebox and per pixel in the .npz file
+RAW_SHOEBOX_COLUMNS = ("d", "fg_fg", "fg_bg", "bg_fg", "bg_bg")
+RAW_PIXEL_COLUMNS = ("pixel_bg", "pixel_fg", "pixel_bg_fg")
+# number of raw overlap counts per pixel kept before they are merged per pixel
+RAW_PIXEL_MERGE = 1 << 24
 
 
 class OverlapCounter:
     """ A class that counts the overlaps of shoeboxes of spots on imagesets. 
         The overlaps can be counted either per pixel or per shoebox."""
 
-    def __init__(self, inputfile, num_bins, outputfile_l, outputfile_t, run_shoeboxes):
+    def __init__(
+        self,
+        inputfile,
+        num_bins,
+        outputfile_l,
+        outputfile_t,
+        run_shoeboxes,
+        cache_dir=None,
+        cache_size=4096,
+        shoebox_engine="raster",
+        nproc=1,
+        run_combined=False,
+        reflections_file=None,
+        store=None,
+        raw_counts=None,
+        prefetch=0,
+        sample=None,
+        sample_method="even",
+        tolerance=None,
+    ):
         """
         The overlap counter is initialized with default settings
         for the filename to open, the number of resolution bins 
@@ -25,7 +74,10 @@ class OverlapCounter:
 
         :param str inputfile: name of expt file that contains the reflection 
                              table (default= "13_integrated.expt")
-        :param int num_bins: number of resolution bins (default:50)
+        :param num_bins: number of resolution bins, or list of numbers of 
+                         resolution bins the overlaps are binned to in the 
+                         same pass through the images, with one set of 
+                         output files per number of bins (default:50)
         :param str outputfile_l: name of outputfile written containing overlaps 
                                 per resolution bin (default: overlap_lists)
         :param str outputfile_t: name of outputfile written containing average 
@@ -33,32 +85,115 @@ class OverlapCounter:
         :param bool run_shoeboxes: The boolean which decides whether overlaps
                                    per shoebox should be run. If set to False,
                                    overlaps per pixel will be run. (default:True)
+        :param str cache_dir: directory of the cache for resolution maps and
+                              resolution bin indices, no cache is used if
+                              set to None (default: None)
+        :param int cache_size: maximum size of the cache in MB (default: 4096)
+        :param str shoebox_engine: the way overlaps per shoebox are counted, 
+                                   either "raster" (all shoeboxes of an image
+                                   at once) or "pairwise" (one overlapping 
+                                   pair after the other) (default: "raster")
+        :param int nproc: number of processes the images are distributed to
+                          (default: 1)
+        :param bool run_combined: The boolean which decides whether overlaps
+                                  per shoebox and per pixel should be run 
+                                  together in one pass through the images.
+                                  (default: False)
+        :param str reflections_file: name of the refl file the shoebox masks 
+                                     are computed from instead of reading
+                                     them from the pickle files of extract.py,
+                                     no image is read if set (default: None)
+        :param str store: directory of the shoebox store written by extract.py
+                          the shoeboxes are read from instead of the pickle 
+                          files (default: None)
+        :param str raw_counts: name of the .npz file the raw overlap counts per
+                               shoebox and per pixel are saved to, so that they
+                               can be aggregated again for other resolution 
+                               bins, they are not saved if set to None 
+                               (default: None)
+        :param int prefetch: number of images whose shoeboxes are loaded in
+                             the background while an image is processed, 
+                             only used with one process, the images are 
+                             loaded one after another if set to 0 
+                             (default: 0)
+        :param float sample: fraction of the images the overall overlap 
+                             ratios are estimated from, with confidence 
+                             intervals, all images are counted if set to None
+                             (default: None)
+        :param str sample_method: the way the images of the sample are chosen,
+                                  either "even" (evenly spaced) or "random"
+                                  (default: "even")
+        :param float tolerance: width of the 95% confidence intervals at which
+                                the estimate stops before the whole sample is
+                                counted, the whole sample is counted if set to 
+                                None (default: None)
         """
         self.inputfile = inputfile
-        self.num_bins = num_bins
+        if np.ndim(num_bins) == 0:
+            num_bins = [num_bins]
+        self.bin_counts = [int(n) for n in num_bins]
+        self.num_bins = self.bin_counts[0]
         self.outputfile_l = outputfile_l
         self.outputfile_t = outputfile_t
         self.run_shoeboxes = run_shoeboxes
+        self.shoebox_engine = shoebox_engine
+        self.nproc = nproc
+        self.run_combined = run_combined
+        self.reflections_file = reflections_file
+        self.predicted_shoeboxes = None
+        self.store = store
+        self.shoebox_store = None
+        self.raw_counts = raw_counts
+        self.prefetch = prefetch
+        self.sample = sample
+        self.sample_method = sample_method
+        self.tolerance = tolerance
+        self.raw_shoebox = []
+        self.raw_pixel = []
+        self.resolution_maps = {}
+        self.cache = None
+        self.cache_key = None
+        if cache_dir is not None:
+            self.cache = ResolutionCache(cache_dir, cache_size * 1024 ** 2)
 
     def np_resolution(self, x_dim, y_dim, panel, beam):
         """
         This function writes a 2D numpy array of the resolutions (1/d^2) 
-        corresponding to the pixels on the image.
+        corresponding to the pixels on the image. The array is computed 
+        once per panel and beam geometry and then reused.
 
         :param int x_dim: width of the image and resolution numpy array
         :param int y_dim: length of the image and resolution numpy array
-        :param   panel:
-        :param   beam:
+        :param   panel: dxtbx panel
+        :param   beam: dxtbx beam
 
         :returns: 2D numpy array containing the resolutions (1/d^2)
         """
-        resolution = np.zeros((y_dim, x_dim))
-        for y in range(y_dim):
-            for x in range(x_dim):
-                d = panel.get_resolution_at_pixel(beam.get_s0(), (x, y))
-                resolution[y, x] = 1 / d ** 2
+        key = geometry_key(panel, beam, x_dim, y_dim)
+        if key not in self.resolution_maps:
+            strategy = type(panel.get_px_mm_strategy()).__name__
+            if strategy in VECTORIZED_STRATEGIES:
+                resolution = resolution_map(panel, beam, x_dim, y_dim)
+            else:
+                resolution = resolution_map_per_pixel(panel, beam, x_dim, y_dim)
+            self.resolution_maps[key] = resolution
+
+        return self.resolution_maps[key]
+
+    def cached_array(self, name, compute):
+        """
+        This function returns an array that only depends on the geometry of
+        the dataset from the cache, or computes it if there is no cache
+        or the array is not in the cache yet.
+
+        :param str name: name of the array in the cache
+        :param function compute: function without arguments that returns the array
 
-        return resolution
+        :returns: numpy array
+        """
+        if self.cache is None or self.cache_key is None:
+            return compute()
+        return self.cache.get(self.cache_key, name, compute)
 
     def prepare_bins_shoebox(self, vmax, vmin, num_bins):
         """
@@ -74,16 +209,11 @@ class OverlapCounter:
 
 
         """
+        return bin_centres(vmin, vmax, num_bins)
 
-        d2_list = []
-        intervall = (vmax - vmin) / (num_bins)
-        for i in range(num_bins):
-            d2 = vmin + ((2 * i + 1) / 2) * intervall
-            d2_list.append(d2)
-
-        return d2_list, intervall
-
-    def assign_shoebox_to_resolution_bin(self, d2_shoebox, vmin, vmax, intervall):
+    def assign_shoebox_to_resolution_bin(
+        self, d2_shoebox, vmin, vmax, intervall, num_bins=None
+    ):
         """
         This function assigns a shoebox to a resolution bin by writing an index
         array, which contains the indices of the resolution bin in the resolution 
@@ -94,23 +224,16 @@ class OverlapCounter:
         :param float vmax: maximum resolution in 1/d^2
         :param float vmin: minimum resolution in 1/d^2
         :param float intervall: resolution intervall of the resolution bins
-        """
-
-        index_list = []
-        weight = [0] * self.num_bins
-        num_bins = self.num_bins
-        for d2 in d2_shoebox:
-            if d2 == vmin:
-                index = 0
-            elif d2 >= vmax:
-                index = num_bins - 1
-            else:
-                index = int((d2 - vmin - intervall / 2) / intervall)
-            index_list.append(index)
-
-            weight[index] += 1
+        :param int num_bins: number of resolution bins, the number of bins of
+                             the overlap counter is used if set to None
 
-        index_array = np.array(index_list)
+        :returns: 1D numpy array of indices in the resolution bin list, 
+                  list of weight of bins
+        """
+        if num_bins is None:
+            num_bins = self.num_bins
+        index_array = bin_index(d2_shoebox, vmin, vmax, num_bins)
+        weight = bin_weight(index_array, num_bins)
 
         return index_array, weight
 
@@ -127,114 +250,96 @@ class OverlapCounter:
                                     for each pixel
         
         :returns: list of average value of resolution bins, 1D numpy array of 
-                indices in the resolution bin list, list of weight of bins
-        """
-        d2_list = []
-        weight = [0] * num_bins
-        resolution_1d = resolution.reshape(-1)
-        index_list = []
-
-        intervall = (vmax - vmin) / (num_bins)
-
-        for i in range(num_bins):
-            d2 = vmin + ((2 * i + 1) / 2) * intervall
-            d2_list.append(d2)
-        for d2 in resolution_1d:
-            if d2 == vmin:
-                index = 0
-            elif d2 == vmax:
-                index = num_bins - 1
-            else:
-                index = int((d2 - vmin - intervall / 2) / intervall)
-            index_list.append(index)
+                indices in the resolution bin list (of the smallest unsigned 
+                type that holds num_bins), list of weight of bins
+        """
+        d2_list, intervall = self.prepare_bins_shoebox(vmax, vmin, num_bins)
 
-            weight[index] += 1
-        index_array = np.array(index_list)
+        index_array = self.cached_array(
+            "bin_index_%d" % num_bins,
+            lambda: bin_index(resolution.reshape(-1), vmin, vmax, num_bins),
+        )
+        weight = bin_weight(index_array, num_bins)
 
         return d2_list, index_array, weight
 
-    def write_bg_and_fg_mask(self, reflections, shoebox, y_dim, x_dim, z):
-        """This function writes masks (one for forground, one for background)
-        of the shape of the image that contain the counts of shoeboxes that 
-        have a foreground/background at the specific pixels.
+    def write_bg_and_fg_mask(self, bbox, masks, y_dim, x_dim, z, pairs=None):
+        """This function counts for the pixels in overlaps of shoeboxes how 
+        many shoeboxes have a foreground/background at the specific pixels.
+        The counts are only kept for the pixels the overlapping shoeboxes 
+        cover, not for the whole image.
 
-        :param dials_array_family_flex_ext.reflection_table reflections: reflection table
-        :param list shoeboxes: list that contains all shoeboxes on the image
+        :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+        :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
         :param int y_dim: height of the image
         :param int x_dim: width of the image
         :param int z: index of image in dataset
+        :param list pairs: pairs of overlapping shoeboxes, they are found 
+                           if set to None
 
-        :returns: masks of counts of background and foreground pixels in shoeboxes 
+        :returns: indices of the counted pixels on the image and counts of
+                  background and foreground pixels in shoeboxes at these pixels
         
         """
-        # Get the bounding box overlaps
-        bbox_overlaps = reflections.find_overlaps()
-
-        # create empty masks with the shape of the image
-        n_background = np.zeros(dtype=int, shape=(y_dim, x_dim))
-        n_foreground = np.zeros(dtype=int, shape=(y_dim, x_dim))
-
-        for edge in bbox_overlaps.edges():
-            # get indices of overlapping shoeboxes in the shoebox list
-            index1 = bbox_overlaps.source(edge)
-            index2 = bbox_overlaps.target(edge)
-
-            # avoid counting overlaps twice
-            if index1 > index2:
-                bbox1 = shoebox[index1].bbox
-                bbox2 = shoebox[index2].bbox
-                mask1 = shoebox[index1].mask.as_numpy_array()
-                mask2 = shoebox[index2].mask.as_numpy_array()
-
-                shoebox_mask = [mask1, mask2]
-                shoebox_bbox = [bbox1, bbox2]
-                indices = [index1, index2]
-
-                # calculate coordinates of overlap
-                x0 = max(bbox1[0], bbox2[0], 0)
-                x1 = min(bbox1[1], bbox2[1], x_dim)
-                y0 = max(bbox1[2], bbox2[2], 0)
-                y1 = min(bbox1[3], bbox2[3], y_dim)
-
-                assert x1 > x0
-                assert y1 > y0
-                # add background and foreground information of shoeboxes to overall masks
-                for mask, bbox, index in zip(shoebox_mask, shoebox_bbox, indices):
-                    x0m, x1m, y0m, y1m, z0m, _ = bbox
-                    sub_mask = mask[
-                        (z - z0m), (y0 - y0m) : (y1 - y0m), (x0 - x0m) : (x1 - x0m)
-                    ]
-                    n_background[y0:y1, x0:x1] += (sub_mask & 3) == 3
-                    n_foreground[y0:y1, x0:x1] += (sub_mask & 5) == 5
+        # Get the pairs of overlapping shoeboxes
+        if pairs is None:
+            pairs = bbox_pairs(bbox, y_dim, x_dim)
 
-                    # set submask values to zero to avoid counting shoeboxes double
-                    sub_mask[sub_mask == 3] = 0
-                    sub_mask[sub_mask == 5] = 0
-                    shoebox[index].mask = flex.int(mask)
+        # add background and foreground information of shoeboxes to the counts
+        pixels, n_background, n_foreground = sparse_bg_and_fg(
+            bbox, masks, pairs, y_dim, x_dim, z
+        )
 
-        return n_background, n_foreground
+        return pixels, n_background, n_foreground
 
-    def write_overlaps_per_shoebox(self, reflections, shoebox, y_dim, x_dim, z):
+    def write_overlaps_per_shoebox(
+        self, reflections, bbox, masks, y_dim, x_dim, z, pairs=None
+    ):
         """
         This function counts shoebox overlaps (background/background,
         foreground/foreground, foreground/background, background/foreground)
-        for each shoebox.
+        for each shoebox with the selected engine.
+
+        :param reflections: the reflection table, only used by the pairwise engine
+        :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+        :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
+        :param int y_dim: the height of the image
+        :param int x_dim: the width of the image
+        :param int z: the index of the current image
+        :param list pairs: pairs of overlapping shoeboxes, they are found 
+                           when needed if set to None
+
+        :returns: lists of the fg/fg,fg/bg,bg/fg and bg/bg overlaps per shoebox
+
+        """
+        if self.shoebox_engine == "pairwise":
+            return self.write_overlaps_per_shoebox_pairwise(
+                reflections, reflections["shoebox"], y_dim, x_dim, z, pairs
+            )
+        return count_overlaps_per_shoebox(bbox, masks, y_dim, x_dim, z)
+
+    def write_overlaps_per_shoebox_pairwise(
+        self, reflections, shoebox, y_dim, x_dim, z, pairs=None
+    ):
+        """
+        This function counts shoebox overlaps (background/background,
+        foreground/foreground, foreground/background, background/foreground)
+        for each shoebox by comparing the masks of each overlapping pair.
 
         :param reflections: the reflection table
         :param list shoebox: the list containing the shoeboxes on one image
         :param int y_dim: the height of the image
         :param int x_dim: the width of the image
         :param int z: the index of the current image
+        :param list pairs: pairs of overlapping shoeboxes, they are found 
+                           if set to None
 
         :returns: lists of the fg/fg,fg/bg,bg/fg and bg/bg overlaps per shoebox
 
         """
-        # Get the bounding box overlaps
-        bbox_overlaps = reflections.find_overlaps()
-
-        # create empty masks with the shape of the image
-        n_background = np.zeros(dtype=int, shape=(y_dim, x_dim))
-        n_foreground = np.zeros(dtype=int, shape=(y_dim, x_dim))
+        # Get the pairs of overlapping shoeboxes
+        if pairs is None:
+            pairs = overlapping_pairs(reflections)
 
         no_shoeboxes = len(shoebox)
         fg_fg = [0] * no_shoeboxes
@@ -243,66 +348,147 @@ class OverlapCounter:
         bg_bg = [0] * no_shoeboxes
 
         # loop through the overlaps
-        for edge in bbox_overlaps.edges():
-            # get indices of overlapping shoeboxes in the shoebox list
-            index1 = bbox_overlaps.source(edge)
-            index2 = bbox_overlaps.target(edge)
-
-            # avoid counting overlaps twice
-            if index1 > index2:
-                bbox1 = shoebox[index1].bbox
-                bbox2 = shoebox[index2].bbox
-                mask1 = shoebox[index1].mask.as_numpy_array()
-                mask2 = shoebox[index2].mask.as_numpy_array()
-
-                # calculate coordinates of overlap
-                x0 = max(bbox1[0], bbox2[0], 0)
-                x1 = min(bbox1[1], bbox2[1], x_dim)
-                y0 = max(bbox1[2], bbox2[2], 0)
-                y1 = min(bbox1[3], bbox2[3], y_dim)
-
-                assert x1 > x0
-                assert y1 > y0
-
-                x01, x11, y01, y11, z01, _ = bbox1
-                x02, x12, y02, y12, z02, _ = bbox2
-
-                # get submasks of both shoeboxes for the overlapping area
-                sub_mask1 = mask1[
-                    (z - z01), (y0 - y01) : (y1 - y01), (x0 - x01) : (x1 - x01)
-                ]
-                sub_mask2 = mask2[
-                    (z - z02), (y0 - y02) : (y1 - y02), (x0 - x02) : (x1 - x02)
-                ]
-
-                # create background and foreground masks for both shoeboxes
-                array1_fg = np.zeros(sub_mask1.shape, dtype=int)
-                array1_bg = np.zeros(sub_mask1.shape, dtype=int)
-                array2_fg = np.zeros(sub_mask2.shape, dtype=int)
-                array2_bg = np.zeros(sub_mask2.shape, dtype=int)
-
-                # detect foreground and background pixels on submasks
-                array1_fg += (sub_mask1 & 5) == 5
-                array2_fg += (sub_mask2 & 5) == 5
-                array1_bg += (sub_mask1 & 3) == 3
-                array2_bg += (sub_mask2 & 3) == 3
-
-                # count overlaps
-                fg_fg[index1] += np.any(np.logical_and(array1_fg, array2_fg))
-                fg_fg[index2] += np.any(np.logical_and(array1_fg, array2_fg))
-
-                bg_bg[index1] += np.any(np.logical_and(array1_bg, array2_bg))
-                bg_bg[index2] += np.any(np.logical_and(array1_bg, array2_bg))
-
-                fg_bg[index1] += np.any(np.logical_and(array1_fg, array2_bg))
-                fg_bg[index2] += np.any(np.logical_and(array1_bg, array2_fg))
-
-                bg_fg[index1] += np.any(np.logical_and(array1_bg, array2_fg))
-                bg_fg[index2] += np.any(np.logical_and(array1_fg, array2_bg))
+        for index1, index2 in pairs:
+            bbox1 = shoebox[index1].bbox
+            bbox2 = shoebox[index2].bbox
+            mask1 = shoebox[index1].mask.as_numpy_array()
+            mask2 = shoebox[index2].mask.as_numpy_array()
+
+            # calculate coordinates of overlap
+            x0 = max(bbox1[0], bbox2[0], 0)
+            x1 = min(bbox1[1], bbox2[1], x_dim)
+            y0 = max(bbox1[2], bbox2[2], 0)
+            y1 = min(bbox1[3], bbox2[3], y_dim)
+
+            assert x1 > x0
+            assert y1 > y0
+
+            x01, x11, y01, y11, z01, _ = bbox1
+            x02, x12, y02, y12, z02, _ = bbox2
+
+            # get submasks of both shoeboxes for the overlapping area
+            sub_mask1 = mask1[
+                (z - z01), (y0 - y01) : (y1 - y01), (x0 - x01) : (x1 - x01)
+            ]
+            sub_mask2 = mask2[
+                (z - z02), (y0 - y02) : (y1 - y02), (x0 - x02) : (x1 - x02)
+            ]
+
+            # create background and foreground masks for both shoeboxes
+            array1_fg = np.zeros(sub_mask1.shape, dtype=int)
+            array1_bg = np.zeros(sub_mask1.shape, dtype=int)
+            array2_fg = np.zeros(sub_mask2.shape, dtype=int)
+            array2_bg = np.zeros(sub_mask2.shape, dtype=int)
+
+            # detect foreground and background pixels on submasks
+            array1_fg += (sub_mask1 & 5) == 5
+            array2_fg += (sub_mask2 & 5) == 5
+            array1_bg += (sub_mask1 & 3) == 3
+            array2_bg += (sub_mask2 & 3) == 3
+
+            # count overlaps
+            fg_fg[index1] += np.any(np.logical_and(array1_fg, array2_fg))
+            fg_fg[index2] += np.any(np.logical_and(array1_fg, array2_fg))
+
+            bg_bg[index1] += np.any(np.logical_and(array1_bg, array2_bg))
+            bg_bg[index2] += np.any(np.logical_and(array1_bg, array2_bg))
+
+            fg_bg[index1] += np.any(np.logical_and(array1_fg, array2_bg))
+            fg_bg[index2] += np.any(np.logical_and(array1_bg, array2_fg))
+
+            bg_fg[index1] += np.any(np.logical_and(array1_bg, array2_fg))
+            bg_fg[index2] += np.any(np.logical_and(array1_fg, array2_bg))
 
         return fg_fg, fg_bg, bg_fg, bg_bg
 
-    def write_output_lists_pixel(self, res, total, bg, fg, bg_fg):
+    def overlaps_per_pixel(self, n_background, n_foreground, pixels=None):
+        """This function counts the background, foreground and 
+        background/foreground overlaps of each pixel that is part of at least 
+        two shoeboxes, as all other pixels have no overlaps.
+
+        :param numpy array n_background: counts of shoebox backgrounds per pixel
+        :param numpy array n_foreground: counts of shoebox foregrounds per pixel
+        :param numpy array pixels: indices of the pixels on the image the counts
+                                   belong to, the counts are given for every
+                                   pixel of the image if set to None
+
+        :returns: numpy arrays of the indices of the overlapping pixels on the 
+                  image and their background, foreground and 
+                  background/foreground overlap counts
+        """
+        n_background = n_background.reshape(-1)
+        n_foreground = n_foreground.reshape(-1)
+        overlapping = np.flatnonzero((n_background + n_foreground) > 1)
+
+        bg = n_background[overlapping].astype(np.int64)
+        fg = n_foreground[overlapping].astype(np.int64)
+        if pixels is not None:
+            overlapping = pixels[overlapping]
+
+        return overlapping, bg * (bg - 1) // 2, fg * (fg - 1) // 2, bg * fg
+
+    def bin_overlaps_per_pixel(self, overlaps, index_array, num_bins):
+        """This function adds the overlaps of the pixels to resolution bins.
+
+        :param tuple overlaps: result of overlaps_per_pixel
+        :param numpy array index_array: 1D numpy array of indices of the 
+                                        resolution bin of each pixel
+        :param int num_bins: number of resolution bins
+
+        :returns: numpy arrays of background, foreground and 
+                  background/foreground overlap counts per resolution bin
+        """
+        pixels, bg, fg, bg_fg = overlaps
+        index = index_array[pixels]
+
+        count_bg = bin_sum(index, bg, num_bins)
+        count_fg = bin_sum(index, fg, num_bins)
+        count_bg_fg = bin_sum(index, bg_fg, num_bins)
+
+        return count_bg, count_fg, count_bg_fg
+
+    def count_overlaps_per_bin(
+        self, n_background, n_foreground, index_array, num_bins, pixels=None
+    ):
+        """This function counts the background, foreground and 
+        background/foreground overlaps per resolution bin. Only pixels that are 
+        part of at least two shoeboxes are considered, as all other pixels 
+        have no overlaps.
+
+        :param numpy array n_background: counts of shoebox backgrounds per pixel
+        :param numpy array n_foreground: counts of shoebox foregrounds per pixel
+        :param numpy array index_array: 1D numpy array of indices of the 
+                                        resolution bin of each pixel
+        :param int num_bins: number of resolution bins
+        :param numpy array pixels: indices of the pixels on the image the counts
+                                   belong to, the counts are given for every
+                                   pixel of the image if set to None
+
+        :returns: numpy arrays of background, foreground and 
+                  background/foreground overlap counts per resolution bin
+        """
+        overlaps = self.overlaps_per_pixel(n_background, n_foreground, pixels)
+        return self.bin_overlaps_per_pixel(overlaps, index_array, num_bins)
+
+    def output_name(self, outputfile, kind, num_bins=None):
+        """This function returns the name of an output file. If the overlaps 
+        are binned to several numbers of resolution bins, the number of bins 
+        is added to the name.
+
+        :param str outputfile: outputfile_l or outputfile_t
+        :param str kind: "pixel" or "shoebox"
+        :param int num_bins: number of resolution bins, the first number of 
+                             bins of the overlap counter is used if set to None
+
+        :returns: name of the output file
+        """
+        if num_bins is None:
+            num_bins = self.num_bins
+        if len(self.bin_counts) > 1:
+            return "%s_%d_%s.txt" % (outputfile, num_bins, kind)
+        return "%s_%s.txt" % (outputfile, kind)
+
+    def write_output_lists_pixel(self, res, total, bg, fg, bg_fg, num_bins=None):
         """This function writes a text file containing the lists of the 
         average resolution of the bins and the overlaps per pixel per bin.
 
@@ -311,13 +497,16 @@ class OverlapCounter:
         :param list bg: list of background overlaps per bin
         :param list fg: list of foreground overlaps per bin
         :param list bg_fg: list of background foreground overlaps per bin
+        :param int num_bins: number of resolution bins (default: None)
         """
-        name_outfile = self.outputfile_l + "_pixel.txt"
+        name_outfile = self.output_name(self.outputfile_l, "pixel", num_bins)
         with open(name_outfile, "w") as outfile:
             for r, t, f, b, bf in zip(res, total, fg, bg, bg_fg):
                 outfile.write("%f, %f, %f, %f, %f\n" % (r, t, f, b, bf))
 
-    def write_output_total_pixel(self, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg):
+    def write_output_total_pixel(
+        self, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg, num_bins=None
+    ):
         """This function writes a text file containing the average 
            overlaps per pixel of the dataset.
 
@@ -325,6 +514,7 @@ class OverlapCounter:
         :param float ratio_bg: average background overlap ratio
         :param float ratio_fg: average foreground overlap ratio
         :param float ratio_bg_fg: average background foreground overlap ratio
+        :param int num_bins: number of resolution bins (default: None)
         """
 
         text = [
@@ -334,12 +524,14 @@ class OverlapCounter:
             "background foreground overlap ratio:",
         ]
         data = [ratio_total, ratio_fg, ratio_bg, ratio_bg_fg]
-        name_outfile = self.outputfile_t + "_pixel.txt"
+        name_outfile = self.output_name(self.outputfile_t, "pixel", num_bins)
         with open(name_outfile, "w") as outfile:
             for t, d in zip(text, data):
                 outfile.write("%s, %f\n" % (t, d))
 
-    def write_output_lists_shoebox(self, res, total_f, total_b, bg, fg, bg_fg, fg_bg):
+    def write_output_lists_shoebox(
+        self, res, total_f, total_b, bg, fg, bg_fg, fg_bg, num_bins=None
+    ):
         """This function writes a text file containing the lists of the 
         average resolution of the bins and the overlaps per shoebox per bin.
 
@@ -348,8 +540,9 @@ class OverlapCounter:
         :param list bg: list of background overlaps per bin
         :param list fg: list of foreground overlaps per bin
         :param list bg_fg: list of background foreground overlaps per bin
+        :param int num_bins: number of resolution bins (default: None)
         """
-        name_outfile = self.outputfile_l + "_shoebox.txt"
+        name_outfile = self.output_name(self.outputfile_l, "shoebox", num_bins)
         with open(name_outfile, "w") as outfile:
             for r, tf, tb, f, b, fb, bf in zip(
                 res, total_f, total_b, fg, bg, fg_bg, bg_fg
@@ -358,7 +551,9 @@ class OverlapCounter:
                     "%f, %f, %f, %f, %f, %f, %f\n" % (r, tf, tb, f, b, fb, bf)
                 )
 
-    def write_output_total_shoebox(self, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg):
+    def write_output_total_shoebox(
+        self, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg, num_bins=None
+    ):
         """This function writes a text file containing the average overlaps
         per shoebox of the dataset.
 
@@ -366,6 +561,7 @@ class OverlapCounter:
         :param float ratio_bg: average background overlap ratio
         :param float ratio_fg: average foreground overlap ratio
         :param float ratio_bg_fg: average background foreground overlap ratio
+        :param int num_bins: number of resolution bins (default: None)
         """
 
         text = [
@@ -375,23 +571,32 @@ class OverlapCounter:
             "background foreground overlap ratio:",
         ]
         data = [ratio_total, ratio_fg, ratio_bg, ratio_bg_fg]
-        name_outfile = self.outputfile_t + "_shoebox.txt"
+        name_outfile = self.output_name(self.outputfile_t, "shoebox", num_bins)
         with open(name_outfile, "w") as outfile:
             for t, d in zip(text, data):
                 outfile.write("%s, %f\n" % (t, d))
 
-    def prepare_data(self):
+    def prepare_data(self, check_format=None):
         """
         This function extracts dimensions of the imageset the resolutions
         per pixel and the minimum and maximum resolution of the imagesets from 
         the input file.
 
+        :param bool check_format: whether the format of the images is checked,
+                                  by default only if the shoeboxes are read 
+                                  from the pickle files
+
         :returns: number of images, width and height of the images, minimum and maximum 
         resolutions and a resolution list per pixel
 
         """
-        # get input from expt file
-        experiments = ExperimentListFactory.from_json_file(self.inputfile)
+        # get input from expt file, the format of the images is only checked
+        # if the shoeboxes are read from the pickle files
+        if check_format is None:
+            check_format = self.reflections_file is None
+        experiments = ExperimentListFactory.from_json_file(
+            self.inputfile, check_format=check_format
+        )
         assert len(experiments) == 1
         imageset = experiments[0].imageset
         beam = experiments[0].beam
@@ -399,143 +604,316 @@ class OverlapCounter:
         panel = detector[0]
 
         # get dimensions of the dataset
-        y_dim = imageset.get_raw_data(0)[0].all()[0]
-        x_dim = imageset.get_raw_data(0)[0].all()[1]
+        x_dim, y_dim = panel.get_image_size()
         z_dim = len(imageset)
 
+        # compute the shoeboxes from the reflection table instead of the images
+        if self.reflections_file is not None:
+            reflections = flex.reflection_table.from_file(self.reflections_file)
+            self.predicted_shoeboxes = PredictedShoeboxes(experiments, reflections)
+        elif self.store is not None:
+            self.shoebox_store = ShoeboxStore(self.store)
+
         print("Number of images in dataset:", z_dim)
 
-        # write resolution array
-        resolution = self.np_resolution(x_dim, y_dim, panel, beam)
+        # write resolution array, or read it from the cache
+        if self.cache is not None:
+            self.cache_key = self.cache.key(detector, beam)
+        resolution = self.cached_array(
+            "resolution", lambda: self.np_resolution(x_dim, y_dim, panel, beam)
+        )
         print("Read in resolutions.")
 
         # get vmin, vmx and number of bins
-        vmin = np.amin(resolution)
-        vmax = np.amax(resolution)
+        limits = self.cached_array(
+            "limits", lambda: np.array([np.amin(resolution), np.amax(resolution)])
+        )
+        vmin, vmax = limits
 
         return z_dim, y_dim, x_dim, vmin, vmax, resolution
 
-    def count_overlaps_per_reflection(self):
+    def load_shoeboxes(self, z):
         """
-        The function that counts overlaps per reflection.
+        This function loads the reflection table with the shoeboxes of one image
+        from its pickle file or the shoebox store, or computes it from the 
+        reflection file if one is given. Unless the pairwise engine is used,
+        the shoeboxes of the store are read as a dictionary of the numpy 
+        columns bbox, d and masks instead of a reflection table.
 
-        :returns:total overlpas ratio per shoebox, foreground overlap
-        ratio per shoebox, background overlap ratio per shoebox,
-        background/foredround overlap per shoebox
+        :param int z: index of the image in the dataset
+
+        :returns: reflection table or dictionary of the columns of the image
         """
-        start_main = timer()
-        # get dimensions of imageset and resolution values
-        z_dim, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data()
+        if self.predicted_shoeboxes is not None:
+            return self.predicted_shoeboxes.frame(z)
+        if self.shoebox_store is not None:
+            if self.shoebox_engine == "pairwise":
+                return self.shoebox_store.frame(z)
+            columns = self.shoebox_store.frame_columns(z, ("bbox", "d"))
+            columns["masks"] = self.shoebox_store.frame_masks(z)
+            return columns
+        filename = "shoeboxes_" + str(z) + ".pickle"
+        return flex.reflection_table.from_pickle(filename)
+
+    def shoebox_columns(self, reflections):
+        """
+        This function returns the bounding boxes, masks and resolutions of the
+        shoeboxes of one image as numpy arrays.
 
-        # prepare the bins
-        num_bins = self.num_bins
-        d2_list, intervall = self.prepare_bins_shoebox(vmax, vmin, num_bins)
+        :param reflections: reflection table or dictionary of the columns of 
+                            the image, as returned by load_shoeboxes
 
-        # prepare the lists containing the overall overlap counts and ratios
-        ratio_fg_fg = [0] * num_bins
-        ratio_fg_bg = [0] * num_bins
-        ratio_bg_fg = [0] * num_bins
-        ratio_bg_bg = [0] * num_bins
-        ratio_total_f = [0] * num_bins
-        ratio_total_b = [0] * num_bins
-        sum_fg_fg = [0] * num_bins
-        sum_fg_bg = [0] * num_bins
-        sum_bg_fg = [0] * num_bins
-        sum_bg_bg = [0] * num_bins
-        sum_total_f = [0] * num_bins
-        sum_total_b = [0] * num_bins
-
-        # loop through all images
-        for z in range(z_dim):
-            start = timer()
-
-            filename = "shoeboxes_" + str(z) + ".pickle"
-
-            # get shoeboxes and resolutions from pickle file
-            reflections = flex.reflection_table.from_pickle(filename)
-            resolution = reflections["d"].as_numpy_array()
-
-            d2_shoebox = np.array(map(lambda d: 1 / (d ** 2), resolution))
-
-            shoebox = reflections["shoebox"]
-            no_shoeboxes = len(shoebox)
-
-            # assign shoeboxes to resolution bins
-            index_array, weight = self.assign_shoebox_to_resolution_bin(
-                d2_shoebox, vmin, vmax, intervall
-            )
+        :returns: 2D numpy array of the bounding boxes, sequence of the 3D 
+                  numpy arrays of the masks and numpy array of the resolutions
+        """
+        if isinstance(reflections, dict):
+            return reflections["bbox"], reflections["masks"], reflections["d"]
+        bbox = np.stack([p.as_numpy_array() for p in reflections["bbox"].parts()], 1)
+        masks = ShoeboxMasks(reflections["shoebox"])
+        return bbox, masks, reflections["d"].as_numpy_array()
 
-            # count overlpas for each shoebox
-            fg_fg, fg_bg, bg_fg, bg_bg = self.write_overlaps_per_shoebox(
-                reflections, shoebox, y_dim, x_dim, z
-            )
+    def image_pairs(self, reflections, bbox, y_dim, x_dim):
+        """
+        This function finds the pairs of overlapping shoeboxes of one image,
+        with dials for the pairwise engine and from the bounding boxes 
+        otherwise.
 
-            # prepare lists containg overlap counts and ratio per image
-            ratio_fg_fg_im = [0] * num_bins
-            ratio_fg_bg_im = [0] * num_bins
-            ratio_bg_fg_im = [0] * num_bins
-            ratio_bg_bg_im = [0] * num_bins
-            ratio_total_f_im = [0] * num_bins
-            ratio_total_b_im = [0] * num_bins
-            sum_fg_fg_im = [0] * num_bins
-            sum_fg_bg_im = [0] * num_bins
-            sum_bg_fg_im = [0] * num_bins
-            sum_bg_bg_im = [0] * num_bins
-            sum_total_f_im = [0] * num_bins
-            sum_total_b_im = [0] * num_bins
-
-            # add counts to resolution bins
-            for f, fb, bf, b, i in zip(fg_fg, fg_bg, bg_fg, bg_bg, index_array):
-                if weight[i] > 0:
-                    ratio_fg_fg_im[i] += f / weight[i]
-                    ratio_fg_bg_im[i] += fb / weight[i]
-                    ratio_bg_fg_im[i] += bf / weight[i]
-                    ratio_bg_bg_im[i] += b / weight[i]
-                    ratio_total_f_im[i] += (f + fb + b) / weight[i]
-                    ratio_total_b_im[i] += (f + bf + b) / weight[i]
-                    sum_fg_fg_im[i] += f
-                    sum_fg_bg_im[i] += fb
-                    sum_bg_fg_im[i] += bf
-                    sum_bg_bg_im[i] += b
-                    sum_total_f_im[i] += f + fb + b
-                    sum_total_b_im[i] += f + bf + b
-                    ratio_fg_fg[i] += f / (weight[i] * z_dim)
-                    ratio_fg_bg[i] += fb / (weight[i] * z_dim)
-                    ratio_bg_fg[i] += bf / (weight[i] * z_dim)
-                    ratio_bg_bg[i] += b / (weight[i] * z_dim)
-                    ratio_total_f[i] += (f + fb + b) / (weight[i] * z_dim)
-                    ratio_total_b[i] += (f + bf + b) / (weight[i] * z_dim)
-                    sum_fg_fg[i] += f / (z_dim)
-                    sum_fg_bg[i] += fb / (z_dim)
-                    sum_bg_fg[i] += bf / (z_dim)
-                    sum_bg_bg[i] += b / (z_dim)
-                    sum_total_f[i] += (f + fb + b) / (z_dim)
-                    sum_total_b[i] += (f + bf + b) / (z_dim)
-
-            # calculate overall overlap ratios of the current image
-            overall_ratio_fg_fg_im = sum(sum_fg_fg_im) / no_shoeboxes
-            overall_ratio_fg_bg_im = sum(sum_fg_bg_im) / no_shoeboxes
-            overall_ratio_bg_fg_im = sum(sum_bg_fg_im) / no_shoeboxes
-            overall_ratio_bg_bg_im = sum(sum_bg_bg_im) / no_shoeboxes
-            overall_ratio_total_im = sum(sum_total_f_im) / no_shoeboxes
-
-            end = timer()
-
-            # print output
-            print("Image no.:", z + 1)
-            print("No. of shoeboxes:", no_shoeboxes)
-            print("total overlap ratio per shoebox", overall_ratio_total_im)
-            print("foreground overlap ratio per shoebox", overall_ratio_fg_fg_im)
-            print("background overlap ratio per shoebox", overall_ratio_bg_bg_im)
-            print(
-                "foreground background overlap ratio per shoebox",
-                overall_ratio_fg_bg_im,
-            )
-            print(
-                "background foreground overlap ratio per shoebox",
-                overall_ratio_bg_fg_im,
+        :param reflections: reflection table or dictionary of the columns of 
+                            the image
+        :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+
+        :returns: list of pairs of the indices of the overlapping shoeboxes
+        """
+        if self.shoebox_engine == "pairwise":
+            return overlapping_pairs(reflections)
+        return bbox_pairs(bbox, y_dim, x_dim)
+
+    def map_images(self, count_image, frames):
+        """
+        The function that applies the function that counts the overlaps on 
+        one image to every image, in the order of the images. With one 
+        process and prefetch set, the shoeboxes of the next images are 
+        loaded in the background while the current image is processed.
+
+        :param function count_image: function that takes the index of an 
+                                     image and optionally its reflection table
+        :param list frames: indices of the images
+
+        :returns: generator of the results of the images
+        """
+        if self.prefetch < 1 or self.nproc > 1:
+            for result in map_frames(count_image, frames, self.nproc):
+                yield result
+            return
+
+        prefetcher = FramePrefetcher(self.load_shoeboxes, frames, self.prefetch)
+        loaded = iter(prefetcher)
+        try:
+            for z, reflections in loaded:
+                yield count_image(z, reflections=reflections)
+        finally:
+            # stop the loading thread if the caller stops early
+            loaded.close()
+            prefetcher.report()
+
+    def count_overlaps_image_reflection(
+        self, z, y_dim, x_dim, vmin, vmax, z_dim, reflections=None, pairs=None
+    ):
+        """
+        The function that counts overlaps per reflection on one image.
+
+        :param int z: index of the image in the dataset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param float vmin: minimum resolution in 1/d^2
+        :param float vmax: maximum resolution in 1/d^2
+        :param int z_dim: number of images in the dataset
+        :param reflections: reflection table of the image, it is loaded 
+                            from its pickle file if set to None
+        :param list pairs: pairs of overlapping shoeboxes, they are found 
+                           when needed if set to None
+
+        :returns: number of shoeboxes on the image, lists of the overlap counts 
+                  per resolution bin of the image for the first number of bins,
+                  for every number of bins the lists of the contributions
+                  of the image to the overlap ratios and sums per resolution bin
+                  of the dataset, the time taken for the image and the raw 
+                  overlap counts per shoebox (None if they are not saved)
+        """
+        start = timer()
+
+        # get shoeboxes and resolutions from pickle file
+        if reflections is None:
+            reflections = self.load_shoeboxes(z)
+        bbox, masks, resolution = self.shoebox_columns(reflections)
+
+        d2_shoebox = 1 / resolution ** 2
+
+        no_shoeboxes = len(masks)
+
+        # count overlpas for each shoebox
+        counts = self.write_overlaps_per_shoebox(
+            reflections, bbox, masks, y_dim, x_dim, z, pairs
+        )
+
+        # add counts to the resolution bins of every number of bins
+        binned = [
+            self.aggregate_image_reflection(
+                d2_shoebox, counts, vmin, vmax, z_dim, num_bins
             )
-            print("Time taken: ", end - start)
+            for num_bins in self.bin_counts
+        ]
+        image_counts = binned[0][0]
+        dataset_counts = [counts_bins for _, counts_bins in binned]
+
+        # keep the raw counts of the shoeboxes
+        raw = None
+        if self.raw_counts is not None:
+            raw = (resolution,) + tuple(np.asarray(c, dtype=np.uint16) for c in counts)
+        end = timer()
+
+        return no_shoeboxes, image_counts, dataset_counts, end - start, raw
+
+    def aggregate_image_reflection(self, d2_shoebox, counts, vmin, vmax, z_dim, num_bins):
+        """
+        The function that adds the overlap counts of the shoeboxes on one 
+        image to resolution bins.
+
+        :param numpy array d2_shoebox: resolutions in 1/d^2 of the shoeboxes
+        :param tuple counts: lists of the fg/fg,fg/bg,bg/fg and bg/bg overlaps 
+                             per shoebox
+        :param float vmin: minimum resolution in 1/d^2
+        :param float vmax: maximum resolution in 1/d^2
+        :param int z_dim: number of images in the dataset
+        :param int num_bins: number of resolution bins
+
+        :returns: lists of the overlap counts per resolution bin of the image 
+                  and lists of the contributions of the image to the overlap 
+                  ratios and sums per resolution bin of the dataset
+        """
+        d2_list, intervall = self.prepare_bins_shoebox(vmax, vmin, num_bins)
+
+        # assign shoeboxes to resolution bins
+        index_array, weight = self.assign_shoebox_to_resolution_bin(
+            d2_shoebox, vmin, vmax, intervall, num_bins
+        )
+        weight = np.array(weight, dtype=np.float64)
+
+        # sum up the overlap counts of the shoeboxes per resolution bin
+        sum_fg_fg, sum_fg_bg, sum_bg_fg, sum_bg_bg = [
+            bin_sum(index_array, np.asarray(count, dtype=np.float64), num_bins)
+            for count in counts
+        ]
+        sum_total_f = sum_fg_fg + sum_fg_bg + sum_bg_bg
+        sum_total_b = sum_fg_fg + sum_bg_fg + sum_bg_bg
+        sums = [sum_fg_fg, sum_fg_bg, sum_bg_fg, sum_bg_bg, sum_total_f, sum_total_b]
+
+        # overlap ratios per shoebox of the bins, bins without shoeboxes stay 0
+        ratios = [
+            np.divide(count, weight, out=np.zeros(num_bins), where=weight > 0)
+            for count in sums
+        ]
+
+        # the counts of the image and its contributions to the overall 
+        # overlap ratios and sums of the dataset
+        image_counts = [count.tolist() for count in sums[:5]]
+        dataset_counts = [(ratio / z_dim).tolist() for ratio in ratios] + [
+            (count / z_dim).tolist() for count in sums
+        ]
+        return image_counts, dataset_counts
+
+    def add_counts(self, counts, counts_im):
+        """
+        The function that adds overlap counts per resolution bin of one image
+        to the counts of the dataset.
+
+        :param list counts: lists of overlap counts per resolution bin of the 
+                            dataset
+        :param list counts_im: lists of overlap counts per resolution bin of 
+                               the image
+        """
+        for count, count_im in zip(counts, counts_im):
+            for i in range(len(count)):
+                count[i] += count_im[i]
+
+    def sum_image_reflection(self, dataset_counts, z, result):
+        """
+        The function that adds the overlap counts per reflection of one image 
+        to the counts of the dataset and prints the overlap ratios of the image.
+
+        :param list dataset_counts: lists of the overlap ratios and sums per 
+                                    resolution bin of the dataset, for every
+                                    number of bins
+        :param int z: index of the image in the dataset
+        :param tuple result: result of count_overlaps_image_reflection
+
+        :returns: number of shoeboxes on the image
+        """
+        no_shoeboxes, image_counts, image_dataset_counts, time_taken, _ = result
+        for counts, counts_im in zip(dataset_counts, image_dataset_counts):
+            self.add_counts(counts, counts_im)
+
+        # calculate overall overlap ratios of the current image
+        sum_fg_fg_im, sum_fg_bg_im, sum_bg_fg_im, sum_bg_bg_im = image_counts[:4]
+        sum_total_f_im = image_counts[4]
+        overall_ratio_fg_fg_im = sum(sum_fg_fg_im) / no_shoeboxes
+        overall_ratio_fg_bg_im = sum(sum_fg_bg_im) / no_shoeboxes
+        overall_ratio_bg_fg_im = sum(sum_bg_fg_im) / no_shoeboxes
+        overall_ratio_bg_bg_im = sum(sum_bg_bg_im) / no_shoeboxes
+        overall_ratio_total_im = sum(sum_total_f_im) / no_shoeboxes
+
+        # print output
+        print("Image no.:", z + 1)
+        print("No. of shoeboxes:", no_shoeboxes)
+        print("total overlap ratio per shoebox", overall_ratio_total_im)
+        print("foreground overlap ratio per shoebox", overall_ratio_fg_fg_im)
+        print("background overlap ratio per shoebox", overall_ratio_bg_bg_im)
+        print(
+            "foreground background overlap ratio per shoebox",
+            overall_ratio_fg_bg_im,
+        )
+        print(
+            "background foreground overlap ratio per shoebox",
+            overall_ratio_bg_fg_im,
+        )
+        print("Time taken: ", time_taken)
+
+        return no_shoeboxes
+
+    def write_results_reflection(
+        self, dataset_counts, no_shoeboxes, d2_list, num_bins=None
+    ):
+        """
+        The function that calculates the overlap ratios per reflection of the
+        dataset, prints them and writes the output files.
+
+        :param list dataset_counts: lists of the overlap ratios and sums per 
+                                    resolution bin of the dataset
+        :param int no_shoeboxes: number of shoeboxes on the last image
+        :param list d2_list: list of average resolution of resolution bins
+        :param int num_bins: number of resolution bins, the first number of 
+                             bins of the overlap counter is used if set to None
+
+        :returns:total overlpas ratio per shoebox, foreground overlap
+        ratio per shoebox, background overlap ratio per shoebox,
+        background/foredround overlap per shoebox
+        """
+        (
+            ratio_fg_fg,
+            ratio_fg_bg,
+            ratio_bg_fg,
+            ratio_bg_bg,
+            ratio_total_f,
+            ratio_total_b,
+            sum_fg_fg,
+            sum_fg_bg,
+            sum_bg_fg,
+            sum_bg_bg,
+            sum_total_f,
+            sum_total_b,
+        ) = dataset_counts
 
         # calculate overall overlap ratios of the whole dataset
         overall_ratio_fg_fg = sum(sum_fg_fg) / no_shoeboxes
@@ -543,10 +921,11 @@ class OverlapCounter:
         overall_ratio_bg_fg = sum(sum_bg_fg) / no_shoeboxes
         overall_ratio_bg_bg = sum(sum_bg_bg) / no_shoeboxes
         overall_ratio_total = sum(sum_total_f) / no_shoeboxes
-        end_main = timer()
 
         # print output
         print("Overlap statistics for whole dataset:")
+        if len(self.bin_counts) > 1:
+            print("No. of resolution bins:", num_bins or self.num_bins)
         print("total overlap ratio per shoebox", overall_ratio_total)
         print("foreground overlap ratio per shoebox", overall_ratio_fg_fg)
         print("background overlap ratio per shoebox", overall_ratio_bg_bg)
@@ -562,15 +941,16 @@ class OverlapCounter:
             ratio_fg_fg,
             ratio_fg_bg,
             ratio_bg_fg,
+            num_bins,
         )
         self.write_output_total_shoebox(
             overall_ratio_total,
             overall_ratio_bg_bg,
             overall_ratio_fg_fg,
             overall_ratio_bg_fg,
+            num_bins,
         )
 
-        print("Time taken for imageset: ", end_main - start_main)
         return (
             overall_ratio_total,
             overall_ratio_fg_fg,
@@ -578,93 +958,195 @@ class OverlapCounter:
             overall_ratio_bg_fg,
         )
 
-    def count_overlaps_per_pixel(self):
-        """The function that counts the overlaps per pixel on an image dataset.
+    def write_results_reflection_bins(self, dataset_counts, no_shoeboxes, vmin, vmax):
+        """
+        The function that writes the results per reflection of the dataset 
+        for every number of resolution bins.
 
-        :returns: overall averages for the whole imageset (total, bg, fg, bg_fg)
+        :param list dataset_counts: lists of the overlap ratios and sums per 
+                                    resolution bin of the dataset, for every
+                                    number of bins
+        :param int no_shoeboxes: number of shoeboxes on the last image
+        :param float vmin: minimum resolution in 1/d^2
+        :param float vmax: maximum resolution in 1/d^2
+
+        :returns: overall averages of the first number of bins (total, fg, 
+                  bg, bg_fg)
+        """
+        overall = []
+        for num_bins, counts in zip(self.bin_counts, dataset_counts):
+            d2_list, _ = self.prepare_bins_shoebox(vmax, vmin, num_bins)
+            overall.append(
+                self.write_results_reflection(counts, no_shoeboxes, d2_list, num_bins)
+            )
+        return overall[0]
+
+    def count_overlaps_per_reflection(self):
+        """
+        The function that counts overlaps per reflection.
 
+        :returns:total overlpas ratio per shoebox, foreground overlap
+        ratio per shoebox, background overlap ratio per shoebox,
+        background/foredround overlap per shoebox
         """
         start_main = timer()
+        # get dimensions of imageset and resolution values
         z_dim, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data()
 
-        print(x_dim, y_dim)
-        num_bins = self.num_bins
-        # get bin labels(middle of resolution range) array with size of image with
-        # indices of bin the resolution is in and weight of each bin
-        d2_list, index_array, weight = self.prepare_bins_pixel(
-            vmax, vmin, num_bins, resolution
+        # only the resolution range of the resolution map is needed
+        del resolution
+        self.resolution_maps.clear()
+
+        # prepare the lists containing the overall overlap counts and ratios
+        # for every number of bins
+        dataset_counts = [
+            [[0] * num_bins for i in range(12)] for num_bins in self.bin_counts
+        ]
+
+        # loop through all images, the counts of the images are added up 
+        # in the order of the images
+        count_image = functools.partial(
+            self.count_overlaps_image_reflection,
+            y_dim=y_dim,
+            x_dim=x_dim,
+            vmin=vmin,
+            vmax=vmax,
+            z_dim=z_dim,
         )
-        print("Prepared bins.")
+        results = self.map_images(count_image, range(z_dim))
+        for z, result in enumerate(results):
+            no_shoeboxes = self.sum_image_reflection(dataset_counts, z, result)
+            self.collect_raw_reflection(result[4])
+
+        self.write_raw_counts(z_dim, y_dim, x_dim, vmin, vmax)
+        overall = self.write_results_reflection_bins(
+            dataset_counts, no_shoeboxes, vmin, vmax
+        )
+        end_main = timer()
 
-        count_bg = [0] * num_bins
-        count_fg = [0] * num_bins
-        count_bg_fg = [0] * num_bins
-        count_total = [0] * num_bins
+        print("Time taken for imageset: ", end_main - start_main)
+        return overall
 
-        # loop through all images
-        for z in range(z_dim):
-            start = timer()
-            filename = "shoeboxes_" + str(z) + ".pickle"
+    def count_overlaps_image_pixel(
+        self, z, y_dim, x_dim, index_arrays, reflections=None, pairs=None
+    ):
+        """The function that counts the overlaps per pixel on one image.
 
-            # get shoeboxes from pickle file
-            reflections = flex.reflection_table.from_pickle(filename)
-            shoebox = reflections["shoebox"]
+        :param int z: index of the image in the dataset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param list index_arrays: 1D numpy arrays of indices of the resolution
+                                  bin of each pixel, one for every number of 
+                                  bins of the overlap counter
+        :param reflections: reflection table of the image, it is loaded 
+                            from its pickle file if set to None
+        :param list pairs: pairs of overlapping shoeboxes, they are found 
+                           if set to None
+
+        :returns: number of shoeboxes on the image, background, foreground and 
+                  background/foreground overlap counts per resolution bin for
+                  every number of bins, the time taken for the image and the 
+                  raw overlap counts per pixel (None if they are not saved)
+        """
+        start = timer()
 
-            # write masks of background of shoeboxes and foreground of shoeboxes
-            n_background, n_foreground = self.write_bg_and_fg_mask(
-                reflections, shoebox, y_dim, x_dim, z
-            )
+        # get shoeboxes from pickle file
+        if reflections is None:
+            reflections = self.load_shoeboxes(z)
+        bbox, masks, _ = self.shoebox_columns(reflections)
 
-            # prepare lists that will contain count of different kinds of overlap
-            # per resolution bin for the current image
-            count_bg_im = [0] * len(d2_list)
-            count_fg_im = [0] * len(d2_list)
-            count_bg_fg_im = [0] * len(d2_list)
+        # count backgrounds and foregrounds of shoeboxes per pixel
+        pixels, n_background, n_foreground = self.write_bg_and_fg_mask(
+            bbox, masks, y_dim, x_dim, z, pairs
+        )
 
-            # fill lists of overlap counts
-            for bg, fg, index in itertools.izip(
-                n_background.reshape(-1), n_foreground.reshape(-1), index_array
-            ):
-                count_bg_im[index] += bg * (bg - 1) / 2
-                count_fg_im[index] += fg * (fg - 1) / 2
-                count_bg_fg_im[index] += bg * fg
-
-            bg_ratio_im = []
-            fg_ratio_im = []
-            bg_fg_ratio_im = []
-            total_ratio_im = []
-            bin = 0
-
-            # calculate ratios of overlaps (no. of overlaps in bin/no. of pixels in bin)
-            # add count of overlaps of image to overall counts
-            for b, f, bf, w in zip(count_bg_im, count_fg_im, count_bg_fg_im, weight):
-                bg_ratio_im.append(b / w)
-                fg_ratio_im.append(f / w)
-                bg_fg_ratio_im.append(bf / w)
-                total_ratio_im.append(b / w + f / w + bf / w)
+        # count the different kinds of overlap per resolution bin for the
+        # current image
+        overlaps = self.overlaps_per_pixel(n_background, n_foreground, pixels)
+        binned = [
+            self.bin_overlaps_per_pixel(overlaps, index_array, num_bins)
+            for index_array, num_bins in zip(index_arrays, self.bin_counts)
+        ]
+        count_bg_im, count_fg_im, count_bg_fg_im = zip(*binned)
+
+        # keep the raw counts of the pixels
+        raw = None
+        if self.raw_counts is not None:
+            raw = overlaps
+        end = timer()
+
+        return (
+            len(masks),
+            count_bg_im,
+            count_fg_im,
+            count_bg_fg_im,
+            end - start,
+            raw,
+        )
+
+    def sum_image_pixel(self, counts, z, result, weight):
+        """The function that adds the overlap counts per pixel of one image 
+        to the counts of the dataset and prints the overlap ratios of the image.
+
+        :param list counts: lists of the background, foreground,
+                            background/foreground and total overlap counts 
+                            per resolution bin of the dataset, for every 
+                            number of bins
+        :param int z: index of the image in the dataset
+        :param tuple result: result of count_overlaps_image_pixel
+        :param list weight: list of weight of bins of the first number of bins
+        """
+        no_shoeboxes, count_bg_bins, count_fg_bins, count_bg_fg_bins = result[:4]
+        time_taken = result[4]
+
+        # add count of overlaps of image to overall counts
+        for counts_bins, b_im, f_im, bf_im in zip(
+            counts, count_bg_bins, count_fg_bins, count_bg_fg_bins
+        ):
+            count_bg, count_fg, count_bg_fg, count_total = counts_bins
+            for bin, (b, f, bf) in enumerate(zip(b_im, f_im, bf_im)):
                 count_fg[bin] += f
                 count_bg[bin] += b
                 count_bg_fg[bin] += bf
                 count_total[bin] += b + f + bf
-                bin += 1
-
-            # print output
-            print("Image no.:", z + 1)
-            print("No. of shoeboxes:", len(shoebox))
-            print(
-                "total overlap ratio",
-                (sum(count_bg_im) + sum(count_fg_im) + sum(count_bg_fg_im))
-                / sum(weight),
-            )
-            print("foreground overlap ratio", sum(count_fg_im) / sum(weight))
-            print("background overlap ratio", sum(count_bg_im) / sum(weight))
-            print(
-                "background foreground overlap ratio", sum(count_bg_fg_im) / sum(weight)
-            )
 
-            end = timer()
+        # the ratios of the image do not depend on the bins
+        count_bg_im = count_bg_bins[0]
+        count_fg_im = count_fg_bins[0]
+        count_bg_fg_im = count_bg_fg_bins[0]
 
-            print("Time taken for image:", end - start)
+        # print output
+        print("Image no.:", z + 1)
+        print("No. of shoeboxes:", no_shoeboxes)
+        print(
+            "total overlap ratio",
+            (sum(count_bg_im) + sum(count_fg_im) + sum(count_bg_fg_im))
+            / sum(weight),
+        )
+        print("foreground overlap ratio", sum(count_fg_im) / sum(weight))
+        print("background overlap ratio", sum(count_bg_im) / sum(weight))
+        print(
+            "background foreground overlap ratio", sum(count_bg_fg_im) / sum(weight)
+        )
+
+        print("Time taken for image:", time_taken)
+
+    def write_results_pixel(self, counts, z_dim, d2_list, weight, num_bins=None):
+        """The function that calculates the overlap ratios per pixel of the
+        dataset, prints them and writes the output files.
+
+        :param list counts: lists of the background, foreground,
+                            background/foreground and total overlap counts 
+                            per resolution bin of the dataset
+        :param int z_dim: number of images in the dataset
+        :param list d2_list: list of average resolution of resolution bins
+        :param list weight: list of weight of bins
+        :param int num_bins: number of resolution bins, the first number of 
+                             bins of the overlap counter is used if set to None
+
+        :returns: overall averages for the whole imageset (total, bg, fg, bg_fg)
+        """
+        count_bg, count_fg, count_bg_fg, count_total = counts
 
         # ratio of overlaps per resolution bin
         ratio_total = []
@@ -686,10 +1168,10 @@ class OverlapCounter:
         ratio_bg_dataset = sum(count_bg) / (sum(weight) * z_dim)
         ratio_bg_fg_dataset = sum(count_bg_fg) / (sum(weight) * z_dim)
 
-        end_main = timer()
-
         # print output
         print("Overlap statistics for whole dataset:")
+        if len(self.bin_counts) > 1:
+            print("No. of resolution bins:", num_bins or self.num_bins)
         print("total overlap ratio", ratio_total_dataset)
         print("foreground overlap ratio", ratio_fg_dataset)
         print("background overlap ratio", ratio_bg_dataset)
@@ -697,14 +1179,16 @@ class OverlapCounter:
 
         # write output files
         self.write_output_lists_pixel(
-            d2_list, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg
+            d2_list, ratio_total, ratio_bg, ratio_fg, ratio_bg_fg, num_bins
         )
         self.write_output_total_pixel(
-            ratio_total_dataset, ratio_bg_dataset, ratio_fg_dataset, ratio_bg_fg_dataset
+            ratio_total_dataset,
+            ratio_bg_dataset,
+            ratio_fg_dataset,
+            ratio_bg_fg_dataset,
+            num_bins,
         )
 
-        print("Time taken for dataset:", end_main - start_main)
-
         return (
             ratio_total_dataset,
             ratio_fg_dataset,
@@ -712,7 +1196,512 @@ class OverlapCounter:
             ratio_bg_fg_dataset,
         )
 
+    def prepare_bins_pixel_bins(self, vmax, vmin, resolution):
+        """The function that assigns the pixels to the resolution bins of 
+        every number of bins of the overlap counter.
+
+        :param float vmax: maximum resolution in 1/d^2
+        :param float vmin: minimum resolution in 1/d^2
+        :param numpy array resolution: 2D numpy array of the resolutions 
+                                       (1/d^2) of the pixels
+
+        :returns: list of the results of prepare_bins_pixel, one for every
+                  number of bins
+        """
+        return [
+            self.prepare_bins_pixel(vmax, vmin, num_bins, resolution)
+            for num_bins in self.bin_counts
+        ]
+
+    def write_results_pixel_bins(self, counts, z_dim, binnings):
+        """The function that writes the results per pixel of the dataset for
+        every number of resolution bins.
+
+        :param list counts: lists of the background, foreground,
+                            background/foreground and total overlap counts 
+                            per resolution bin of the dataset, for every 
+                            number of bins
+        :param int z_dim: number of images in the dataset
+        :param list binnings: result of prepare_bins_pixel_bins
+
+        :returns: overall averages of the first number of bins (total, bg, 
+                  fg, bg_fg)
+        """
+        overall = []
+        for num_bins, counts_bins, (d2_list, _, weight) in zip(
+            self.bin_counts, counts, binnings
+        ):
+            overall.append(
+                self.write_results_pixel(counts_bins, z_dim, d2_list, weight, num_bins)
+            )
+        return overall[0]
+
+    def count_overlaps_per_pixel(self):
+        """The function that counts the overlaps per pixel on an image dataset.
+
+        :returns: overall averages for the whole imageset (total, bg, fg, bg_fg)
+
+        """
+        start_main = timer()
+        z_dim, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data()
+
+        print(x_dim, y_dim)
+        # get bin labels(middle of resolution range) array with size of image with
+        # indices of bin the resolution is in and weight of each bin, for
+        # every number of bins
+        binnings = self.prepare_bins_pixel_bins(vmax, vmin, resolution)
+        index_arrays = [index_array for _, index_array, _ in binnings]
+        weight = binnings[0][2]
+        print("Prepared bins.")
+
+        # the resolution map is not needed once the pixels are binned
+        del resolution
+        self.resolution_maps.clear()
+
+        # background, foreground, background/foreground and total overlap counts
+        counts = [[[0] * num_bins for i in range(4)] for num_bins in self.bin_counts]
+
+        # loop through all images, the counts of the images are added up 
+        # in the order of the images
+        count_image = functools.partial(
+            self.count_overlaps_image_pixel,
+            y_dim=y_dim,
+            x_dim=x_dim,
+            index_arrays=index_arrays,
+        )
+        results = self.map_images(count_image, range(z_dim))
+        for z, result in enumerate(results):
+            self.sum_image_pixel(counts, z, result, weight)
+            self.collect_raw_pixel(result[5])
+
+        self.write_raw_counts(z_dim, y_dim, x_dim, vmin, vmax)
+        overall = self.write_results_pixel_bins(counts, z_dim, binnings)
+        end_main = timer()
+
+        print("Time taken for dataset:", end_main - start_main)
+
+        return overall
+
+    def count_overlaps_image_combined(
+        self, z, y_dim, x_dim, vmin, vmax, z_dim, index_arrays, reflections=None
+    ):
+        """The function that counts the overlaps per reflection and per pixel
+        on one image, loading the image and finding the overlapping 
+        shoeboxes only once.
+
+        :param int z: index of the image in the dataset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param float vmin: minimum resolution in 1/d^2
+        :param float vmax: maximum resolution in 1/d^2
+        :param int z_dim: number of images in the dataset
+        :param list index_arrays: 1D numpy arrays of indices of the resolution
+                                  bin of each pixel, one for every number of 
+                                  bins of the overlap counter
+        :param reflections: reflection table of the image, it is loaded 
+                            from its pickle file if set to None
+
+        :returns: results of count_overlaps_image_reflection and
+                  count_overlaps_image_pixel
+        """
+        if reflections is None:
+            reflections = self.load_shoeboxes(z)
+        bbox, _, _ = self.shoebox_columns(reflections)
+        pairs = self.image_pairs(reflections, bbox, y_dim, x_dim)
+
+        result_reflection = self.count_overlaps_image_reflection(
+            z, y_dim, x_dim, vmin, vmax, z_dim, reflections, pairs
+        )
+        result_pixel = self.count_overlaps_image_pixel(
+            z, y_dim, x_dim, index_arrays, reflections, pairs
+        )
+        return result_reflection, result_pixel
+
+    def count_overlaps_combined(self):
+        """The function that counts the overlaps per reflection and per pixel 
+        in one pass through the images and writes the output files of both.
+
+        :returns: overall averages per shoebox (total, fg, bg, bg_fg) and 
+                  overall averages per pixel (total, fg, bg, bg_fg)
+        """
+        start_main = timer()
+        z_dim, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data()
+
+        # prepare the bins
+        binnings = self.prepare_bins_pixel_bins(vmax, vmin, resolution)
+        index_arrays = [index_array for _, index_array, _ in binnings]
+        weight = binnings[0][2]
+        print("Prepared bins.")
+
+        # the resolution map is not needed once the pixels are binned
+        del resolution
+        self.resolution_maps.clear()
+
+        # prepare the lists containing the overall overlap counts and ratios
+        dataset_counts = [
+            [[0] * num_bins for i in range(12)] for num_bins in self.bin_counts
+        ]
+        counts = [[[0] * num_bins for i in range(4)] for num_bins in self.bin_counts]
+
+        # loop through all images, the counts of the images are added up 
+        # in the order of the images
+        count_image = functools.partial(
+            self.count_overlaps_image_combined,
+            y_dim=y_dim,
+            x_dim=x_dim,
+            vmin=vmin,
+            vmax=vmax,
+            z_dim=z_dim,
+            index_arrays=index_arrays,
+        )
+        results = self.map_images(count_image, range(z_dim))
+        for z, (result_reflection, result_pixel) in enumerate(results):
+            no_shoeboxes = self.sum_image_reflection(
+                dataset_counts, z, result_reflection
+            )
+            self.sum_image_pixel(counts, z, result_pixel, weight)
+            self.collect_raw_reflection(result_reflection[4])
+            self.collect_raw_pixel(result_pixel[5])
+
+        self.write_raw_counts(z_dim, y_dim, x_dim, vmin, vmax)
+        overall_reflection = self.write_results_reflection_bins(
+            dataset_counts, no_shoeboxes, vmin, vmax
+        )
+        overall_pixel = self.write_results_pixel_bins(counts, z_dim, binnings)
+        end_main = timer()
+
+        print("Time taken for dataset:", end_main - start_main)
+
+        return overall_reflection, overall_pixel
+
+    def collect_raw_reflection(self, raw):
+        """The function that keeps the raw overlap counts per shoebox of one 
+        image, in the order of the images.
+
+        :param tuple raw: resolutions d and fg/fg, fg/bg, bg/fg and bg/bg 
+                          overlap counts of the shoeboxes on the image, 
+                          nothing is kept if set to None
+        """
+        if raw is not None:
+            self.raw_shoebox.append(raw)
+
+    def collect_raw_pixel(self, raw):
+        """The function that adds the raw overlap counts per pixel of one image
+        to the overlap counts per pixel of the dataset. Only the overlapping
+        pixels are kept; the counts of the images are merged per pixel once
+        more than RAW_PIXEL_MERGE of them are waiting.
+
+        :param tuple raw: indices of the overlapping pixels and their 
+                          background, foreground and background/foreground 
+                          overlap counts, nothing is added if set to None
+        """
+        if raw is None:
+            return
+        self.raw_pixel.append(
+            (raw[0],) + tuple(counts.astype(np.uint32) for counts in raw[1:])
+        )
+        if sum(len(part[0]) for part in self.raw_pixel) > RAW_PIXEL_MERGE:
+            self.raw_pixel = [self.merge_raw_pixel(self.raw_pixel)]
+
+    def merge_raw_pixel(self, parts):
+        """The function that adds up the raw overlap counts per pixel of
+        several images.
+
+        :param list parts: tuples of the indices of the overlapping pixels and
+                           their background, foreground and 
+                           background/foreground overlap counts
+
+        :returns: tuple of the sorted indices of the overlapping pixels and 
+                  their summed background, foreground and 
+                  background/foreground overlap counts
+        """
+        columns = [np.concatenate(column) for column in zip(*parts)]
+        pixels, inverse = np.unique(columns[0], return_inverse=True)
+        merged = (pixels,)
+        for counts_im in columns[1:]:
+            counts = np.zeros(len(pixels), dtype=np.uint32)
+            np.add.at(counts, inverse, counts_im)
+            merged += (counts,)
+        return merged
+
+    def write_raw_counts(self, z_dim, y_dim, x_dim, vmin, vmax):
+        """The function that saves the raw overlap counts per shoebox and per
+        pixel of the dataset to a compressed .npz file.
+
+        :param int z_dim: number of images in the dataset
+        :param int y_dim: height of the images
+        :param int x_dim: width of the images
+        :param float vmin: minimum resolution in 1/d^2
+        :param float vmax: maximum resolution in 1/d^2
+        """
+        if self.raw_counts is None:
+            return
+
+        arrays = {
+            "z_dim": z_dim,
+            "y_dim": y_dim,
+            "x_dim": x_dim,
+            "vmin": vmin,
+            "vmax": vmax,
+        }
+        if self.raw_shoebox:
+            columns = list(zip(*self.raw_shoebox))
+            arrays["frames"] = np.cumsum([0] + [len(d) for d in columns[0]])
+            for name, column in zip(RAW_SHOEBOX_COLUMNS, columns):
+                arrays[name] = np.concatenate(column)
+        if self.raw_pixel:
+            merged = self.merge_raw_pixel(self.raw_pixel)
+            arrays["pixels"] = merged[0]
+            for name, counts in zip(RAW_PIXEL_COLUMNS, merged[1:]):
+                arrays[name] = counts
+
+        with open(self.raw_counts, "wb") as outfile:
+            np.savez_compressed(outfile, **arrays)
+        print("Saved raw overlap counts to", self.raw_counts)
+
+    def reaggregate(self):
+        """The function that aggregates the raw overlap counts saved by an 
+        earlier run to the resolution bins of the overlap counter and writes 
+        the output files of the overlaps per reflection and per pixel, 
+        for the kinds of overlaps the raw counts were saved for. 
+
+        :returns: list of the overall averages per shoebox and/or per pixel 
+                  (total, fg, bg, bg_fg) of the first number of bins
+        """
+        raw = np.load(self.raw_counts)
+        z_dim = int(raw["z_dim"])
+        vmin = float(raw["vmin"])
+        vmax = float(raw["vmax"])
+        overall = []
+
+        if "frames" in raw:
+            frames = raw["frames"]
+            d = raw["d"]
+            counts = [raw[name] for name in RAW_SHOEBOX_COLUMNS[1:]]
+
+            # add up the counts of the images in the order of the images
+            dataset_counts = [
+                [[0] * num_bins for i in range(12)] for num_bins in self.bin_counts
+            ]
+            for z in range(z_dim):
+                first, last = frames[z], frames[z + 1]
+                d2_shoebox = 1 / d[first:last] ** 2
+                counts_im = [c[first:last].tolist() for c in counts]
+                for num_bins, counts_bins in zip(self.bin_counts, dataset_counts):
+                    _, image_dataset_counts = self.aggregate_image_reflection(
+                        d2_shoebox, counts_im, vmin, vmax, z_dim, num_bins
+                    )
+                    self.add_counts(counts_bins, image_dataset_counts)
+
+            no_shoeboxes = frames[-1] - frames[-2]
+            overall.append(
+                self.write_results_reflection_bins(
+                    dataset_counts, no_shoeboxes, vmin, vmax
+                )
+            )
+
+        if "pixels" in raw:
+            # the resolution bins of the pixels depend on the geometry only,
+            # so the images do not need to be available any more
+            _, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data(
+                check_format=False
+            )
+            assert (y_dim, x_dim) == (int(raw["y_dim"]), int(raw["x_dim"]))
+            binnings = self.prepare_bins_pixel_bins(vmax, vmin, resolution)
+            del resolution
+            self.resolution_maps.clear()
+
+            overlaps = [raw[name] for name in ("pixels",) + RAW_PIXEL_COLUMNS]
+            counts = []
+            for num_bins, (_, index_array, _) in zip(self.bin_counts, binnings):
+                count_bg, count_fg, count_bg_fg = self.bin_overlaps_per_pixel(
+                    overlaps, index_array, num_bins
+                )
+                counts.append(
+                    [
+                        count_bg.tolist(),
+                        count_fg.tolist(),
+                        count_bg_fg.tolist(),
+                        (count_bg + count_fg + count_bg_fg).tolist(),
+                    ]
+                )
+            overall.append(self.write_results_pixel_bins(counts, z_dim, binnings))
+
+        return overall
+
+    def estimate_image(self, z, y_dim, x_dim, reflections=None):
+        """The function that counts the overlaps on one image of the sample
+        the overall overlap ratios are estimated from.
+
+        :param int z: index of the image in the dataset
+        :param int y_dim: height of the image
+        :param int x_dim: width of the image
+        :param reflections: reflection table of the image, it is loaded 
+                            from its pickle file if set to None
+
+        :returns: number of shoeboxes on the image, sums of the total, fg, bg 
+                  and bg_fg overlaps per shoebox and total, fg, bg and bg_fg 
+                  overlap ratios per pixel of the image (None for the kind of
+                  overlaps that is not counted)
+        """
+        if reflections is None:
+            reflections = self.load_shoeboxes(z)
+        bbox, masks, _ = self.shoebox_columns(reflections)
+        pairs = None
+        if self.run_combined:
+            pairs = self.image_pairs(reflections, bbox, y_dim, x_dim)
+
+        shoebox_sums = None
+        if self.run_combined or self.run_shoeboxes:
+            fg_fg, fg_bg, bg_fg, bg_bg = [
+                sum(count)
+                for count in self.write_overlaps_per_shoebox(
+                    reflections, bbox, masks, y_dim, x_dim, z, pairs
+                )
+            ]
+            shoebox_sums = (fg_fg + fg_bg + bg_bg, fg_fg, bg_bg, bg_fg)
+
+        pixel_ratios = None
+        if self.run_combined or not self.run_shoeboxes:
+            pixels, n_background, n_foreground = self.write_bg_and_fg_mask(
+                bbox, masks, y_dim, x_dim, z, pairs
+            )
+            _, bg, fg, bg_fg = self.overlaps_per_pixel(
+                n_background, n_foreground, pixels
+            )
+            num_pixels = y_dim * x_dim
+            pixel_ratios = (
+                (bg.sum() + fg.sum() + bg_fg.sum()) / num_pixels,
+                fg.sum() / num_pixels,
+                bg.sum() / num_pixels,
+                bg_fg.sum() / num_pixels,
+            )
+
+        return len(masks), shoebox_sums, pixel_ratios
+
+    def write_output_interval(self, kind, estimate, half_width, num_frames):
+        """This function writes a text file containing the estimated average 
+        overlaps of the dataset and their 95% confidence intervals.
+
+        :param str kind: "pixel" or "shoebox"
+        :param list estimate: estimated total, fg, bg and bg_fg overlap ratios
+        :param list half_width: half widths of the confidence intervals
+        :param int num_frames: number of images the estimate is based on
+        """
+        text = [
+            "total overlap ratio:",
+            "foreground overlap ratio:",
+            "background overlap ratio:",
+            "background foreground overlap ratio:",
+        ]
+        name_outfile = self.output_name(self.outputfile_t, kind + "_interval")
+        with open(name_outfile, "w") as outfile:
+            for t, e, h in zip(text, estimate, half_width):
+                outfile.write("%s, %f, %f, %f\n" % (t, e, e - h, e + h))
+            outfile.write("images:, %d\n" % num_frames)
+
+    def estimate_overlaps(self):
+        """The function that estimates the overall overlap ratios from a 
+        sample of the images, with 95% confidence intervals. The estimate
+        stops early once all intervals are narrower than the tolerance. It 
+        writes the overlap_total files and files with the intervals.
+
+        :returns: estimated overall averages per shoebox or per pixel 
+                  (total, fg, bg, bg_fg), or both in combined mode
+        """
+        start_main = timer()
+        z_dim, y_dim, x_dim, vmin, vmax, resolution = self.prepare_data()
+        del resolution
+        self.resolution_maps.clear()
+
+        frames = sample_frames(z_dim, self.sample, self.sample_method)
+        print("Estimating overlaps from %d of %d images." % (len(frames), z_dim))
+        if self.raw_counts is not None:
+            print("Warning: no raw overlap counts are saved for an estimate.")
+        if len(self.bin_counts) > 1:
+            print("Warning: the estimate has no resolution bins, num_bins is ignored.")
+
+        estimate_image = functools.partial(
+            self.estimate_image, y_dim=y_dim, x_dim=x_dim
+        )
+        shoebox_sums = []
+        pixel_ratios = []
+        results = self.map_images(estimate_image, frames)
+        try:
+            for z, result in zip(frames, results):
+                no_shoeboxes, sums, ratios = result
+                if z == z_dim - 1:
+                    # the overlap ratios per shoebox are normalised by the 
+                    # number of shoeboxes on the last image
+                    no_shoeboxes_last = no_shoeboxes
+                if sums is not None:
+                    shoebox_sums.append(sums)
+                if ratios is not None:
+                    pixel_ratios.append(ratios)
+
+                estimates = []
+                if shoebox_sums:
+                    estimates.append(
+                        mean_and_interval(
+                            np.array(shoebox_sums) / no_shoeboxes_last, z_dim
+                        )
+                    )
+                if pixel_ratios:
+                    estimates.append(mean_and_interval(pixel_ratios, z_dim))
+                width = max(2 * np.max(half_width) for _, half_width in estimates)
+                num_frames = max(len(shoebox_sums), len(pixel_ratios))
+                if (
+                    self.tolerance is not None
+                    and num_frames >= min(MIN_FRAMES, len(frames))
+                    and width < self.tolerance
+                ):
+                    print("Confidence intervals narrower than", self.tolerance)
+                    break
+        finally:
+            # stop the processes or the loading thread when the estimate
+            # stops early
+            results.close()
+
+        kinds = []
+        if shoebox_sums:
+            kinds.append("shoebox")
+        if pixel_ratios:
+            kinds.append("pixel")
+
+        # print output and write output files
+        overall = []
+        names = ["total", "foreground", "background", "background foreground"]
+        print("Overlap estimates from %d images (95%% confidence):" % num_frames)
+        for kind, (estimate, half_width) in zip(kinds, estimates):
+            for name, e, h in zip(names, estimate, half_width):
+                print("%s overlap ratio per %s" % (name, kind), e, "+-", h)
+
+            total, fg, bg, bg_fg = estimate.tolist()
+            if kind == "shoebox":
+                self.write_output_total_shoebox(total, bg, fg, bg_fg)
+            else:
+                self.write_output_total_pixel(total, bg, fg, bg_fg)
+            self.write_output_interval(kind, estimate, half_width, num_frames)
+            overall.append((total, fg, bg, bg_fg))
+        end_main = timer()
+
+        print("Time taken for estimate:", end_main - start_main)
+        if self.run_combined:
+            return tuple(overall)
+        return overall[0]
+
     def main(self):
+        """
+        The main function of the overlap counter.
+
+        :returns: overall averages (total, fg, bg, bg_fg) per shoebox or per
+                  pixel, or both if overlaps are counted in combined mode, 
+                  estimated from a sample of the images if sample is set
+        """
+        if self.sample is not None:
+            return self.estimate_overlaps()
+        if self.run_combined:
+            return self.count_overlaps_combined()
         if self.run_shoeboxes:
             total, fg, bg, bg_fg = self.count_overlaps_per_reflection()
         else:
@@ -737,8 +1726,9 @@ def run():
         "--num_bins",
         dest="num_bins",
         type=int,
-        help="The number of resolution bins",
-        default=50,
+        nargs="+",
+        help="The number of resolution bins, several numbers of bins write one set of output files each.",
+        default=[50],
     )
     parser.add_argument(
         "--outputfile_l",
@@ -768,13 +1758,121 @@ def run():
         action='store_false',
        
     )
+    parser.add_argument(
+        "--run_combined",
+        dest="run_combined",
+        help="Counts overlaps per shoebox and per pixel in one pass.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--nproc",
+        dest="nproc",
+        type=int,
+        help="The number of processes the images are distributed to.",
+        default=1,
+    )
+    parser.add_argument(
+        "--shoebox_engine",
+        dest="shoebox_engine",
+        type=str,
+        choices=["raster", "pairwise"],
+        help="The way overlaps per shoebox are counted.",
+        default="raster",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        dest="cache_dir",
+        type=str,
+        help="The directory of the cache for resolution maps and resolution bins, e.g. ~/.cache/iolite. No cache is used if it is not set.",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        type=int,
+        help="The maximum size of the cache in MB.",
+        default=4096,
+    )
+    parser.add_argument(
+        "--no_cache",
+        dest="cache_dir",
+        help="Sets cache_dir to None (the default), so that no cache is used.",
+        action="store_const",
+        const=None,
+    )
+    parser.add_argument(
+        "--reflections",
+        dest="reflections_file",
+        type=str,
+        help="The name of the refl file the shoebox masks are computed from without reading images.",
+        default=None,
+    )
+    parser.add_argument(
+        "--store",
+        dest="store",
+        type=str,
+        help="The directory of the shoebox store the shoeboxes are read from instead of the pickle files.",
+        default=None,
+    )
+    parser.add_argument(
+        "--raw_counts",
+        dest="raw_counts",
+        type=str,
+        help="The name of the .npz file the raw overlap counts are saved to, for reaggregate_overlaps.",
+        default=None,
+    )
+    parser.add_argument(
+        "--prefetch",
+        dest="prefetch",
+        type=int,
+        help="The number of images loaded in the background while an image is processed (one process only).",
+        default=0,
+    )
+    parser.add_argument(
+        "--sample",
+        dest="sample",
+        type=float,
+        help="The fraction of the images the overall overlap ratios are estimated from, e.g. 0.05.",
+        default=None,
+    )
+    parser.add_argument(
+        "--sample_method",
+        dest="sample_method",
+        type=str,
+        choices=["even", "random"],
+        help="The way the images of the sample are chosen.",
+        default="even",
+    )
+    parser.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        help="The width of the 95%% confidence intervals at which the estimate stops early.",
+        default=None,
+    )
     args = parser.parse_args()
+    if args.sample is not None and args.raw_counts is not None:
+        parser.error("--raw_counts cannot be used with --sample")
+    if args.sample is not None and len(args.num_bins) > 1:
+        parser.error("--sample estimates overall ratios, give one --num_bins")
     overlap_counter = OverlapCounter(
         args.inputfile,
         args.num_bins,
         args.outputfile_l,
         args.outputfile_t,
         args.run_shoeboxes,
+        args.cache_dir,
+        args.cache_size,
+        args.shoebox_engine,
+        args.nproc,
+        args.run_combined,
+        args.reflections_file,
+        args.store,
+        args.raw_counts,
+        args.prefetch,
+        args.sample,
+        args.sample_method,
+        args.tolerance,
     )
     overlap_counter.main()
 
@@ -0,0 +1,121 @@
+"""
+This module provides the reflection tables of the images of a dataset with
+shoebox masks, computed from the integrated reflections and the profile
+model of the experiment. Unlike extract.py it never reads an image: the
+overlap statistics only need the bounding boxes and the foreground and
+background masks, which depend on the geometry and the profile model but
+not on the pixel values.
+
+Pixels are marked as valid according to the static mask of the detector,
+so pixels that are only invalid on single images (e.g. overloads) are
+treated as valid.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from dials.array_family import flex
+
+
+class PredictedShoeboxes:
+    """ A class that computes the shoeboxes of the reflections on each image
+        of a dataset from the integrated reflection table, without reading
+        the images."""
+
+    def __init__(self, experiments, reflections):
+        """
+        The reflections are sorted by their first image. They are split into
+        single image reflections one image at a time, when the image is 
+        computed, so the whole table is never split at once.
+
+        :param experiments: experiment list with one experiment that has a
+                            profile model
+        :param reflections: integrated reflection table
+        """
+        assert len(experiments) == 1
+        assert experiments[0].profile is not None
+        assert "bbox" in reflections
+        assert "panel" in reflections
+        self.experiments = experiments
+
+        if "shoebox" in reflections:
+            del reflections["shoebox"]
+
+        # Remove junk before splitting, the partials of a reflection have its
+        # id, miller index and flags
+        reflections = reflections.select(reflections["id"] >= 0)
+        reflections = reflections.select(reflections["miller_index"] != (0, 0, 0))
+        reflections = reflections.select(
+            reflections.get_flags(reflections.flags.integrated_sum)
+        )
+        self.reflections = reflections
+
+        # sort the reflections by their first image
+        _, _, _, _, z0, z1 = [p.as_numpy_array() for p in reflections["bbox"].parts()]
+        assert np.all(z1 > z0)
+        self.order = np.argsort(z0, kind="mergesort")
+        self.frames = z0[self.order]
+        self.last_frames = z1[self.order]
+        self.max_frames = int((z1 - z0).max()) if len(z0) else 1
+
+        # valid pixels of each panel
+        detector = experiments[0].detector
+        static_mask = experiments[0].imageset.get_static_mask()
+        if static_mask is None:
+            self.valid = [
+                np.ones(panel.get_image_size()[::-1], dtype=bool) for panel in detector
+            ]
+        else:
+            self.valid = [m.as_numpy_array() for m in static_mask]
+
+    def frame(self, z):
+        """
+        This function computes the reflection table of one image, with
+        shoeboxes whose masks mark the valid, foreground and background pixels.
+
+        :param int z: index of the image in the dataset
+
+        :returns: reflection table of the image
+        """
+        # reflections that are recorded on the image, in the order of the table
+        first, last = np.searchsorted(self.frames, [z - self.max_frames + 1, z + 1])
+        recorded = self.last_frames[first:last] > z
+        indices = np.sort(self.order[first:last][recorded])
+        subset = self.reflections.select(flex.size_t(indices.tolist()))
+
+        # Split the reflections into their partials on the image, like
+        # reflections.split_partials()
+        if self.max_frames > 1:
+            x0, x1, y0, y1, _, _ = subset["bbox"].parts()
+            n = len(subset)
+            subset["bbox"] = flex.int6(
+                x0, x1, y0, y1, flex.int(n, z), flex.int(n, z + 1)
+            )
+            subset["partial_id"] = flex.size_t(indices.tolist())
+
+        # Allocate the shoeboxes
+        subset["shoebox"] = flex.shoebox(subset["panel"], subset["bbox"], allocate=True)
+
+        # Mark the pixels of the shoeboxes that lie on valid detector pixels
+        shoebox = subset["shoebox"]
+        for index in range(len(shoebox)):
+            valid = self.valid[subset["panel"][index]]
+            y_dim, x_dim = valid.shape
+            x0m, x1m, y0m, y1m, z0m, z1m = shoebox[index].bbox
+
+            x0 = max(x0m, 0)
+            x1 = min(x1m, x_dim)
+            y0 = max(y0m, 0)
+            y1 = min(y1m, y_dim)
+
+            mask = np.zeros((z1m - z0m, y1m - y0m, x1m - x0m), dtype=np.int32)
+            if x1 > x0 and y1 > y0:
+                mask[:, (y0 - y0m) : (y1 - y0m), (x0 - x0m) : (x1 - x0m)] = valid[
+                    y0:y1, x0:x1
+                ]
+            shoebox[index].mask = flex.int(mask)
+
+        # Compute the mask
+        subset.compute_mask(self.experiments)
+
+        return subset
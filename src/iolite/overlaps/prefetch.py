@@ -0,0 +1,97 @@
+"""
+This module loads the shoeboxes of the images of a dataset in a background
+thread, so that the next images are read from disk while the current image
+is processed. At most a fixed number of loaded images wait in a queue, so
+the memory taken by the prefetched images is bounded.
+
+The time the processing waits for an image to be loaded and the time spent
+processing the images are measured, so that it can be seen whether a run
+is limited by reading the images or by counting the overlaps.
+"""
+from __future__ import absolute_import, division, print_function
+
+import threading
+from timeit import default_timer as timer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class FramePrefetcher:
+    """ A class that loads the images of a dataset in a background thread
+        and hands them out in the order of the images."""
+
+    def __init__(self, load, frames, depth=2):
+        """
+        The prefetcher is initialized with the function that loads an image,
+        the indices of the images and the number of images loaded ahead.
+
+        :param function load: function that takes the index of an image and
+                              returns its reflection table
+        :param list frames: indices of the images
+        :param int depth: maximum number of loaded images waiting to be
+                          processed (default: 2)
+        """
+        assert depth >= 1
+        self.load = load
+        self.frames = list(frames)
+        self.depth = depth
+        self.io_wait = 0.0
+        self.compute = 0.0
+
+    def __iter__(self):
+        """
+        This function yields the index and the reflection table of every
+        image, while the next images are loaded in the background. An error
+        raised while loading an image is raised again when the image is due.
+
+        :returns: generator of tuples of the index and the reflection table
+                  of every image
+        """
+        loaded = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+
+        def load_frames():
+            for z in self.frames:
+                try:
+                    item = (z, self.load(z), None)
+                except Exception as error:
+                    item = (z, None, error)
+                # wait for space in the queue, unless the images are not
+                # needed anymore
+                while not stop.is_set():
+                    try:
+                        loaded.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set() or item[2] is not None:
+                    return
+
+        thread = threading.Thread(target=load_frames)
+        thread.daemon = True
+        thread.start()
+        try:
+            for _ in self.frames:
+                start = timer()
+                z, reflections, error = loaded.get()
+                self.io_wait += timer() - start
+                if error is not None:
+                    raise error
+
+                start = timer()
+                yield z, reflections
+                self.compute += timer() - start
+        finally:
+            stop.set()
+            thread.join()
+
+    def report(self):
+        """
+        This function prints the time spent waiting for images to be loaded
+        and the time spent processing them.
+        """
+        print("Time waiting for shoeboxes:", self.io_wait)
+        print("Time computing:", self.compute)
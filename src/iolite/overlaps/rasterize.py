@@ -0,0 +1,341 @@
+"""
+This module paints the foreground and background of overlapping shoeboxes
+of one image into counts per pixel, kept only for the pixels the overlapping
+shoeboxes cover. Every shoebox that is part of an overlap is converted to a
+numpy array once, no matter with how many other shoeboxes it overlaps.
+
+The shoeboxes are given as a 2D numpy array of their bounding boxes and a
+sequence of their masks as 3D numpy arrays, as read from a shoebox store.
+The masks of dials shoeboxes are wrapped with ShoeboxMasks.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+
+def overlapping_pairs(reflections):
+    """
+    This function lists the pairs of shoeboxes whose bounding boxes overlap.
+
+    :param dials_array_family_flex_ext.reflection_table reflections: reflection table
+
+    :returns: list of tuples of the indices of the overlapping shoeboxes
+    """
+    bbox_overlaps = reflections.find_overlaps()
+
+    pairs = []
+    for edge in bbox_overlaps.edges():
+        # get indices of overlapping shoeboxes in the shoebox list
+        index1 = bbox_overlaps.source(edge)
+        index2 = bbox_overlaps.target(edge)
+
+        # avoid counting overlaps twice
+        if index1 > index2:
+            pairs.append((index1, index2))
+
+    return pairs
+
+
+def bbox_pairs(bbox, y_dim, x_dim):
+    """
+    This function lists the pairs of shoeboxes whose bounding boxes overlap
+    on the image, from the bounding boxes sorted by their first column.
+
+    :param numpy array bbox: 2D array of the bounding boxes (x0, x1, y0, y1, z0, z1)
+                             of the shoeboxes on the image
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+
+    :returns: list of pairs of the indices of the overlapping shoeboxes, the
+              larger index first
+    """
+    bbox = np.asarray(bbox, dtype=np.int64).reshape(-1, 6)
+    x0 = np.maximum(bbox[:, 0], 0)
+    x1 = np.minimum(bbox[:, 1], x_dim)
+    y0 = np.maximum(bbox[:, 2], 0)
+    y1 = np.minimum(bbox[:, 3], y_dim)
+
+    # every shoebox is compared with the shoeboxes that start before it ends
+    order = np.argsort(x0, kind="mergesort")
+    starts = np.arange(1, len(order) + 1)
+    ends = np.searchsorted(x0[order], x1[order], side="left")
+    counts = np.maximum(ends - starts, 0)
+    first = np.repeat(np.arange(len(order)), counts)
+    offsets = np.cumsum(counts) - counts
+    second = np.arange(counts.sum()) + np.repeat(starts - offsets, counts)
+    index1 = order[first]
+    index2 = order[second]
+
+    overlap_x = np.maximum(x0[index1], x0[index2]) < np.minimum(x1[index1], x1[index2])
+    overlap_y = np.maximum(y0[index1], y0[index2]) < np.minimum(y1[index1], y1[index2])
+    overlap = overlap_x & overlap_y
+    index1 = index1[overlap]
+    index2 = index2[overlap]
+
+    return np.stack(
+        [np.maximum(index1, index2), np.minimum(index1, index2)], 1
+    ).tolist()
+
+
+class ShoeboxMasks:
+    """ A class that gives the masks of a list of dials shoeboxes as numpy 
+        arrays, converting the mask of a shoebox when it is used."""
+
+    def __init__(self, shoebox):
+        """
+        :param list shoebox: list that contains all shoeboxes on the image
+        """
+        self.shoebox = shoebox
+
+    def __len__(self):
+        return len(self.shoebox)
+
+    def __getitem__(self, index):
+        return self.shoebox[index].mask.as_numpy_array()
+
+
+def overlap_window(bbox1, bbox2, y_dim, x_dim):
+    """
+    This function calculates the coordinates of the overlap of two
+    bounding boxes on the image.
+
+    :param tuple bbox1: bounding box of the first shoebox
+    :param tuple bbox2: bounding box of the second shoebox
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+
+    :returns: coordinates x0, x1, y0, y1 of the overlap
+    """
+    x0 = max(bbox1[0], bbox2[0], 0)
+    x1 = min(bbox1[1], bbox2[1], x_dim)
+    y0 = max(bbox1[2], bbox2[2], 0)
+    y1 = min(bbox1[3], bbox2[3], y_dim)
+
+    assert x1 > x0
+    assert y1 > y0
+
+    return x0, x1, y0, y1
+
+
+def sparse_bg_and_fg(bbox, masks, pairs, y_dim, x_dim, z):
+    """
+    This function counts for every pixel that lies in an overlap of two
+    shoeboxes how many shoeboxes have a foreground/background at the pixel.
+    Only the pixels of a shoebox that lie in its overlap with another
+    shoebox are counted, so the counts are kept for these pixels only and
+    their memory tracks the size of the overlapping shoeboxes instead of the
+    size of the image.
+
+    A pixel that is exactly background (3) or foreground (5) is counted once,
+    a background or foreground pixel with additional flags is counted once
+    per overlap it lies in.
+
+    :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+    :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
+    :param list pairs: list of tuples of the indices of overlapping shoeboxes
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+    :param int z: index of image in dataset
+
+    :returns: sorted 1D numpy array of the indices of the counted pixels on the
+              image and uint16 arrays of the counts of background and
+              foreground pixels in shoeboxes at these pixels
+    """
+    # count for every pixel of the shoeboxes in how many overlaps it lies
+    bboxes = {}
+    coverage = {}
+    for index1, index2 in pairs:
+        for index in (index1, index2):
+            if index not in bboxes:
+                bboxes[index] = tuple(int(b) for b in bbox[index])
+                x0m, x1m, y0m, y1m, _, _ = bboxes[index]
+                coverage[index] = np.zeros((y1m - y0m, x1m - x0m), dtype=np.uint16)
+
+        x0, x1, y0, y1 = overlap_window(bboxes[index1], bboxes[index2], y_dim, x_dim)
+        for index in (index1, index2):
+            x0m, _, y0m, _, _, _ = bboxes[index]
+            coverage[index][(y0 - y0m) : (y1 - y0m), (x0 - x0m) : (x1 - x0m)] += 1
+
+    # paint every shoebox once
+    pixels = []
+    background = []
+    foreground = []
+    for index, cover in coverage.items():
+        x0m, x1m, y0m, y1m, z0m, _ = bboxes[index]
+        mask = masks[index][z - z0m]
+
+        # part of the shoebox that lies on the image
+        x0 = max(x0m, 0)
+        x1 = min(x1m, x_dim)
+        y0 = max(y0m, 0)
+        y1 = min(y1m, y_dim)
+        window = (slice(y0 - y0m, y1 - y0m), slice(x0 - x0m, x1 - x0m))
+        mask = mask[window]
+        cover = cover[window]
+
+        counted = np.where((mask == 3) | (mask == 5), np.minimum(cover, 1), cover)
+        bg = counted * ((mask & 3) == 3)
+        fg = counted * ((mask & 5) == 5)
+
+        y, x = np.nonzero(bg + fg)
+        pixels.append((y + y0) * x_dim + (x + x0))
+        background.append(bg[y, x])
+        foreground.append(fg[y, x])
+
+    if not pixels:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, np.uint16), np.zeros(0, np.uint16)
+
+    # add up the counts of shoeboxes that share a pixel
+    pixels, inverse = np.unique(np.concatenate(pixels), return_inverse=True)
+    n_background = np.bincount(inverse, weights=np.concatenate(background))
+    n_foreground = np.bincount(inverse, weights=np.concatenate(foreground))
+    assert max(n_background.max(), n_foreground.max()) <= np.iinfo(np.uint16).max
+
+    return pixels, n_background.astype(np.uint16), n_foreground.astype(np.uint16)
+
+
+def rasterize_bg_and_fg(bbox, masks, pairs, y_dim, x_dim, z):
+    """
+    This function writes masks (one for foreground, one for background)
+    of the shape of the image that contain the counts of shoeboxes that
+    have a foreground/background at the specific pixels, as counted by
+    sparse_bg_and_fg.
+
+    :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+    :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
+    :param list pairs: list of tuples of the indices of overlapping shoeboxes
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+    :param int z: index of image in dataset
+
+    :returns: masks of counts of background and foreground pixels in shoeboxes
+    """
+    pixels, background, foreground = sparse_bg_and_fg(
+        bbox, masks, pairs, y_dim, x_dim, z
+    )
+
+    n_background = np.zeros(dtype=int, shape=(y_dim, x_dim))
+    n_foreground = np.zeros(dtype=int, shape=(y_dim, x_dim))
+    n_background.reshape(-1)[pixels] = background
+    n_foreground.reshape(-1)[pixels] = foreground
+
+    return n_background, n_foreground
+
+
+def shoebox_footprints(bbox, masks, y_dim, x_dim, z):
+    """
+    This function lists the foreground and background pixels of all
+    shoeboxes on the image. Each pixel is labelled with the index of its
+    shoebox and the mask value of the shoebox at the pixel.
+
+    :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+    :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+    :param int z: index of image in dataset
+
+    :returns: 1D numpy arrays of the pixel indices on the image, the shoebox
+              indices and the mask values
+    """
+    pixels = []
+    labels = []
+    flags = []
+    for index, (x0m, x1m, y0m, y1m, z0m, _) in enumerate(np.asarray(bbox).tolist()):
+
+        # part of the shoebox that lies on the image
+        x0 = max(x0m, 0)
+        x1 = min(x1m, x_dim)
+        y0 = max(y0m, 0)
+        y1 = min(y1m, y_dim)
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        mask = masks[index][
+            z - z0m, (y0 - y0m) : (y1 - y0m), (x0 - x0m) : (x1 - x0m)
+        ]
+        y, x = np.nonzero(((mask & 5) == 5) | ((mask & 3) == 3))
+        pixels.append((y + y0) * x_dim + (x + x0))
+        labels.append(np.full(len(y), index, dtype=np.int64))
+        flags.append(mask[y, x])
+
+    if not pixels:
+        return (np.zeros(0, dtype=np.int64),) * 3
+    return np.concatenate(pixels), np.concatenate(labels), np.concatenate(flags)
+
+
+def count_overlaps_per_shoebox(bbox, masks, y_dim, x_dim, z):
+    """
+    This function counts shoebox overlaps (foreground/foreground,
+    foreground/background, background/foreground, background/background)
+    for each shoebox without looking at the overlapping pairs one by one.
+
+    The foreground and background pixels of all shoeboxes are sorted by
+    their position on the image. Every two shoeboxes that share a pixel
+    form a collision, and collisions of the same two shoeboxes are merged,
+    so that each overlapping pair is counted once per kind of overlap.
+
+    :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+    :param masks: sequence of the 3D numpy arrays of the masks of the shoeboxes
+    :param int y_dim: height of the image
+    :param int x_dim: width of the image
+    :param int z: index of image in dataset
+
+    :returns: lists of the fg/fg,fg/bg,bg/fg and bg/bg overlaps per shoebox
+    """
+    no_shoeboxes = len(masks)
+    pixels, labels, flags = shoebox_footprints(bbox, masks, y_dim, x_dim, z)
+
+    # sort the footprints by pixel, so that shoeboxes sharing a pixel are adjacent
+    order = np.argsort(pixels, kind="mergesort")
+    pixels = pixels[order]
+    labels = labels[order]
+    fg = (flags[order] & 5) == 5
+    bg = (flags[order] & 3) == 3
+
+    # collect the collisions of all shoeboxes that share a pixel
+    first = []
+    second = []
+    distance = 1
+    while distance < len(pixels):
+        shared = np.flatnonzero(pixels[:-distance] == pixels[distance:])
+        if len(shared) == 0:
+            break
+        first.append(shared)
+        second.append(shared + distance)
+        distance += 1
+
+    if first:
+        first = np.concatenate(first)
+        second = np.concatenate(second)
+    else:
+        first = second = np.zeros(0, dtype=np.int64)
+
+    label1 = labels[first]
+    label2 = labels[second]
+
+    def unique_pairs(label_a, label_b, collide):
+        # pairs of shoeboxes that collide in at least one pixel
+        keys = np.unique(label_a[collide] * no_shoeboxes + label_b[collide])
+        return keys // no_shoeboxes, keys % no_shoeboxes
+
+    def count(*indices):
+        counts = np.zeros(no_shoeboxes, dtype=np.int64)
+        for index in indices:
+            counts += np.bincount(index, minlength=no_shoeboxes)
+        return counts.tolist()
+
+    # fg/fg and bg/bg overlaps are symmetric
+    low = np.minimum(label1, label2)
+    high = np.maximum(label1, label2)
+    fg_fg = count(*unique_pairs(high, low, fg[first] & fg[second]))
+    bg_bg = count(*unique_pairs(high, low, bg[first] & bg[second]))
+
+    # foreground of one shoebox overlapping the background of the other
+    fg_label = np.concatenate([label1, label2])
+    bg_label = np.concatenate([label2, label1])
+    fg_on_bg = np.concatenate([fg[first] & bg[second], bg[first] & fg[second]])
+    fg_index, bg_index = unique_pairs(fg_label, bg_label, fg_on_bg)
+    fg_bg = count(fg_index)
+    bg_fg = count(bg_index)
+
+    return fg_fg, fg_bg, bg_fg, bg_bg
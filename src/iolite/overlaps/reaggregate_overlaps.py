@@ -0,0 +1,88 @@
+"""
+This program writes the output files of overlapping_spots (overlap_lists_*
+and overlap_total_*) for any number of resolution bins from the raw overlap
+counts that overlapping_spots saved with --raw_counts, without counting the
+overlaps on the images again.
+"""
+from src.iolite.overlaps.overlapping_spots import OverlapCounter
+
+
+def run():
+    """Allows reaggregate_overlaps to be called from command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="command line argument")
+
+    parser.add_argument(
+        "--raw_counts",
+        dest="raw_counts",
+        type=str,
+        help="The name of the .npz file that contains the raw overlap counts.",
+        default="overlap_counts.npz",
+    )
+    parser.add_argument(
+        "--inputfile",
+        dest="inputfile",
+        type=str,
+        help="The name of the json file of the experiment, needed for the overlaps per pixel.",
+        default="13_integrated.expt",
+    )
+    parser.add_argument(
+        "--num_bins",
+        dest="num_bins",
+        type=int,
+        nargs="+",
+        help="The number of resolution bins, several numbers of bins write one set of output files each.",
+        default=[50],
+    )
+    parser.add_argument(
+        "--outputfile_l",
+        dest="outputfile_l",
+        type=str,
+        help="The name of the output file that contains the lists of the overlaps per resolution bin.",
+        default="overlap_lists",
+    )
+    parser.add_argument(
+        "--outputfile_t",
+        dest="outputfile_t",
+        type=str,
+        help="The name of the output file that contains the average overlaps of the dataset",
+        default="overlap_total",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        dest="cache_dir",
+        type=str,
+        help="The directory of the cache for resolution maps and resolution bins, e.g. ~/.cache/iolite. No cache is used if it is not set.",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        type=int,
+        help="The maximum size of the cache in MB.",
+        default=4096,
+    )
+    parser.add_argument(
+        "--no_cache",
+        dest="cache_dir",
+        help="Sets cache_dir to None (the default), so that no cache is used.",
+        action="store_const",
+        const=None,
+    )
+    args = parser.parse_args()
+    overlap_counter = OverlapCounter(
+        args.inputfile,
+        args.num_bins,
+        args.outputfile_l,
+        args.outputfile_t,
+        True,
+        args.cache_dir,
+        args.cache_size,
+        raw_counts=args.raw_counts,
+    )
+    overlap_counter.reaggregate()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,178 @@
+"""
+This module provides an on-disk cache for arrays that only depend on the
+detector and beam geometry of a dataset, like the resolution map and the
+resolution bin index of every pixel. The arrays are stored as .npy files
+and loaded memory-mapped, so that datasets collected with the same geometry
+share them across runs.
+"""
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+
+class ResolutionCache:
+    """ A class that stores numpy arrays on disk, keyed by a hash of the
+        detector and beam models. Entries that were not used for the longest
+        time are evicted once the cache is larger than its maximum size."""
+
+    def __init__(self, directory, max_size):
+        """
+        The cache is initialized with the directory the entries are stored in
+        and the maximum size of the cache.
+
+        :param str directory: directory that contains the cache entries
+        :param int max_size: maximum size of the cache in bytes
+        """
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+
+    def key(self, detector, beam):
+        """
+        This function computes the key of the cache entry of a geometry.
+
+        :param detector: dxtbx detector
+        :param beam: dxtbx beam
+
+        :returns: hexadecimal hash of the detector and beam models
+        """
+        models = json.dumps(
+            {"detector": detector.to_dict(), "beam": beam.to_dict()}, sort_keys=True
+        )
+        return hashlib.sha1(models.encode("utf-8")).hexdigest()
+
+    def path(self, key, name):
+        """
+        This function returns the path of an array in the cache.
+
+        :param str key: key of the cache entry
+        :param str name: name of the array
+
+        :returns: path of the .npy file
+        """
+        return os.path.join(self.directory, key, name + ".npy")
+
+    def load(self, key, name):
+        """
+        This function loads an array from the cache and marks the cache entry
+        as used.
+
+        :param str key: key of the cache entry
+        :param str name: name of the array
+
+        :returns: memory-mapped numpy array or None if it is not in the cache
+        """
+        filename = self.path(key, name)
+        if not os.path.isfile(filename):
+            return None
+        try:
+            array = np.load(filename, mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+        self.touch(key)
+        return array
+
+    def store(self, key, name, array):
+        """
+        This function writes an array to the cache and evicts old entries
+        if the cache got too large.
+
+        :param str key: key of the cache entry
+        :param str name: name of the array
+        :param numpy array array: array that is stored
+
+        :returns: memory-mapped numpy array of the stored array
+        """
+        filename = self.path(key, name)
+        entry = os.path.dirname(filename)
+        if not os.path.isdir(entry):
+            try:
+                os.makedirs(entry)
+            except OSError:
+                # another job created the entry at the same time
+                if not os.path.isdir(entry):
+                    raise
+
+        # write to a temporary file first so that other jobs never see
+        # a partially written array
+        temp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(temp, "wb") as outfile:
+            np.save(outfile, np.asarray(array))
+        os.rename(temp, filename)
+
+        self.touch(key)
+        self.evict(keep=key)
+        return np.load(filename, mmap_mode="r")
+
+    def get(self, key, name, compute):
+        """
+        This function loads an array from the cache or computes and
+        stores it if it is not in the cache yet.
+
+        :param str key: key of the cache entry
+        :param str name: name of the array
+        :param function compute: function without arguments that returns the array
+
+        :returns: memory-mapped numpy array
+        """
+        array = self.load(key, name)
+        if array is None:
+            array = self.store(key, name, compute())
+        return array
+
+    def touch(self, key):
+        """
+        This function marks a cache entry as used by updating its
+        modification time.
+
+        :param str key: key of the cache entry
+        """
+        try:
+            os.utime(os.path.join(self.directory, key), None)
+        except OSError:
+            pass
+
+    def entry_size(self, key):
+        """
+        This function calculates the size of a cache entry.
+
+        :param str key: key of the cache entry
+
+        :returns: size of all files in the cache entry in bytes
+        """
+        entry = os.path.join(self.directory, key)
+        size = 0
+        for name in os.listdir(entry):
+            try:
+                size += os.path.getsize(os.path.join(entry, name))
+            except OSError:
+                pass
+        return size
+
+    def evict(self, keep=None):
+        """
+        This function removes the least recently used cache entries until
+        the cache is not larger than its maximum size.
+
+        :param str keep: key of the cache entry that is never removed
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            entry = os.path.join(self.directory, key)
+            try:
+                entries.append((os.path.getmtime(entry), key, self.entry_size(key)))
+            except OSError:
+                pass
+
+        total_size = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total_size -= size
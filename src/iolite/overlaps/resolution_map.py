@@ -0,0 +1,143 @@
+"""
+This module computes the resolution (1/d^2) of every pixel of a detector
+panel as one numpy array. The geometry (panel origin, fast and slow axis,
+pixel size and the beam vector s0) is evaluated on whole arrays instead of
+calling panel.get_resolution_at_pixel once per pixel.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+# pixel to millimeter strategies that can be evaluated on whole arrays
+VECTORIZED_STRATEGIES = ("SimplePxMmStrategy", "ParallaxCorrectedPxMmStrategy")
+
+
+def pixel_to_millimeter(panel, x_px, y_px):
+    """
+    This function converts pixel coordinates to millimeter coordinates on the
+    panel, following the pixel to millimeter strategy of the panel.
+
+    :param panel: dxtbx panel
+    :param numpy array x_px: pixel coordinates along the fast axis
+    :param numpy array y_px: pixel coordinates along the slow axis
+
+    :returns: numpy arrays of the millimeter coordinates along the fast and
+              slow axis
+    """
+    strategy = type(panel.get_px_mm_strategy()).__name__
+    pixel_size = panel.get_pixel_size()
+    x_mm = x_px * pixel_size[0]
+    y_mm = y_px * pixel_size[1]
+
+    if strategy == "SimplePxMmStrategy":
+        return x_mm, y_mm
+
+    if strategy == "ParallaxCorrectedPxMmStrategy":
+        # parallax_correction_inv_rstbx as applied by dxtbx
+        mu = panel.get_px_mm_strategy().mu()
+        t0 = panel.get_px_mm_strategy().t0()
+        fast = np.array(panel.get_fast_axis())
+        slow = np.array(panel.get_slow_axis())
+        origin = np.array(panel.get_origin())
+        normal = np.cross(fast, slow)
+        if np.dot(origin, normal) < 0:
+            normal = -normal
+
+        s1 = [origin[k] + x_mm * fast[k] + y_mm * slow[k] for k in range(3)]
+        length = np.sqrt(s1[0] ** 2 + s1[1] ** 2 + s1[2] ** 2)
+        s1 = [s / length for s in s1]
+        cos_t = s1[0] * normal[0] + s1[1] * normal[1] + s1[2] * normal[2]
+        o = (1.0 / mu) - (t0 / cos_t + 1.0 / mu) * np.exp(-mu * t0 / cos_t)
+        x_mm = x_mm + (s1[0] * fast[0] + s1[1] * fast[1] + s1[2] * fast[2]) * o
+        y_mm = y_mm + (s1[0] * slow[0] + s1[1] * slow[1] + s1[2] * slow[2]) * o
+        return x_mm, y_mm
+
+    raise ValueError("Unsupported pixel to millimeter strategy: %s" % strategy)
+
+
+def resolution_map(panel, beam, x_dim, y_dim):
+    """
+    This function writes a 2D numpy array of the resolutions (1/d^2)
+    corresponding to the pixels on the image, using numpy arrays for the
+    whole panel geometry.
+
+    :param panel: dxtbx panel
+    :param beam: dxtbx beam
+    :param int x_dim: width of the image and resolution numpy array
+    :param int y_dim: height of the image and resolution numpy array
+
+    :returns: 2D numpy array containing the resolutions (1/d^2)
+    """
+    y_px, x_px = np.mgrid[0:y_dim, 0:x_dim].astype(np.float64)
+    x_mm, y_mm = pixel_to_millimeter(panel, x_px, y_px)
+    del x_px, y_px
+
+    origin = panel.get_origin()
+    fast = panel.get_fast_axis()
+    slow = panel.get_slow_axis()
+    s0 = np.array(beam.get_s0())
+    s0_length = np.sqrt(np.dot(s0, s0))
+
+    # lab coordinates of the pixels and the angle 2theta towards s0
+    dot = np.zeros((y_dim, x_dim))
+    length = np.zeros((y_dim, x_dim))
+    for k in range(3):
+        lab = origin[k] + x_mm * fast[k] + y_mm * slow[k]
+        dot += lab * s0[k]
+        length += lab * lab
+    cos_two_theta = np.clip(dot / (np.sqrt(length) * s0_length), -1.0, 1.0)
+    theta = 0.5 * np.arccos(cos_two_theta)
+
+    # d = wavelength / (2 sin(theta)) with wavelength = 1 / |s0|
+    return (2.0 * np.sin(theta) * s0_length) ** 2
+
+
+def resolution_map_per_pixel(panel, beam, x_dim, y_dim):
+    """
+    This function writes a 2D numpy array of the resolutions (1/d^2)
+    by asking the panel for the resolution of every pixel. It is slow
+    and only kept as a reference for resolution_map.
+
+    :param panel: dxtbx panel
+    :param beam: dxtbx beam
+    :param int x_dim: width of the image and resolution numpy array
+    :param int y_dim: height of the image and resolution numpy array
+
+    :returns: 2D numpy array containing the resolutions (1/d^2)
+    """
+    resolution = np.zeros((y_dim, x_dim))
+    for y in range(y_dim):
+        for x in range(x_dim):
+            d = panel.get_resolution_at_pixel(beam.get_s0(), (x, y))
+            resolution[y, x] = 1 / d ** 2
+
+    return resolution
+
+
+def geometry_key(panel, beam, x_dim, y_dim):
+    """
+    This function returns a hashable key of the geometry that determines
+    the resolution map of a panel.
+
+    :param panel: dxtbx panel
+    :param beam: dxtbx beam
+    :param int x_dim: width of the image
+    :param int y_dim: height of the image
+
+    :returns: tuple describing the panel and beam geometry
+    """
+    strategy = panel.get_px_mm_strategy()
+    strategy_params = ()
+    if type(strategy).__name__ == "ParallaxCorrectedPxMmStrategy":
+        strategy_params = (strategy.mu(), strategy.t0())
+    return (
+        tuple(panel.get_origin()),
+        tuple(panel.get_fast_axis()),
+        tuple(panel.get_slow_axis()),
+        tuple(panel.get_pixel_size()),
+        type(strategy).__name__,
+        strategy_params,
+        tuple(beam.get_s0()),
+        x_dim,
+        y_dim,
+    )
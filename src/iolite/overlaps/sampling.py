@@ -0,0 +1,99 @@
+"""
+This module chooses a subset of the images of a dataset for a quick estimate
+of the overlap ratios and computes confidence intervals of the estimate.
+
+The overall overlap ratios of overlapping_spots are averages over the images
+of a value per image, so they are estimated by the average over a sample of
+the images. The confidence interval is the standard error of the average,
+with the finite population correction as the images are sampled without
+replacement, times the quantile of the normal distribution.
+
+The images are returned in an order in which every leading part of the
+sample is spread over the whole dataset, so that the estimate can be stopped
+early once the interval is narrow enough.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+# quantile of the normal distribution for a 95% confidence interval
+Z_95 = 1.959963984540054
+
+# minimum number of images before an estimate may stop early, as the
+# standard error of fewer images is not reliable
+MIN_FRAMES = 10
+
+
+def radical_inverse(i):
+    """
+    This function mirrors the binary digits of an integer at the binary
+    point (van der Corput sequence), e.g. 1 -> 0.5, 2 -> 0.25, 3 -> 0.75.
+
+    :param int i: non-negative integer
+
+    :returns: float in [0, 1)
+    """
+    inverse = 0.0
+    digit = 0.5
+    while i:
+        if i & 1:
+            inverse += digit
+        i >>= 1
+        digit /= 2
+    return inverse
+
+
+def sample_frames(z_dim, fraction, method="even", seed=0):
+    """
+    This function chooses the images of a sample of a dataset and the order
+    in which they are processed. The last image of the dataset is always
+    part of the sample and comes first, as the overlap ratios per shoebox are
+    normalised by its number of shoeboxes.
+
+    :param int z_dim: number of images in the dataset
+    :param float fraction: fraction of the images in the sample (0 < fraction <= 1)
+    :param str method: "even" for evenly spaced images, processed in van der
+                       Corput order, or "random" for images drawn at random
+                       with a fixed seed (default: "even")
+    :param int seed: seed of the random sample (default: 0)
+
+    :returns: numpy array of the indices of the images in processing order
+    """
+    assert 0 < fraction <= 1
+    num_frames = min(z_dim, max(1, int(np.ceil(fraction * z_dim))))
+
+    if method == "even":
+        frames = np.unique(np.round(np.linspace(0, z_dim - 1, num_frames)).astype(int))
+        order = sorted(range(len(frames)), key=radical_inverse)
+        frames = frames[order]
+    elif method == "random":
+        frames = np.random.RandomState(seed).permutation(z_dim)[:num_frames]
+    else:
+        raise ValueError("Unknown sampling method %s" % method)
+
+    last = z_dim - 1
+    return np.concatenate([[last], frames[frames != last]]).astype(int)[:num_frames]
+
+
+def mean_and_interval(values, population, z=Z_95):
+    """
+    This function computes the average of values per image over a sample of
+    images and the half width of its confidence interval.
+
+    :param numpy array values: 2D array of the values (one row per image)
+    :param int population: number of images in the dataset
+    :param float z: quantile of the normal distribution (default: 95%)
+
+    :returns: numpy arrays of the averages and of the half widths of the
+              confidence intervals, the half widths are infinite for fewer
+              than two images
+    """
+    values = np.asarray(values, dtype=np.float64)
+    num_frames = len(values)
+    mean = values.mean(axis=0)
+    if num_frames < 2:
+        return mean, np.full(mean.shape, np.inf)
+
+    correction = max(0.0, 1 - num_frames / population)
+    standard_error = np.sqrt(values.var(axis=0, ddof=1) / num_frames * correction)
+    return mean, z * standard_error
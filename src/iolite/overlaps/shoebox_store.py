@@ -0,0 +1,318 @@
+"""
+This module provides a columnar store for the shoeboxes of a dataset, as an
+alternative to one pickle file per image. The store is a directory of chunks
+of consecutive images. Every chunk keeps the bounding boxes, panels,
+resolutions and masks of its shoeboxes as separate contiguous columns in
+.npy files, together with an index of the first shoebox of every image.
+The columns are memory-mapped when they are read, so that only the columns
+and images that are needed are loaded from disk.
+
+The files of a chunk whose first image is f are
+
+    f_bbox.npy          bounding boxes (x0, x1, y0, y1, z0, z1) of the shoeboxes
+    f_panel.npy         panel of each shoebox
+    f_d.npy             resolution d of each shoebox
+    f_mask.npy          masks of all shoeboxes, flattened and concatenated,
+                        as int32 or as uint8
+    f_mask_offsets.npy  index of the first mask value of each shoebox
+    f_frames.npy        index of the first shoebox of each image
+
+The frames file is written last, under a temporary name that is renamed
+once it is complete, so a chunk is only visible to readers once all of its
+files are written. A store is written into an empty directory: clear_store
+removes the chunks of an earlier store, and the reader refuses chunks whose
+images overlap.
+"""
+from __future__ import absolute_import, division, print_function
+
+import glob
+import os
+
+import numpy as np
+
+COLUMNS = ("bbox", "panel", "d", "mask", "mask_offsets", "frames")
+
+
+class ShoeboxStoreWriter:
+    """ A class that writes the shoeboxes of consecutive images to a
+        shoebox store, one chunk of images at a time."""
+
+    def __init__(self, directory, first_frame, chunk_size=100, mask_dtype=np.int32):
+        """
+        The writer is initialized with the directory of the store, the index
+        of the first image that is written, the number of images per chunk 
+        and the type the masks are stored as.
+
+        :param str directory: directory of the shoebox store
+        :param int first_frame: index of the first image that is written
+        :param int chunk_size: number of images per chunk (default: 100)
+        :param mask_dtype: numpy type of the stored masks, np.uint8 holds
+                           all mask flags of dials (default: np.int32)
+        """
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.mask_dtype = np.dtype(mask_dtype)
+        self.next_frame = first_frame
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another writer created the store at the same time
+                if not os.path.isdir(directory):
+                    raise
+        self.start_chunk()
+
+    def start_chunk(self):
+        """
+        This function starts a new chunk at the next image.
+        """
+        self.chunk_first = self.next_frame
+        self.bbox = []
+        self.panel = []
+        self.d = []
+        self.mask = []
+        self.frames = [0]
+
+    def append(self, bbox, panel, d, masks):
+        """
+        This function adds the shoeboxes of the next image to the store.
+
+        :param numpy array bbox: 2D array of the bounding boxes of the shoeboxes
+        :param numpy array panel: 1D array of the panels of the shoeboxes
+        :param numpy array d: 1D array of the resolutions d of the shoeboxes
+        :param list masks: list of 3D numpy arrays of the masks of the shoeboxes
+        """
+        bbox = np.asarray(bbox, dtype=np.int32).reshape(-1, 6)
+        assert len(panel) == len(bbox)
+        assert len(d) == len(bbox)
+        assert len(masks) == len(bbox)
+
+        self.bbox.append(bbox)
+        self.panel.append(np.asarray(panel, dtype=np.uint16))
+        self.d.append(np.asarray(d, dtype=np.float64))
+        for mask in masks:
+            mask = np.asarray(mask).reshape(-1)
+            if len(mask) and mask.max() > np.iinfo(self.mask_dtype).max:
+                raise ValueError("Mask value does not fit into %s" % self.mask_dtype)
+            self.mask.append(mask.astype(self.mask_dtype))
+        self.frames.append(self.frames[-1] + len(bbox))
+
+        self.next_frame += 1
+        if len(self.frames) > self.chunk_size:
+            self.flush()
+
+    def append_reflections(self, reflections):
+        """
+        This function adds the shoeboxes of the reflection table of the
+        next image to the store.
+
+        :param dials_array_family_flex_ext.reflection_table reflections: reflection table
+                                                                        of the image
+        """
+        bbox = np.stack([p.as_numpy_array() for p in reflections["bbox"].parts()], 1)
+        masks = [sbox.mask.as_numpy_array() for sbox in reflections["shoebox"]]
+        self.append(
+            bbox,
+            reflections["panel"].as_numpy_array(),
+            reflections["d"].as_numpy_array(),
+            masks,
+        )
+
+    def flush(self):
+        """
+        This function writes the current chunk to disk, if it contains
+        any images, and starts a new chunk.
+        """
+        if len(self.frames) == 1:
+            return
+
+        def concatenate(arrays, dtype, shape):
+            if arrays:
+                return np.concatenate(arrays)
+            return np.zeros(shape, dtype=dtype)
+
+        mask_sizes = [len(mask) for mask in self.mask]
+        columns = {
+            "bbox": concatenate(self.bbox, np.int32, (0, 6)),
+            "panel": concatenate(self.panel, np.uint16, 0),
+            "d": concatenate(self.d, np.float64, 0),
+            "mask": concatenate(self.mask, self.mask_dtype, 0),
+            "mask_offsets": np.concatenate([[0], np.cumsum(mask_sizes)]).astype(
+                np.int64
+            ),
+            "frames": np.array(self.frames, dtype=np.int64),
+        }
+        for name in COLUMNS[:-1]:
+            np.save(chunk_path(self.directory, self.chunk_first, name), columns[name])
+
+        # the frames file makes the chunk visible, so it appears complete
+        filename = chunk_path(self.directory, self.chunk_first, "frames")
+        with open(filename + ".tmp", "wb") as outfile:
+            np.save(outfile, columns["frames"])
+        os.replace(filename + ".tmp", filename)
+
+        self.start_chunk()
+
+    def close(self):
+        """
+        This function writes the last chunk to disk.
+        """
+        self.flush()
+
+
+def clear_store(directory):
+    """
+    This function removes the chunks of an earlier shoebox store from a
+    directory, so that a new store can be written into it.
+
+    :param str directory: directory of the shoebox store
+    """
+    for name in COLUMNS:
+        pattern = os.path.join(directory, "*_%s.npy" % name)
+        for filename in glob.glob(pattern) + glob.glob(pattern + ".tmp"):
+            os.remove(filename)
+
+
+def chunk_path(directory, first_frame, name):
+    """
+    This function returns the path of a column of a chunk.
+
+    :param str directory: directory of the shoebox store
+    :param int first_frame: index of the first image of the chunk
+    :param str name: name of the column
+
+    :returns: path of the .npy file
+    """
+    return os.path.join(directory, "%d_%s.npy" % (first_frame, name))
+
+
+class ShoeboxStore:
+    """ A class that reads the shoeboxes of the images of a dataset from a
+        shoebox store."""
+
+    def __init__(self, directory):
+        """
+        The store is opened by reading the image index of every chunk.
+
+        :param str directory: directory of the shoebox store
+        """
+        self.directory = directory
+        self.columns = {}
+
+        chunks = []
+        for filename in glob.glob(os.path.join(directory, "*_frames.npy")):
+            first = int(os.path.basename(filename).split("_")[0])
+            chunks.append((first, np.load(filename)))
+        assert chunks, "No shoebox store found in %s" % directory
+        chunks.sort(key=lambda chunk: chunk[0])
+
+        self.chunk_first = np.array([first for first, _ in chunks])
+        self.frames = [frames for _, frames in chunks]
+
+        # chunks left over from an earlier store would be read instead of
+        # the images of this one
+        for first, frames, next_first in zip(
+            self.chunk_first[:-1], self.frames[:-1], self.chunk_first[1:]
+        ):
+            if first + len(frames) - 1 > next_first:
+                raise ValueError(
+                    "Overlapping chunks %d and %d in shoebox store %s"
+                    % (first, next_first, directory)
+                )
+
+    def __len__(self):
+        """
+        :returns: number of images in the store
+        """
+        return int(self.chunk_first[-1]) + len(self.frames[-1]) - 1
+
+    def column(self, chunk, name):
+        """
+        This function memory-maps a column of a chunk.
+
+        :param int chunk: index of the chunk
+        :param str name: name of the column
+
+        :returns: memory-mapped numpy array
+        """
+        key = (chunk, name)
+        if key not in self.columns:
+            filename = chunk_path(self.directory, self.chunk_first[chunk], name)
+            self.columns[key] = np.load(filename, mmap_mode="r")
+        return self.columns[key]
+
+    def locate(self, z):
+        """
+        This function finds the chunk of an image and the rows of its shoeboxes.
+
+        :param int z: index of the image in the dataset
+
+        :returns: index of the chunk, first and last row of the shoeboxes
+        """
+        chunk = np.searchsorted(self.chunk_first, z, side="right") - 1
+        frames = self.frames[chunk]
+        frame = z - self.chunk_first[chunk]
+        assert chunk >= 0 and frame < len(frames) - 1, "Image %d not in store" % z
+        return chunk, frames[frame], frames[frame + 1]
+
+    def frame_columns(self, z, names=("bbox", "panel", "d")):
+        """
+        This function reads columns of the shoeboxes of one image.
+
+        :param int z: index of the image in the dataset
+        :param tuple names: names of the columns
+
+        :returns: dictionary of numpy arrays of the columns
+        """
+        chunk, first, last = self.locate(z)
+        return dict((name, self.column(chunk, name)[first:last]) for name in names)
+
+    def frame_masks(self, z):
+        """
+        This function reads the masks of the shoeboxes of one image.
+
+        :param int z: index of the image in the dataset
+
+        :returns: list of 3D numpy arrays of the masks
+        """
+        chunk, first, last = self.locate(z)
+        bbox = self.column(chunk, "bbox")[first:last]
+        offsets = self.column(chunk, "mask_offsets")[first : last + 1]
+        mask = self.column(chunk, "mask")
+
+        masks = []
+        for (x0, x1, y0, y1, z0, z1), start, end in zip(
+            bbox, offsets[:-1], offsets[1:]
+        ):
+            masks.append(mask[start:end].reshape(z1 - z0, y1 - y0, x1 - x0))
+        return masks
+
+    def frame(self, z):
+        """
+        This function reads the reflection table of one image, with the
+        bounding boxes, panels, resolutions and shoebox masks. It is only
+        needed by the pairwise engine of overlapping_spots, the other 
+        engines read frame_columns and frame_masks directly.
+
+        :param int z: index of the image in the dataset
+
+        :returns: reflection table of the image
+        """
+        from dials.array_family import flex
+
+        columns = self.frame_columns(z)
+        masks = self.frame_masks(z)
+
+        reflections = flex.reflection_table()
+        reflections["bbox"] = flex.int6([tuple(b) for b in columns["bbox"].tolist()])
+        reflections["panel"] = flex.size_t(columns["panel"].tolist())
+        reflections["d"] = flex.double(columns["d"].tolist())
+        reflections["shoebox"] = flex.shoebox(
+            reflections["panel"], reflections["bbox"], allocate=False
+        )
+
+        shoebox = reflections["shoebox"]
+        for index, mask in enumerate(masks):
+            shoebox[index].mask = flex.int(np.ascontiguousarray(mask, dtype=np.int32))
+
+        return reflections
@@ -0,0 +1,108 @@
+"""
+This module assigns resolutions (1/d^2) to equally sized resolution bins
+between a minimum and a maximum resolution. All functions work on whole
+numpy arrays, so that the resolutions of every pixel of an image or of
+every shoebox on an image are binned at once.
+
+A resolution d2 goes into the bin with the index
+
+    floor((d2 - vmin - intervall / 2) / intervall)
+
+clipped to the range of bins, where intervall = (vmax - vmin) / num_bins.
+Resolutions at or below vmin therefore go into the first bin and
+resolutions at or above vmax go into the last bin.
+
+The bin indices are stored in the smallest unsigned integer type that holds
+all indices, e.g. uint8 for up to 256 bins, so that the bin index of every
+pixel of an image takes one byte per pixel.
+"""
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+# number of resolutions that are binned at once
+BLOCK_SIZE = 2 ** 20
+
+
+def bin_centres(vmin, vmax, num_bins):
+    """
+    This function calculates the average resolution of the resolution bins.
+
+    :param float vmin: minimum resolution in 1/d^2
+    :param float vmax: maximum resolution in 1/d^2
+    :param int num_bins: number of resolution bins
+
+    :returns: list of average resolution of resolution bins
+              and resolution intervall of resolution bins
+    """
+    intervall = (vmax - vmin) / (num_bins)
+    d2_list = vmin + ((2 * np.arange(num_bins) + 1) / 2) * intervall
+    return d2_list.tolist(), intervall
+
+
+def bin_dtype(num_bins):
+    """
+    This function finds the smallest unsigned integer type that holds the
+    indices of all resolution bins.
+
+    :param int num_bins: number of resolution bins
+
+    :returns: numpy dtype
+    """
+    return np.min_scalar_type(max(num_bins - 1, 0))
+
+
+def bin_index(d2, vmin, vmax, num_bins):
+    """
+    This function assigns resolutions to resolution bins. The resolutions
+    are binned in blocks, so that the temporary arrays stay small.
+
+    :param numpy array d2: array of resolutions in 1/d^2
+    :param float vmin: minimum resolution in 1/d^2
+    :param float vmax: maximum resolution in 1/d^2
+    :param int num_bins: number of resolution bins
+
+    :returns: numpy array of the same shape as d2 containing the indices of
+              the resolution bins, of the type given by bin_dtype
+    """
+    d2 = np.asarray(d2)
+    intervall = (vmax - vmin) / (num_bins)
+    index = np.empty(d2.shape, dtype=bin_dtype(num_bins))
+
+    d2_1d = d2.reshape(-1)
+    index_1d = index.reshape(-1)
+    for start in range(0, len(d2_1d), BLOCK_SIZE):
+        block = np.subtract(d2_1d[start : start + BLOCK_SIZE], vmin, dtype=np.float64)
+        block -= intervall / 2
+        block /= intervall
+        np.floor(block, out=block)
+        np.clip(block, 0, num_bins - 1, out=block)
+        index_1d[start : start + BLOCK_SIZE] = block
+    return index
+
+
+def bin_weight(index_array, num_bins):
+    """
+    This function counts how many entries go into each resolution bin.
+
+    :param numpy array index_array: array of indices of resolution bins
+    :param int num_bins: number of resolution bins
+
+    :returns: list of weight of bins
+    """
+    return np.bincount(index_array.reshape(-1), minlength=num_bins).tolist()
+
+
+def bin_sum(index_array, values, num_bins):
+    """
+    This function sums up values per resolution bin.
+
+    :param numpy array index_array: array of indices of resolution bins
+    :param numpy array values: array of values of the same shape as index_array
+    :param int num_bins: number of resolution bins
+
+    :returns: numpy array of the sum of the values in each bin
+    """
+    return np.bincount(
+        index_array.reshape(-1), weights=values.reshape(-1), minlength=num_bins
+    )
@@ -0,0 +1,89 @@
+import tracemalloc
+
+import numpy as np
+from src.iolite.ice_ring.background_sum import BackgroundSum, pairwise_sum
+
+
+def test_background_sum():
+    # Generate random images with masked pixels and strong spots
+    rng = np.random.RandomState(0)
+    y_dim, x_dim = 50, 60
+    images = []
+    for n in range(5):
+        data = rng.randint(-2, 2 ** 31 - 1, size=(y_dim, x_dim)).astype(np.int32)
+        mask = rng.uniform(size=(y_dim, x_dim)) > 0.1
+        strong = rng.choice(y_dim * x_dim, 100, replace=False)
+        images.append((data, mask, strong))
+
+    # Sum up the valid pixels
+    expected_data = np.zeros((y_dim, x_dim))
+    expected_mask = np.zeros((y_dim, x_dim), dtype=int)
+    for data, mask, strong in images:
+        valid = mask.copy()
+        valid.reshape(-1)[strong] = False
+        expected_data += np.where(valid, data.astype(np.float64), 0)
+        expected_mask += valid
+
+    # Test output
+    background_sum = BackgroundSum(y_dim, x_dim)
+    for image in images:
+        background_sum.add(*image)
+    assert background_sum.summed_data.dtype == np.float64
+    assert background_sum.summed_mask.dtype == np.uint32
+    assert np.array_equal(background_sum.summed_data, expected_data)
+    assert np.array_equal(background_sum.summed_mask, expected_mask)
+
+    # Test that the sums of two halves can be merged
+    first = BackgroundSum(y_dim, x_dim)
+    second = BackgroundSum(y_dim, x_dim)
+    for image in images[:2]:
+        first.add(*image)
+    for image in images[2:]:
+        second.add(*image)
+    first.merge(second)
+    assert np.array_equal(first.summed_data, expected_data)
+    assert np.array_equal(first.summed_mask, expected_mask)
+
+
+def test_background_sum_allocation():
+    y_dim, x_dim = 500, 600
+    data = np.ones((y_dim, x_dim), dtype=np.int32)
+    mask = np.ones((y_dim, x_dim), dtype=bool)
+    background_sum = BackgroundSum(y_dim, x_dim)
+    background_sum.add(data, mask)
+
+    # Test that adding an image allocates no image-sized array
+    tracemalloc.start()
+    background_sum.add(data, mask, np.arange(100))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < y_dim * x_dim
+
+
+def test_pairwise_sum():
+    # Generate random partial sums of blocks of images
+    rng = np.random.RandomState(1)
+    y_dim, x_dim = 20, 30
+    images = [
+        (
+            rng.randint(0, 2 ** 20, size=(y_dim, x_dim)),
+            rng.uniform(size=(y_dim, x_dim)) > 0.2,
+        )
+        for n in range(13)
+    ]
+    serial = BackgroundSum(y_dim, x_dim)
+    for image in images:
+        serial.add(*image)
+
+    # Test output for any number of blocks
+    for num_blocks in range(1, 14):
+        blocks = np.array_split(np.arange(len(images)), num_blocks)
+        sums = []
+        for block in blocks:
+            background_sum = BackgroundSum(y_dim, x_dim)
+            for n in block:
+                background_sum.add(*images[n])
+            sums.append(background_sum)
+        total = pairwise_sum(iter(sums))
+        assert np.array_equal(total.summed_data, serial.summed_data)
+        assert np.array_equal(total.summed_mask, serial.summed_mask)
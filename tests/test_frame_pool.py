@@ -0,0 +1,16 @@
+import functools
+from src.iolite.overlaps.frame_pool import map_frames
+
+
+def square_plus(z, offset):
+    return z * z + offset
+
+
+def test_map_frames():
+    function = functools.partial(square_plus, offset=0.1)
+
+    # Test output
+    serial = list(map_frames(function, range(20), 1))
+    parallel = list(map_frames(function, range(20), 3))
+    assert serial == [z * z + 0.1 for z in range(20)]
+    assert parallel == serial
@@ -94,4 +94,180 @@ def test_overlap_counter():
     assert total==3.375
     assert bg==2
     assert fg==0.5
-    assert bg_fg==0.875
\ No newline at end of file
+    assert bg_fg==0.875
+
+def test_count_overlaps_per_bin():
+    # Generate random overlap counts on a small image
+    np.random.seed(0)
+    n_background = np.random.randint(0, 4, size=(20, 30))
+    n_foreground = np.random.randint(0, 3, size=(20, 30))
+    index_array = np.random.randint(0, 5, size=600)
+
+    # Count overlaps pixel by pixel
+    count_bg = [0] * 5
+    count_fg = [0] * 5
+    count_bg_fg = [0] * 5
+    for bg, fg, index in zip(
+        n_background.reshape(-1), n_foreground.reshape(-1), index_array
+    ):
+        count_bg[index] += bg * (bg - 1) // 2
+        count_fg[index] += fg * (fg - 1) // 2
+        count_bg_fg[index] += bg * fg
+
+    # Test output
+    counter = OverlapCounter("", 5, "", "", False)
+    b, f, bf = counter.count_overlaps_per_bin(n_background, n_foreground, index_array, 5)
+    assert b.tolist() == count_bg
+    assert f.tolist() == count_fg
+    assert bf.tolist() == count_bg_fg
+
+    # Test output for counts of the overlapping pixels only
+    pixels = np.flatnonzero(n_background + n_foreground > 1)
+    b, f, bf = counter.count_overlaps_per_bin(
+        n_background.reshape(-1)[pixels].astype(np.uint16),
+        n_foreground.reshape(-1)[pixels].astype(np.uint16),
+        index_array,
+        5,
+        pixels,
+    )
+    assert b.tolist() == count_bg
+    assert f.tolist() == count_fg
+    assert bf.tolist() == count_bg_fg
+
+
+def test_reaggregate(tmpdir):
+    # Generate random overlap counts of the shoeboxes on a few images
+    rng = np.random.RandomState(0)
+    z_dim, vmin, vmax = 4, 0.01, 0.3
+    frames = []
+    for z in range(z_dim):
+        n = rng.randint(1, 20)
+        d = 1 / np.sqrt(rng.uniform(vmin, vmax, n))
+        frames.append((d, [rng.randint(0, 4, n).tolist() for i in range(4)]))
+
+    # Save the raw counts and aggregate them per image
+    raw_counts = str(tmpdir.join("overlap_counts.npz"))
+    counter = OverlapCounter(
+        "",
+        5,
+        str(tmpdir.join("expected_lists")),
+        str(tmpdir.join("expected_total")),
+        True,
+        raw_counts=raw_counts,
+    )
+    dataset_counts = [[0] * 5 for i in range(12)]
+    for d, counts in frames:
+        _, image_dataset_counts = counter.aggregate_image_reflection(
+            1 / d ** 2, counts, vmin, vmax, z_dim, 5
+        )
+        counter.add_counts(dataset_counts, image_dataset_counts)
+        counter.collect_raw_reflection(
+            (d,) + tuple(np.asarray(c, dtype=np.uint16) for c in counts)
+        )
+    counter.write_raw_counts(z_dim, 1, 1, vmin, vmax)
+    d2_list, _ = counter.prepare_bins_shoebox(vmax, vmin, 5)
+    expected = counter.write_results_reflection(
+        dataset_counts, len(frames[-1][0]), d2_list
+    )
+
+    # Test output
+    counter = OverlapCounter(
+        "",
+        5,
+        str(tmpdir.join("overlap_lists")),
+        str(tmpdir.join("overlap_total")),
+        True,
+        raw_counts=raw_counts,
+    )
+    assert counter.reaggregate() == [expected]
+
+
+def test_reaggregate_bin_counts(tmpdir):
+    # Save random raw overlap counts of the shoeboxes on a few images
+    rng = np.random.RandomState(1)
+    z_dim, vmin, vmax = 3, 0.01, 0.3
+    raw_counts = str(tmpdir.join("overlap_counts.npz"))
+    counter = OverlapCounter("", 5, "", "", True, raw_counts=raw_counts)
+    for z in range(z_dim):
+        n = rng.randint(1, 20)
+        d = 1 / np.sqrt(rng.uniform(vmin, vmax, n))
+        counter.collect_raw_reflection(
+            (d,) + tuple(rng.randint(0, 4, n).astype(np.uint16) for i in range(4))
+        )
+    counter.write_raw_counts(z_dim, 1, 1, vmin, vmax)
+
+    def reaggregate(num_bins, name):
+        counter = OverlapCounter(
+            "",
+            num_bins,
+            str(tmpdir.join(name + "_lists")),
+            str(tmpdir.join(name + "_total")),
+            True,
+            raw_counts=raw_counts,
+        )
+        return counter.reaggregate()
+
+    # Test output of one set of output files per number of bins
+    overall = reaggregate([5, 8], "multi")
+    assert overall == reaggregate(5, "single")
+    for num_bins in (5, 8):
+        reaggregate(num_bins, "single")
+        for kind in ("lists", "total"):
+            single = tmpdir.join("single_%s_shoebox.txt" % kind).read()
+            multi = tmpdir.join("multi_%s_%d_shoebox.txt" % (kind, num_bins)).read()
+            assert single == multi
+
+
+def test_collect_raw_pixel(tmpdir):
+    # Generate random overlap counts of the overlapping pixels on a few images
+    rng = np.random.RandomState(3)
+    z_dim, num_pixels = 5, 600
+    expected = np.zeros((3, num_pixels), dtype=np.uint32)
+    raw_counts = str(tmpdir.join("overlap_counts.npz"))
+    counter = OverlapCounter("", 5, "", "", False, raw_counts=raw_counts)
+    for z in range(z_dim):
+        pixels = np.sort(rng.choice(num_pixels, rng.randint(1, 100), replace=False))
+        counts = [rng.randint(0, 4, len(pixels)).astype(np.int64) for i in range(3)]
+        for total, counts_im in zip(expected, counts):
+            total[pixels] += counts_im.astype(np.uint32)
+        counter.collect_raw_pixel([pixels] + counts)
+    counter.collect_raw_pixel(None)
+    counter.write_raw_counts(z_dim, 20, 30, 0.01, 0.3)
+
+    # Test output
+    raw = np.load(raw_counts)
+    pixels = np.flatnonzero(expected.any(axis=0))
+    assert set(raw["pixels"].tolist()) >= set(pixels.tolist())
+    for name, total in zip(("pixel_bg", "pixel_fg", "pixel_bg_fg"), expected):
+        assert raw[name].tolist() == total[raw["pixels"]].tolist()
+
+
+def test_aggregate_image_reflection():
+    # Generate random overlap counts of the shoeboxes on one image
+    rng = np.random.RandomState(2)
+    z_dim, vmin, vmax, num_bins = 3, 0.01, 0.3, 7
+    d2_shoebox = rng.uniform(vmin, vmax, 200)
+    counts = [rng.randint(0, 5, 200).tolist() for i in range(4)]
+
+    # Add the counts to the bins shoebox by shoebox
+    counter = OverlapCounter("", num_bins, "", "", True)
+    _, intervall = counter.prepare_bins_shoebox(vmax, vmin, num_bins)
+    index_array, weight = counter.assign_shoebox_to_resolution_bin(
+        d2_shoebox, vmin, vmax, intervall
+    )
+    sums = [[0] * num_bins for i in range(6)]
+    for f, fb, bf, b, i in zip(*counts + [index_array]):
+        for k, count in enumerate([f, fb, bf, b, f + fb + b, f + bf + b]):
+            sums[k][i] += count
+    ratios = [
+        [s / (w * z_dim) if w > 0 else 0 for s, w in zip(count, weight)]
+        for count in sums
+    ]
+    sums_dataset = [[s / z_dim for s in count] for count in sums]
+
+    # Test output
+    image_counts, dataset_counts = counter.aggregate_image_reflection(
+        d2_shoebox, counts, vmin, vmax, z_dim, num_bins
+    )
+    assert image_counts == sums[:5]
+    assert np.allclose(dataset_counts, ratios + sums_dataset, rtol=1e-12, atol=0)
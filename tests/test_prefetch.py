@@ -0,0 +1,51 @@
+import threading
+import time
+
+import pytest
+from src.iolite.overlaps.prefetch import FramePrefetcher
+
+
+def test_frame_prefetcher():
+    loaded = []
+    lock = threading.Lock()
+
+    def load(z):
+        time.sleep(0.001)
+        with lock:
+            loaded.append(z)
+        return z * z
+
+    # Test output
+    prefetcher = FramePrefetcher(load, range(20), depth=3)
+    for z, reflections in prefetcher:
+        assert reflections == z * z
+        # at most depth images wait in the queue and one is being loaded
+        with lock:
+            assert len(loaded) <= z + 1 + 3 + 1
+        time.sleep(0.002)
+    assert loaded == list(range(20))
+    assert prefetcher.io_wait > 0
+    assert prefetcher.compute > 0
+
+
+def test_frame_prefetcher_error():
+    def load(z):
+        if z == 4:
+            raise IOError("Cannot read image %d" % z)
+        return z
+
+    # Test that the images before the error are processed
+    processed = []
+    with pytest.raises(IOError):
+        for z, reflections in FramePrefetcher(load, range(10), depth=2):
+            processed.append(z)
+    assert processed == [0, 1, 2, 3]
+
+
+def test_frame_prefetcher_stop():
+    # Test that the background thread stops when the images are not needed
+    threads = threading.active_count()
+    for z, reflections in FramePrefetcher(lambda z: z, range(1000), depth=1):
+        if z == 2:
+            break
+    assert threading.active_count() == threads
@@ -0,0 +1,167 @@
+import numpy as np
+from src.iolite.overlaps.rasterize import (
+    ShoeboxMasks,
+    bbox_pairs,
+    count_overlaps_per_shoebox,
+    overlap_window,
+    rasterize_bg_and_fg,
+    sparse_bg_and_fg,
+)
+
+
+class Mask:
+    """Stand-in for a flex.int mask."""
+
+    def __init__(self, array):
+        self.array = array
+
+    def as_numpy_array(self):
+        return self.array.copy()
+
+
+class Shoebox:
+    """Stand-in for a dials shoebox."""
+
+    def __init__(self, bbox, mask):
+        self.bbox = bbox
+        self.mask = Mask(mask)
+
+
+def random_shoeboxes(num, y_dim, x_dim, z):
+    np.random.seed(1)
+    shoebox = []
+    for i in range(num):
+        x0 = np.random.randint(-3, x_dim - 2)
+        y0 = np.random.randint(-3, y_dim - 2)
+        x1 = x0 + np.random.randint(3, 8)
+        y1 = y0 + np.random.randint(3, 8)
+        mask = np.random.choice([0, 1, 3, 5, 19, 21], size=(1, y1 - y0, x1 - x0))
+        shoebox.append(Shoebox((x0, x1, y0, y1, z, z + 1), mask.astype(np.int32)))
+    return shoebox
+
+
+def reference_bg_and_fg(shoebox, pairs, y_dim, x_dim, z):
+    # The counting edge by edge as done before the rasterization
+    n_background = np.zeros(dtype=int, shape=(y_dim, x_dim))
+    n_foreground = np.zeros(dtype=int, shape=(y_dim, x_dim))
+    masks = [s.mask.as_numpy_array() for s in shoebox]
+    for index1, index2 in pairs:
+        x0, x1, y0, y1 = overlap_window(
+            shoebox[index1].bbox, shoebox[index2].bbox, y_dim, x_dim
+        )
+        for index in (index1, index2):
+            x0m, x1m, y0m, y1m, z0m, _ = shoebox[index].bbox
+            sub_mask = masks[index][
+                (z - z0m), (y0 - y0m) : (y1 - y0m), (x0 - x0m) : (x1 - x0m)
+            ]
+            n_background[y0:y1, x0:x1] += (sub_mask & 3) == 3
+            n_foreground[y0:y1, x0:x1] += (sub_mask & 5) == 5
+            sub_mask[sub_mask == 3] = 0
+            sub_mask[sub_mask == 5] = 0
+    return n_background, n_foreground
+
+
+def find_pairs(shoebox, y_dim, x_dim):
+    # Find the overlapping pairs
+    pairs = []
+    for index1 in range(len(shoebox)):
+        for index2 in range(index1):
+            b1 = shoebox[index1].bbox
+            b2 = shoebox[index2].bbox
+            if (
+                max(b1[0], b2[0], 0) < min(b1[1], b2[1], x_dim)
+                and max(b1[2], b2[2], 0) < min(b1[3], b2[3], y_dim)
+            ):
+                pairs.append((index1, index2))
+    return pairs
+
+
+def columns(shoebox):
+    # The bounding boxes and masks of the shoeboxes as numpy columns
+    return np.array([s.bbox for s in shoebox]), ShoeboxMasks(shoebox)
+
+
+def test_bbox_pairs():
+    y_dim, x_dim, z = 30, 40, 2
+    shoebox = random_shoeboxes(60, y_dim, x_dim, z)
+    bbox, _ = columns(shoebox)
+
+    # Test output
+    pairs = bbox_pairs(bbox, y_dim, x_dim)
+    assert sorted(map(tuple, pairs)) == sorted(find_pairs(shoebox, y_dim, x_dim))
+    assert bbox_pairs(np.zeros((0, 6), dtype=np.int32), y_dim, x_dim) == []
+
+
+def test_rasterize_bg_and_fg():
+    y_dim, x_dim, z = 30, 40, 2
+    shoebox = random_shoeboxes(60, y_dim, x_dim, z)
+    pairs = find_pairs(shoebox, y_dim, x_dim)
+
+    n_background, n_foreground = rasterize_bg_and_fg(
+        *columns(shoebox), pairs, y_dim, x_dim, z
+    )
+    bg, fg = reference_bg_and_fg(shoebox, pairs, y_dim, x_dim, z)
+
+    # Test output
+    assert len(pairs) > 0
+    assert np.array_equal(n_background, bg)
+    assert np.array_equal(n_foreground, fg)
+
+
+def test_sparse_bg_and_fg():
+    y_dim, x_dim, z = 30, 40, 2
+    shoebox = random_shoeboxes(60, y_dim, x_dim, z)
+    pairs = find_pairs(shoebox, y_dim, x_dim)
+
+    pixels, background, foreground = sparse_bg_and_fg(
+        *columns(shoebox), pairs, y_dim, x_dim, z
+    )
+    bg, fg = reference_bg_and_fg(shoebox, pairs, y_dim, x_dim, z)
+
+    # Test output
+    assert background.dtype == np.uint16
+    assert foreground.dtype == np.uint16
+    assert np.array_equal(pixels, np.flatnonzero(bg + fg))
+    assert np.array_equal(background, bg.reshape(-1)[pixels])
+    assert np.array_equal(foreground, fg.reshape(-1)[pixels])
+
+
+def test_count_overlaps_per_shoebox():
+    y_dim, x_dim, z = 30, 40, 2
+    shoebox = random_shoeboxes(60, y_dim, x_dim, z)
+
+    # Count overlaps pair by pair
+    no_shoeboxes = len(shoebox)
+    fg_fg = [0] * no_shoeboxes
+    fg_bg = [0] * no_shoeboxes
+    bg_fg = [0] * no_shoeboxes
+    bg_bg = [0] * no_shoeboxes
+    for index1 in range(no_shoeboxes):
+        for index2 in range(index1):
+            b1 = shoebox[index1].bbox
+            b2 = shoebox[index2].bbox
+            x0, x1 = max(b1[0], b2[0], 0), min(b1[1], b2[1], x_dim)
+            y0, y1 = max(b1[2], b2[2], 0), min(b1[3], b2[3], y_dim)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            m1 = shoebox[index1].mask.as_numpy_array()[
+                0, (y0 - b1[2]) : (y1 - b1[2]), (x0 - b1[0]) : (x1 - b1[0])
+            ]
+            m2 = shoebox[index2].mask.as_numpy_array()[
+                0, (y0 - b2[2]) : (y1 - b2[2]), (x0 - b2[0]) : (x1 - b2[0])
+            ]
+            fg1, bg1 = (m1 & 5) == 5, (m1 & 3) == 3
+            fg2, bg2 = (m2 & 5) == 5, (m2 & 3) == 3
+            fg_fg[index1] += np.any(fg1 & fg2)
+            fg_fg[index2] += np.any(fg1 & fg2)
+            bg_bg[index1] += np.any(bg1 & bg2)
+            bg_bg[index2] += np.any(bg1 & bg2)
+            fg_bg[index1] += np.any(fg1 & bg2)
+            fg_bg[index2] += np.any(bg1 & fg2)
+            bg_fg[index1] += np.any(bg1 & fg2)
+            bg_fg[index2] += np.any(fg1 & bg2)
+
+    # Test output
+    counts = count_overlaps_per_shoebox(*columns(shoebox), y_dim, x_dim, z)
+    assert sum(fg_fg) > 0
+    assert counts == (fg_fg, fg_bg, bg_fg, bg_bg)
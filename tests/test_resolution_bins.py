@@ -0,0 +1,72 @@
+import random
+import numpy as np
+from src.iolite.resolution_bins import (
+    bin_centres,
+    bin_dtype,
+    bin_index,
+    bin_sum,
+    bin_weight,
+)
+
+
+def test_bin_index():
+    vmin, vmax, num_bins = 0.0013, 0.2531, 50
+    intervall = (vmax - vmin) / num_bins
+
+    # Generate resolutions including the edges of the resolution range
+    random.seed(0)
+    d2 = [vmin, vmax] + [random.uniform(vmin, vmax) for i in range(1000)]
+    d2 += [vmin + i * intervall for i in range(num_bins)]
+
+    # Assign the resolutions one by one
+    index_list = []
+    for value in d2:
+        if value == vmin:
+            index = 0
+        elif value >= vmax:
+            index = num_bins - 1
+        else:
+            index = int((value - vmin - intervall / 2) / intervall)
+        index_list.append(index)
+
+    # Test output
+    index_array = bin_index(np.array(d2), vmin, vmax, num_bins)
+    assert index_array.tolist() == index_list
+    assert index_array.dtype == np.uint8
+    assert bin_index(np.array([vmax * 2]), vmin, vmax, num_bins)[0] == num_bins - 1
+    assert bin_weight(index_array, num_bins) == [
+        index_list.count(i) for i in range(num_bins)
+    ]
+    assert np.array_equal(
+        bin_sum(index_array, np.ones(len(d2)), num_bins),
+        bin_weight(index_array, num_bins),
+    )
+
+
+def test_bin_centres():
+    d2_list, intervall = bin_centres(0.0, 1.0, 4)
+
+    # Test output
+    assert intervall == 0.25
+    assert d2_list == [0.125, 0.375, 0.625, 0.875]
+
+
+def test_bin_dtype():
+    # Test output
+    assert bin_dtype(1) == np.uint8
+    assert bin_dtype(256) == np.uint8
+    assert bin_dtype(257) == np.uint16
+    assert bin_dtype(70000) == np.uint32
+
+
+def test_bin_index_blocks(monkeypatch):
+    from src.iolite import resolution_bins
+
+    d2 = np.random.RandomState(0).uniform(0.0, 1.0, size=(13, 11))
+    index_array = bin_index(d2, 0.0, 1.0, 300)
+
+    # Test output for resolutions binned in small blocks
+    monkeypatch.setattr(resolution_bins, "BLOCK_SIZE", 7)
+    assert np.array_equal(bin_index(d2, 0.0, 1.0, 300), index_array)
+    assert index_array.dtype == np.uint16
+    assert index_array.shape == d2.shape
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+from src.iolite.overlaps.resolution_cache import ResolutionCache
+
+
+class Model:
+    """Stand-in for a dxtbx model that can be written as a dictionary."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def to_dict(self):
+        return {"value": self.value}
+
+
+def test_resolution_cache(tmpdir):
+    # Two arrays of 800 bytes fit into the cache, three do not
+    cache = ResolutionCache(str(tmpdir), 2000)
+    key_1 = cache.key(Model(1), Model(0.9795))
+    key_2 = cache.key(Model(2), Model(0.9795))
+    key_3 = cache.key(Model(3), Model(0.9795))
+    assert key_1 == cache.key(Model(1), Model(0.9795))
+    assert key_1 != key_2
+
+    # Arrays are computed once and then read from the cache
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(100, dtype=np.float64)
+
+    array = cache.get(key_1, "resolution", compute)
+    array = cache.get(key_1, "resolution", compute)
+    assert len(calls) == 1
+    assert isinstance(array, np.memmap)
+    assert np.array_equal(array, np.arange(100))
+
+    # The least recently used entry is evicted
+    cache.store(key_2, "resolution", np.zeros(100))
+    os.utime(os.path.join(str(tmpdir), key_1), (0, 0))
+    cache.store(key_3, "resolution", np.zeros(100))
+    assert cache.load(key_1, "resolution") is None
+    assert cache.load(key_2, "resolution") is not None
+    assert cache.load(key_3, "resolution") is not None
@@ -0,0 +1,24 @@
+import pytest
+import numpy as np
+from src.iolite.overlaps.resolution_map import resolution_map, resolution_map_per_pixel
+
+
+@pytest.mark.parametrize("parallax", [False, True])
+def test_resolution_map(parallax):
+    from dxtbx.model import BeamFactory, DetectorFactory, ParallaxCorrectedPxMmStrategy
+
+    # Generate a small panel with the beam hitting it off-centre
+    beam = BeamFactory.simple(0.9795)
+    detector = DetectorFactory.simple(
+        "PAD", 150.0, (3.1, 2.7), "+x", "-y", (0.172, 0.172), (40, 30), (-1, 1e6)
+    )
+    panel = detector[0]
+    if parallax:
+        panel.set_px_mm_strategy(ParallaxCorrectedPxMmStrategy(3.96, 0.32))
+
+    resolution = resolution_map(panel, beam, 40, 30)
+    reference = resolution_map_per_pixel(panel, beam, 40, 30)
+
+    # Test output
+    assert resolution.shape == (30, 40)
+    assert np.allclose(resolution, reference, rtol=1e-9, atol=0)
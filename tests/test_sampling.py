@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from src.iolite.overlaps.sampling import mean_and_interval, radical_inverse, sample_frames
+
+
+def test_radical_inverse():
+    # Test output
+    assert [radical_inverse(i) for i in range(6)] == [0, 0.5, 0.25, 0.75, 0.125, 0.625]
+
+
+def test_sample_frames():
+    # Test output of an evenly spaced sample of 5%
+    frames = sample_frames(3600, 0.05)
+    assert len(frames) == 180
+    assert frames[0] == 3599
+    assert len(set(frames)) == 180
+    assert np.all(np.diff(np.sort(frames)) >= 20)
+    # every leading part of the sample is spread over the whole dataset
+    assert np.ptp(frames[:8]) > 3000
+
+    # Test output of a random sample
+    frames = sample_frames(100, 0.1, "random")
+    assert len(frames) == 10
+    assert frames[0] == 99
+    assert len(set(frames)) == 10
+    assert np.array_equal(frames, sample_frames(100, 0.1, "random"))
+
+    # Test output of the whole dataset
+    assert sorted(sample_frames(7, 1)) == list(range(7))
+
+    with pytest.raises(ValueError):
+        sample_frames(100, 0.1, "first")
+
+
+def test_mean_and_interval():
+    rng = np.random.RandomState(0)
+    values = rng.uniform(0, 1, size=(50, 4))
+
+    # Test output
+    mean, half_width = mean_and_interval(values, 1000)
+    assert np.allclose(mean, values.mean(axis=0))
+    expected = 1.96 * values.std(axis=0, ddof=1) / np.sqrt(50) * np.sqrt(1 - 50 / 1000)
+    assert np.allclose(half_width, expected, rtol=1e-4)
+
+    # the whole dataset has no sampling error
+    _, half_width = mean_and_interval(values, 50)
+    assert np.all(half_width == 0)
+
+    _, half_width = mean_and_interval(values[:1], 50)
+    assert np.all(np.isinf(half_width))
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from src.iolite.overlaps.shoebox_store import (
+    ShoeboxStore,
+    ShoeboxStoreWriter,
+    clear_store,
+)
+
+
+def random_frame(rng, z, n):
+    x0 = rng.randint(0, 50, n)
+    y0 = rng.randint(0, 50, n)
+    bbox = np.stack(
+        [x0, x0 + rng.randint(1, 8, n), y0, y0 + rng.randint(1, 8, n), [z] * n, [z + 1] * n],
+        1,
+    )
+    masks = [
+        rng.choice([0, 1, 3, 5, 19, 37], size=(1, b[3] - b[2], b[1] - b[0]))
+        for b in bbox
+    ]
+    return bbox, rng.randint(0, 2, n), rng.uniform(1, 3, n), masks
+
+
+def test_shoebox_store(tmpdir):
+    rng = np.random.RandomState(0)
+    directory = str(tmpdir.join("shoeboxes"))
+
+    # write two blocks of images independently, the second one first
+    frames = [random_frame(rng, z, rng.randint(0, 6)) for z in range(12)]
+    for first, last in [(7, 12), (0, 7)]:
+        writer = ShoeboxStoreWriter(directory, first, chunk_size=3)
+        for z in range(first, last):
+            writer.append(*frames[z])
+        writer.close()
+
+    # Test output
+    store = ShoeboxStore(directory)
+    assert len(store) == 12
+    for z, (bbox, panel, d, masks) in enumerate(frames):
+        columns = store.frame_columns(z)
+        assert np.array_equal(columns["bbox"], bbox.reshape(-1, 6))
+        assert np.array_equal(columns["panel"], panel)
+        assert np.array_equal(columns["d"], d)
+        stored_masks = store.frame_masks(z)
+        assert len(stored_masks) == len(masks)
+        for stored, mask in zip(stored_masks, masks):
+            assert np.array_equal(stored, mask)
+
+
+def test_shoebox_store_uint8(tmpdir):
+    rng = np.random.RandomState(1)
+    directory = str(tmpdir.join("shoeboxes"))
+
+    frames = [random_frame(rng, z, 4) for z in range(5)]
+    writer = ShoeboxStoreWriter(directory, 0, mask_dtype=np.uint8)
+    for frame in frames:
+        writer.append(*frame)
+    writer.close()
+
+    # Test output
+    store = ShoeboxStore(directory)
+    for z, (bbox, panel, d, masks) in enumerate(frames):
+        for stored, mask in zip(store.frame_masks(z), masks):
+            assert stored.dtype == np.uint8
+            assert np.array_equal(stored, mask)
+
+    # Test that masks which do not fit are rejected
+    writer = ShoeboxStoreWriter(directory, 5, mask_dtype=np.uint8)
+    with pytest.raises(ValueError):
+        writer.append([[0, 1, 0, 1, 5, 6]], [0], [1.0], [np.array([[[256]]])])
+
+
+def test_shoebox_store_rewrite(tmpdir):
+    rng = np.random.RandomState(2)
+    directory = str(tmpdir.join("shoeboxes"))
+
+    # write a store in chunks of 3 images, then one in a single chunk
+    frames = [random_frame(rng, z, 3) for z in range(6)]
+    for chunk_size in (3, 10):
+        writer = ShoeboxStoreWriter(directory, 0, chunk_size=chunk_size)
+        for frame in frames[:4]:
+            writer.append(*frame)
+        writer.close()
+
+    # Test that the chunks of both stores are rejected
+    with pytest.raises(ValueError):
+        ShoeboxStore(directory)
+
+    # Test output after the earlier store is cleared
+    clear_store(directory)
+    assert tmpdir.join("shoeboxes").listdir() == []
+    writer = ShoeboxStoreWriter(directory, 0, chunk_size=10)
+    for frame in frames[:2]:
+        writer.append(*frame)
+    writer.close()
+    store = ShoeboxStore(directory)
+    assert len(store) == 2
+    assert np.array_equal(store.frame_columns(1)["bbox"], frames[1][0])
@@ -0,0 +1,40 @@
+import numpy as np
+from src.iolite.ice_ring.strong_spots import frame_pixels, strong_spot_pixels
+
+
+def test_strong_spot_pixels():
+    # Generate random shoeboxes, some of them reaching over the image edge
+    rng = np.random.RandomState(0)
+    y_dim, x_dim, num_frames = 30, 40, 6
+    bboxes = []
+    masks = []
+    for i in range(50):
+        x0 = rng.randint(-3, x_dim)
+        y0 = rng.randint(-3, y_dim)
+        z0 = rng.randint(0, num_frames + 1)
+        size = rng.randint(1, 6, 3)
+        bboxes.append((x0, x0 + size[0], y0, y0 + size[1], z0, z0 + size[2]))
+        masks.append(rng.choice([1, 3, 5, 7], size=size[::-1]))
+
+    # Mask the strong spots image by image and shoebox by shoebox
+    expected = np.zeros((num_frames, y_dim, x_dim), dtype=bool)
+    for (x0, x1, y0, y1, z0, z1), mask in zip(bboxes, masks):
+        for z in range(z0, min(z1, num_frames)):
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    if 0 <= y < y_dim and 0 <= x < x_dim:
+                        if mask[z - z0, y - y0, x - x0] == 5:
+                            expected[z, y, x] = True
+
+    # Test output
+    pixels, offsets = strong_spot_pixels(bboxes, masks, y_dim, x_dim, num_frames)
+    assert len(offsets) == num_frames + 1
+    for n in range(num_frames):
+        mask_array = np.zeros((y_dim, x_dim), dtype=bool)
+        mask_array.reshape(-1)[frame_pixels(pixels, offsets, n)] = True
+        assert np.array_equal(mask_array, expected[n])
+
+    # Test output without shoeboxes
+    pixels, offsets = strong_spot_pixels([], [], y_dim, x_dim, num_frames)
+    assert len(pixels) == 0
+    assert offsets.tolist() == [0] * (num_frames + 1)